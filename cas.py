@@ -0,0 +1,96 @@
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+from ihm import print_debug
+import usage
+
+# Content-addressed store of artifacts. An artifact is keyed by the hash of
+# everything it is derived from: the contents of its inputs, the command line
+# (without the paths, which change across directories and machines) and the
+# version of the tool. The store can be shared (e.g. on NFS) between runs,
+# build directories and machines.
+
+CHUNK_SIZE = 1 << 20
+
+# Keyed by (path, mtime, size) so that edited files are hashed again
+@functools.lru_cache(maxsize=None)
+def _file_digest(path: str, mtime: int, size: int) -> str:
+    h = hashlib.sha256()
+    with open(path,'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_digest(path: str) -> str:
+    st = os.stat(path)
+    return _file_digest(os.path.realpath(path), st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version(tool: str) -> str:
+    # polycc drops its temporary files in the current directory, even for
+    # --version: the tool runs in a private scratch directory
+    try:
+        with tempfile.TemporaryDirectory(prefix="version-") as scratch:
+            output, _ = usage.run(
+                [tool, "--version"],
+                text=True,
+                capture_output=True,
+                timeout=30,
+                cwd=scratch
+            )
+        version = output.stdout + output.stderr
+    except (OSError, subprocess.TimeoutExpired) as e:
+        version = ""
+    # Not all the tools know --version: fall back on the executable itself
+    if not version.strip():
+        executable = shutil.which(tool)
+        if executable:
+            version = file_digest(executable)
+    return version
+
+def headers_of(include_dirs: list[str]) -> list[str]:
+    headers = []
+    for d in include_dirs:
+        for root,dirs,files in os.walk(d):
+            headers += [os.path.join(root,f) for f in files if f.endswith('.h')]
+    return sorted(headers)
+
+def key_of(command: str, inputs: list[str]) -> str:
+    h = hashlib.sha256()
+    h.update(command.encode())
+    h.update(toolchain_version(command.split()[0]).encode())
+    for i in inputs:
+        h.update(file_digest(i).encode())
+    return h.hexdigest()
+
+class Store:
+    def __init__(self, directory: str, verbose: bool = False):
+        self.directory = directory
+        self.verbose = verbose
+        os.makedirs(directory, exist_ok=True)
+
+    def path_of(self, key: str) -> str:
+        return f"{self.directory}/{key[:2]}/{key}"
+
+    def fetch(self, key: str, target: str) -> bool:
+        path = self.path_of(key)
+        if not os.path.exists(path):
+            return False
+        shutil.copy2(path, target)
+        print_debug(self.verbose, f"{target} fetched from {path}")
+        return True
+
+    def store(self, key: str, source: str):
+        path = self.path_of(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent writers (other threads or machines) must not see a
+        # partially copied artifact
+        fd,tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        shutil.copy2(source, tmp)
+        os.replace(tmp, path)
+        print_debug(self.verbose, f"{source} stored as {path}")
@@ -1,33 +1,54 @@
+import asyncio
+import codecs
 import subprocess
 import sys, os
+import tempfile
+import threading
+import time
 from typing import Union
 import re
 from ihm import print_debug
+from usage import Usage, ledger, tool_of, spawn, wait4, kill, shutdown
+
+# The children are read by chunks...
+CHUNK_SIZE = 64 * 1024
+# ... and only the end of their output is kept in memory when it goes to a
+# file (the file holds it all)
+TAIL_SIZE = 64 * 1024
 
 
 class Result:
     success: bool
     message: str
+    # The resources consumed by the child, if it ran
+    usage: Usage | None
+    timed_out = False
 
-    def __init__(self, success, message):
+    def __init__(self, success, message, usage=None):
         self.success = success
         self.message = message
+        self.usage = usage
 
 
 class Fail(Result):
-    def __init__(self, message):
-        super().__init__(success=False, message=message)
+    def __init__(self, message, usage=None):
+        super().__init__(success=False, message=message, usage=usage)
 
 
 class Success(Result):
-    def __init__(self, message):
-        super().__init__(success=True, message=message)
+    def __init__(self, message, usage=None):
+        super().__init__(success=True, message=message, usage=usage)
+
+
+class Timeout(Fail):
+    # The message is what the child printed before it was killed
+    timed_out = True
 
 
-def fail(command_list):
+def fail(command_list, usage=None):
     print("! " + " ".join(command_list) + " fails", file=sys.stderr)
     command = " ".join(command_list)
-    return Fail(command)
+    return Fail(command, usage)
 
 
 def remove_color_codes(text):
@@ -35,7 +56,86 @@ def remove_color_codes(text):
     return ansi_escape.sub("", text)
 
 
-def execute(
+class _Sink:
+    # Cleans the output of a child line by line (escape sequences never span
+    # lines), and sends it to a file and/or to memory
+
+    def __init__(self, file, keep: bool, tail_size: int | None):
+        self.file = file
+        self.keep = keep
+        self.tail_size = tail_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.pending = ""
+        self.kept: list[str] = []
+        self.kept_size = 0
+
+    def feed(self, data: bytes, final: bool = False):
+        text = self.pending + self.decoder.decode(data, final)
+        cut = len(text) if final else text.rfind("\n") + 1
+        # A line without an end (e.g. a progress bar) is not kept forever
+        if cut == 0 and len(text) > CHUNK_SIZE:
+            cut = len(text)
+        lines, self.pending = text[:cut], text[cut:]
+        if lines:
+            self._emit(remove_color_codes(lines))
+
+    def _emit(self, text: str):
+        if self.file:
+            self.file.write(text)
+        if self.keep:
+            self.kept.append(text)
+            self.kept_size += len(text)
+            if self.tail_size is not None and self.kept_size > 2 * self.tail_size:
+                self.kept = ["".join(self.kept)[-self.tail_size :]]
+                self.kept_size = self.tail_size
+
+    def text(self) -> str:
+        text = "".join(self.kept)
+        return text if self.tail_size is None else text[-self.tail_size :]
+
+
+async def _pump(stream: asyncio.StreamReader, sink: _Sink):
+    while chunk := await stream.read(CHUNK_SIZE):
+        sink.feed(chunk)
+    sink.feed(b"", final=True)
+
+
+async def _reader(loop: asyncio.AbstractEventLoop, pipe):
+    reader = asyncio.StreamReader(limit=CHUNK_SIZE, loop=loop)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe
+    )
+    return reader, transport
+
+
+class _Child:
+    # A child spawned by Popen, but reaped by wait4 (see usage.py) and waited
+    # for by the event loop
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, process: subprocess.Popen):
+        self.process = process
+        self.start = time.monotonic()
+        self.exited = loop.create_future()
+        self.usage: Usage | None = None
+
+        def on_exit(status, rusage):
+            loop.call_soon_threadsafe(self._exited, status, rusage)
+
+        wait4(process.pid, on_exit)
+
+    def _exited(self, status, rusage):
+        self.process.returncode = os.waitstatus_to_exitcode(status)
+        self.usage = Usage.of(rusage, time.monotonic() - self.start)
+        self.exited.set_result(self.process.returncode)
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self.exited)
+
+    def kill(self):
+        kill(self.process.pid)
+
+
+async def execute_async(
     command_list: list[str],
     message_if_success: str = "",
     timeout: int | None = None,
@@ -43,34 +143,129 @@ def execute(
     env_vars: dict[str, str] = {},
     capture_output=True,
     debug: bool = False,
-):
+    cwd: str | None = None,
+    tail_size: int = TAIL_SIZE,
+) -> Result:
+    # The command is executed without a shell, in its own process group
+    # (killed as a whole on timeout). With target_file, its output (stdout,
+    # then stderr) is streamed to the file, which only appears if the command
+    # completes (<target_file>.part keeps what a timed out command printed),
+    # and the message is the end of it.
     env_str = ""
     for k in env_vars:
         env_str += f"{k}={env_vars[k]} "
+    print_debug(debug, env_str + " ".join(command_list))
 
-    command = env_str + " ".join(command_list)
-    print_debug(debug, command)
-
+    redirected = capture_output or target_file != None
+    loop = asyncio.get_running_loop()
     try:
-        output = subprocess.run(
-            command,
-            shell=True,
-            text=True,
-            capture_output=capture_output,
-            timeout = timeout
+        popen = spawn(
+            command_list,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if redirected else None,
+            stderr=subprocess.PIPE if redirected else None,
+            env={**os.environ, **env_vars},
+            cwd=cwd,
         )
-    except subprocess.CalledProcessError as e:
+    except OSError:
         return fail(command_list)
-    except subprocess.TimeoutExpired as e:
-        return fail(["Timeout:"] + command_list)
+    process = _Child(loop, popen)
+    if not redirected:
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            fail(["Timeout:"] + command_list)
+            return Timeout("", process.usage)
+        return Success(message_if_success, process.usage)
+
+    tail = tail_size if target_file else None
+    partial = f"{target_file}.part" if target_file else None
+    out_file = open(partial, "w") if partial else None
+    # stderr is spilled to disk until stdout is complete
+    err_file = tempfile.TemporaryFile("w+") if target_file else None
+    out = _Sink(out_file, capture_output, tail)
+    err = _Sink(err_file, capture_output, tail)
+    stdout, stdout_transport = await _reader(loop, popen.stdout)
+    stderr, stderr_transport = await _reader(loop, popen.stderr)
+    timed_out = False
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(_pump(stdout, out), _pump(stderr, err), process.wait()),
+            timeout,
+        )
+    except asyncio.TimeoutError:
+        timed_out = True
+        process.kill()
+        await process.wait()
+        stdout_transport.close()
+        stderr_transport.close()
+        out.feed(b"", final=True)
+        err.feed(b"", final=True)
+    if out_file:
+        err_file.seek(0)
+        while chunk := err_file.read(CHUNK_SIZE):
+            out_file.write(chunk)
+        err_file.close()
+        out_file.close()
+        if not timed_out:
+            os.replace(partial, target_file)
+    if timed_out:
+        fail(["Timeout:"] + command_list)
+        return Timeout(out.text() + err.text(), process.usage)
     if capture_output:
-        tmp_result = output.stdout + output.stderr
-        result = remove_color_codes(tmp_result)
-        res = Success(result)
-    else:
-        res = Success(message_if_success)
-    if target_file:
-        f = open(target_file, "w")
-        f.write(res.message)
-        f.close()
-    return res
+        return Success(out.text() + err.text(), process.usage)
+    return Success(message_if_success, process.usage)
+
+
+# A single event loop supervises the children of all the threads
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="execute", daemon=True
+            ).start()
+    return _loop
+
+
+def execute(
+    command_list: list[str],
+    message_if_success: str = "",
+    timeout: int | None = None,
+    target_file: str | None = None,
+    env_vars: dict[str, str] = {},
+    capture_output=True,
+    debug: bool = False,
+    cwd: str | None = None,
+    tail_size: int = TAIL_SIZE,
+) -> Result:
+    future = asyncio.run_coroutine_threadsafe(
+        execute_async(
+            command_list=command_list,
+            message_if_success=message_if_success,
+            timeout=timeout,
+            target_file=target_file,
+            env_vars=env_vars,
+            capture_output=capture_output,
+            debug=debug,
+            cwd=cwd,
+            tail_size=tail_size,
+        ),
+        _event_loop(),
+    )
+    try:
+        result = future.result()
+    except KeyboardInterrupt:
+        shutdown()
+        raise
+    # Accounted on the calling thread, to the stage of its task
+    if result.usage:
+        ledger.record(tool_of(command_list), result.usage)
+    return result
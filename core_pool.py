@@ -0,0 +1,71 @@
+import contextlib
+import glob
+import os
+import queue
+import shutil
+
+# Pool of isolated cores on which measurements run one at a time. Each
+# measurement reserves a core, is pinned on it and allocates its memory on
+# the NUMA node of the core.
+
+SYSFS_CPU = "/sys/devices/system/cpu"
+
+def parse_cpu_list(text: str) -> set[int]:
+    # "0-3,8,10-11"
+    cpus = set()
+    for chunk in text.strip().split(','):
+        if not chunk:
+            continue
+        if '-' in chunk:
+            first,last = chunk.split('-')
+            cpus.update(range(int(first),int(last) + 1))
+        else:
+            cpus.add(int(chunk))
+    return cpus
+
+def siblings_of(core: int) -> set[int]:
+    path = f"{SYSFS_CPU}/cpu{core}/topology/thread_siblings_list"
+    if not os.path.exists(path):
+        return {core}
+    with open(path,'r') as f:
+        return parse_cpu_list(f.read())
+
+def numa_node_of(core: int) -> int:
+    nodes = glob.glob(f"{SYSFS_CPU}/cpu{core}/node*")
+    if not nodes:
+        return 0
+    return int(os.path.basename(nodes[0])[len("node"):])
+
+def sibling_conflicts(cores: list[int]) -> list[tuple[int,int]]:
+    conflicts = []
+    for i,c in enumerate(cores):
+        for d in cores[i + 1:]:
+            if d in siblings_of(c):
+                conflicts.append((c,d))
+    return conflicts
+
+def pinned(command_list: list[str], core: int, node: int) -> list[str]:
+    if shutil.which("numactl"):
+        return ["numactl", f"--physcpubind={core}", f"--membind={node}"] + command_list
+    elif shutil.which("taskset"):
+        return ["taskset", "-c", str(core)] + command_list
+    return command_list
+
+class CorePool:
+    def __init__(self, cores: list[int]):
+        conflicts = sibling_conflicts(cores)
+        if conflicts:
+            raise ValueError(f"Cores {conflicts} are sibling hyperthreads")
+        self.cores = cores
+        self.nodes = {c: numa_node_of(c) for c in cores}
+        self.free: queue.Queue[int] = queue.Queue()
+        for c in cores:
+            self.free.put(c)
+
+    @contextlib.contextmanager
+    def reserve(self):
+        core = self.free.get()
+        try:
+            yield core,self.nodes[core]
+        finally:
+            self.free.put(core)
@@ -0,0 +1,115 @@
+import heapq
+import os
+import sqlite3
+import statistics
+import time
+
+from ihm import print_debug
+from usage import FIELDS, Usage
+
+# Wall times of the previous runs of each job, keyed by the basename of what
+# it produces (<kernel>.<version>.<compiler>) and by its tool (the stage:
+# gus, sens, perf...). Only the jobs which actually ran their tool are
+# recorded: a cache hit says nothing about a real run. They drive the order in which jobs are started
+# (longest expected first), their timeouts and the estimated makespan.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS durations (
+    blueprint TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    correct INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS durations_by_job ON durations (blueprint, tool);
+CREATE TABLE IF NOT EXISTS usages (
+    blueprint TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    children INTEGER NOT NULL,
+    wall REAL NOT NULL,
+    user REAL NOT NULL,
+    sys REAL NOT NULL,
+    max_rss INTEGER NOT NULL,
+    minor_faults INTEGER NOT NULL,
+    major_faults INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+"""
+
+# Only the most recent runs of a job are representative
+RECENT_RUNS = 10
+# A job is given this many times its longest successful run, but never less
+# than its default timeout
+TIMEOUT_FACTOR = 3
+
+def kernel_of(blueprint: str) -> str:
+    return blueprint.split('.')[0]
+
+class History:
+    def __init__(self, path: str, verbose: bool = False):
+        self.verbose = verbose
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, blueprint: str, tool: str, seconds: float, correct: bool):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO durations VALUES (?, ?, ?, ?, ?)",
+                (blueprint, tool, seconds, int(correct), time.time())
+            )
+
+    def record_usage(self, blueprint: str, tool: str, usage: Usage):
+        # The resources consumed by the children of the job (see usage.py)
+        with self.connection:
+            self.connection.execute(
+                f"INSERT INTO usages VALUES (?, ?, {', '.join('?' * len(FIELDS))}, ?)",
+                (blueprint, tool, *(getattr(usage, n) for n in FIELDS), time.time())
+            )
+
+    def _recent(self, blueprint: str, tool: str) -> list[float]:
+        rows = self.connection.execute(
+            "SELECT seconds FROM durations WHERE blueprint = ? AND tool = ? AND correct = 1 ORDER BY recorded_at DESC LIMIT ?",
+            (blueprint, tool, RECENT_RUNS)
+        )
+        return [s for s, in rows]
+
+    def expected(self, blueprint: str, tool: str) -> float | None:
+        recent = self._recent(blueprint, tool)
+        if recent:
+            return max(recent)
+        # Never ran: the other versions of the same kernel are a fair guess
+        prefix = kernel_of(blueprint) + "."
+        rows = self.connection.execute(
+            "SELECT seconds FROM durations WHERE substr(blueprint, 1, ?) = ? AND tool = ? AND correct = 1",
+            (len(prefix), prefix, tool)
+        )
+        similar = [s for s, in rows]
+        if similar:
+            return statistics.median(similar)
+        return None
+
+    def timeout(self, blueprint: str, tool: str, default: int) -> int:
+        recent = self._recent(blueprint, tool)
+        if not recent:
+            return default
+        timeout = max(default, int(TIMEOUT_FACTOR * max(recent)) + 1)
+        print_debug(self.verbose, f"{blueprint} ({tool}): timeout {timeout}s from history")
+        return timeout
+
+def history_key(name: str, tool: str) -> str:
+    # (/build/2mm.pocc.gcc.gus, gus) -> 2mm.pocc.gcc
+    bb = os.path.basename(name)
+    suffix = f".{tool}"
+    if bb.endswith(suffix):
+        return bb[:-len(suffix)]
+    return bb
+
+def lpt_makespan(durations: list[float], workers: int) -> float:
+    # Independent jobs started longest first on a pool of workers
+    ends = [0.0] * workers
+    for d in sorted(durations, reverse=True):
+        heapq.heappush(ends, heapq.heappop(ends) + d)
+    return max(ends)
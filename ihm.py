@@ -1,4 +1,6 @@
 import argparse
+import os
+import shlex
 import sys
 from typing import Union
 
@@ -51,7 +53,7 @@ def get_args():
         "--linker-options",
         nargs="*",
         default=["-lm"],
-        help="The options to feed the linker with",
+        help="The options to feed the linker with (each one split as the shell would)",
     )
     parser.add_argument(
         "--build-directory",
@@ -77,6 +79,29 @@ def get_args():
         default="16777216",
         help="The size in bytes, kilobytes (k), megabytes (m) or gigabytes (g) of the L2 cache.",
     )
+    parser.add_argument(
+        "--perf-format",
+        choices=["table", "csv"],
+        default="table",
+        help="Scrape perf stat's table, or read its field-separated output (with the TopdownL1 metrics and the multiplexing of every event)",
+    )
+    parser.add_argument(
+        "--tma-level",
+        type=int,
+        choices=[1, 2, 3],
+        default=1,
+        help="Drill down to this level of the top-down hierarchy, only below the bottlenecks of the level above (requires --perf-format csv)",
+    )
+    parser.add_argument(
+        "--kernel-window",
+        action="store_true",
+        help="Count only during the kernel, which enables perf's counters through its control FIFO (compile with -DPOLYBENCH_PERF_CTL and link with polybench.c)",
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Build each benchmark as a shared object too, and count its kernel with perf-pipedream from a measurement worker (requires --always-link-with polybench.c and libperf-pipedream.so)",
+    )
     parser.add_argument(
         "--tma-scope-install-dir",
         type=str,
@@ -98,15 +123,45 @@ def get_args():
     parser.add_argument(
         "--use-cache", action="store_true", help="Cache intermediate files"
     )
+    parser.add_argument(
+        "--cas-dir",
+        type=str,
+        default=None,
+        help="The content-addressed store of versions, binaries and Gus reports (supersedes --use-cache)",
+    )
     parser.add_argument(
         "--reuse-perf-reports", action="store_true", help="Reuse perf reports"
     )
+    parser.add_argument(
+        "--reports-index",
+        type=str,
+        default=None,
+        help="The index of the parsed reports (default: <reports-directory>/report_index.sqlite)",
+    )
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=None,
+        help="The database of the durations of the previous runs (default: <reports-directory>/history.sqlite)",
+    )
     parser.add_argument(
         "--csv-output",
         type=str,
         default=None,
         help="The CSV file in which write the results",
     )
+    parser.add_argument(
+        "--families-output",
+        type=str,
+        default=None,
+        help="The CSV file in which write the aggregates of the results per family (original benchmark) and compiler",
+    )
+    parser.add_argument(
+        "--usage-output",
+        type=str,
+        default=None,
+        help="The CSV file in which write the resources consumed by the child processes (wall, user, sys, max RSS, page faults), by stage and by tool",
+    )
     parser.add_argument(
         "--sample", type=int, default=0, help="Sample N blueprints (don't sample if 0)"
     )
@@ -124,6 +179,37 @@ def get_args():
         default=0,
         help="The core on which perf should run"
     )
+    parser.add_argument(
+        "--repetitions-min",
+        type=int,
+        default=1,
+        help="Min number of measurements of each binary",
+    )
+    parser.add_argument(
+        "--repetitions-max",
+        type=int,
+        default=1,
+        help="Max number of measurements of each binary",
+    )
+    parser.add_argument(
+        "--ci-target",
+        type=float,
+        default=0.01,
+        help="Repeat until the half-width of the confidence interval of the cycles (relative) and of the top-down fractions (absolute) is below this",
+    )
+    parser.add_argument(
+        "--ci-level",
+        type=float,
+        default=0.95,
+        help="The confidence level of the intervals",
+    )
+    parser.add_argument(
+        "--perf-cores",
+        nargs="+",
+        type=int,
+        default=None,
+        help="The isolated cores on which concurrent measurements run (one per core, no sibling hyperthreads)",
+    )
     parser.add_argument(
         "--enable-gus", action="store_true", help="Enable Gus detailed report"
     )
@@ -132,16 +218,74 @@ def get_args():
         action="store_true",
         help="Enable Gus sensitivity report",
     )
+    parser.add_argument(
+        "--sens-jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Max number of concurrent Gus sensitivity reports",
+    )
+    parser.add_argument(
+        "--render-pdf",
+        action="store_true",
+        help="Render the PDF of the sensitivity reports",
+    )
     parser.add_argument(
         "--use-huge-pages",
         action="store_true",
         help="Perf uses huge pages",
     )
+    parser.add_argument(
+        "--huge-pages",
+        choices=["thp", "hugetlb"],
+        default=None,
+        help="Allocate the arrays of the benchmarks on transparent huge pages, or on those of the hugetlb pool (falling back to transparent ones), through POLYBENCH_HUGE_PAGES (requires to link with polybench.c or polybench_stub.c)",
+    )
+    parser.add_argument(
+        "--fuzz-jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Max number of concurrent Pluto runs",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=str,
+        default=None,
+        help="The directory in which to create the private working directories of the Pluto and sensitivity runs",
+    )
+    parser.add_argument(
+        "--compile-jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Max number of concurrent compilations",
+    )
+    parser.add_argument(
+        "--gus-jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Max number of concurrent Gus detailed reports",
+    )
     parser.add_argument("--debug", action="store_true", help="Print debug messages")
     parser.add_argument(
         "--verbose-output", action="store_true", help="Print results on stdout"
     )
     args = parser.parse_args()
+    # e.g. --linker-options '-lm -Lperfpipedream/build-static -lpapi': the
+    # compiler is not run through a shell anymore
+    args.linker_options = [o for l in args.linker_options for o in shlex.split(l)]
     if args.fool_gus is not None and args.enable_sensitivity is None:
         parser.error("--fool-gus requires --enable-sensitivity")
+    if args.kernel_window and args.tma_scope_install_dir:
+        parser.error("--kernel-window and --tma-scope-install-dir are exclusive")
+    if args.huge_pages and args.use_huge_pages:
+        parser.error("--huge-pages and --use-huge-pages are exclusive")
+    if args.in_process and not args.always_link_with:
+        parser.error("--in-process requires --always-link-with")
+    if args.in_process and (
+        args.kernel_window or args.tma_scope_install_dir or args.tma_level > 1
+    ):
+        parser.error(
+            "--in-process excludes --kernel-window, --tma-scope-install-dir and --tma-level"
+        )
+    if args.tma_level > 1 and args.perf_format != "csv":
+        parser.error("--tma-level requires --perf-format csv")
     return args
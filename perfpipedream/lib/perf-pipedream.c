@@ -1,10 +1,14 @@
+#define _GNU_SOURCE
 #include <asm/unistd.h>
+#include <dirent.h>
 #include <limits.h>
+#include <link.h>
 #include <linux/perf_event.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <sys/ioctl.h>
+#include <sys/mman.h>
 #include <alloca.h>
 #include <unistd.h>
 
@@ -62,22 +66,47 @@ const char *PERFPIPEDREAM_EVENTS_NAME[] = {
     "PERFPIPEDREAM_NO_EVENT",
     "PAPI_TOT_CYC",
     "PAPI_TOT_INS",
+    "TOPDOWN_SLOTS",
+    "TOPDOWN_RETIRING",
+    "TOPDOWN_BAD_SPEC",
+    "TOPDOWN_FE_BOUND",
+    "TOPDOWN_BE_BOUND",
 };
 
-const int PERFPIPEDREAM_NUM_EVENTS = 3;
+const int PERFPIPEDREAM_NUM_EVENTS = 8;
+
+#define TOPDOWN_SLOTS_IDX 3
 
 typedef struct {
     int fd;
+    // Index of the event in the event set (the slots lead the group)
+    int res_idx;
+    // Index of the leader of its group in RUNNING_PE_CONFIG: the members
+    // of a group follow their leader
+    int leader;
 } s_perf_event_config_t;
 
+// The events of every counted thread, one thread after the other
 struct perf_event_attr **RUNNING_PE = NULL;
 s_perf_event_config_t **RUNNING_PE_CONFIG = NULL;
 int NUM_RUNNING_PE = 0;
+// The counted threads
+pid_t *RUNNING_TIDS = NULL;
+int NUM_RUNNING_THREADS = 0;
 
 // Array of array of events or `EVENTSET_FREE`
 int **ALL_EVENT_SET = NULL;
 // Number of events for each event set
 int *NUM_PE = NULL;
+// Whether each event set is multiplexed: one group per event (but the
+// topdown metrics, which stay with the slots) instead of a single group
+int *MULTIPLEX = NULL;
+// Sampling period of the leader of each event set (0 if only counting), and
+// the PERFPIPEDREAM_SAMPLE_* flags
+unsigned long long *SAMPLE_PERIOD = NULL;
+int *SAMPLE_FLAGS = NULL;
+// The PERFPIPEDREAM_THREADS_* mode of each event set
+int *THREADS = NULL;
 // Total maximal number of event set
 int NUM_EVENT_SET = 0;
 
@@ -86,7 +115,185 @@ int TRAP = 0;
 int IS_INIT = 0;
 int RUNNING = 0;
 
-static int event_idx_to_config(int idx, __u64 *config) {
+// The samples of the running event set are written by the kernel in a ring
+// buffer (a metadata page, then a power of two of data pages), and drained
+// into histograms on read and stop. They are dumped at shutdown.
+#define SAMPLE_DEFAULT_DATA_PAGES 64
+#define SAMPLE_DEFAULT_PATH "perf-pipedream.samples"
+#define SAMPLE_FILE_MAGIC "PPDSMPL1"
+
+typedef struct {
+    // Instruction pointer, or source and target of a branch
+    __u64 from;
+    __u64 to;
+    __u64 count;
+} s_histogram_entry_t;
+
+typedef struct {
+    s_histogram_entry_t *entries;
+    // A power of two, or 0
+    size_t size;
+    size_t used;
+} s_histogram_t;
+
+void *RING = NULL;
+size_t RING_DATA_SIZE = 0;
+s_histogram_t IP_HISTOGRAM = {NULL, 0, 0};
+s_histogram_t BRANCH_HISTOGRAM = {NULL, 0, 0};
+__u64 LOST_SAMPLES = 0;
+unsigned long long LAST_SAMPLE_PERIOD = 0;
+
+// Type of the core PMU, which counts the topdown events (cpu_core on hybrid
+// parts)
+static __u32 core_pmu_type() {
+    const char *paths[] = {
+        "/sys/bus/event_source/devices/cpu_core/type",
+        "/sys/bus/event_source/devices/cpu/type",
+    };
+    for (unsigned int i = 0; i < sizeof(paths) / sizeof(*paths); ++i) {
+        FILE *f = fopen(paths[i], "r");
+        unsigned int type;
+        if (f == NULL)
+            continue;
+        int n = fscanf(f, "%u", &type);
+        fclose(f);
+        if (n == 1)
+            return type;
+    }
+    return PERF_TYPE_RAW;
+}
+
+static void histogram_add(s_histogram_t *histogram, __u64 from, __u64 to) {
+    // Open addressing, at most half full
+    if (2 * (histogram->used + 1) > histogram->size) {
+        s_histogram_t grown = {NULL, histogram->size ? 2 * histogram->size : 1024, 0};
+        grown.entries = calloc(grown.size, sizeof(*grown.entries));
+        for (size_t i = 0; i < histogram->size; ++i) {
+            s_histogram_entry_t *e = &histogram->entries[i];
+            if (e->count == 0)
+                continue;
+            size_t h = (e->from * 0x9E3779B97F4A7C15ull ^ e->to) & (grown.size - 1);
+            while (grown.entries[h].count != 0)
+                h = (h + 1) & (grown.size - 1);
+            grown.entries[h] = *e;
+            grown.used++;
+        }
+        free(histogram->entries);
+        *histogram = grown;
+    }
+    size_t h = (from * 0x9E3779B97F4A7C15ull ^ to) & (histogram->size - 1);
+    while (histogram->entries[h].count != 0 &&
+           (histogram->entries[h].from != from || histogram->entries[h].to != to))
+        h = (h + 1) & (histogram->size - 1);
+    if (histogram->entries[h].count == 0) {
+        histogram->entries[h].from = from;
+        histogram->entries[h].to = to;
+        histogram->used++;
+    }
+    histogram->entries[h].count++;
+}
+
+static void histogram_free(s_histogram_t *histogram) {
+    free(histogram->entries);
+    histogram->entries = NULL;
+    histogram->size = 0;
+    histogram->used = 0;
+}
+
+static void ring_copy(void *dst, __u64 offset, size_t size) {
+    const char *data = (const char *)RING + sysconf(_SC_PAGESIZE);
+    size_t start = offset & (RING_DATA_SIZE - 1);
+    size_t first = size < RING_DATA_SIZE - start ? size : RING_DATA_SIZE - start;
+    memcpy(dst, data + start, first);
+    memcpy((char *)dst + first, data, size - first);
+}
+
+// Moves the records written by the kernel since the last call into the
+// histograms
+static void drain_samples() {
+    if (RING == NULL)
+        return;
+    struct perf_event_mmap_page *meta = RING;
+    __u64 head = __atomic_load_n(&meta->data_head, __ATOMIC_ACQUIRE);
+    __u64 tail = meta->data_tail;
+    // The size of a record fits in 16 bits
+    static __u64 record[(1 << 16) / sizeof(__u64)];
+    while (tail < head) {
+        struct perf_event_header header;
+        ring_copy(&header, tail, sizeof(header));
+        if (header.size < sizeof(header))
+            break;
+        ring_copy(record, tail, header.size);
+        // The fields follow the header: { ip, [bnr, { from, to, flags }[bnr]] }
+        __u64 *fields = record + sizeof(header) / sizeof(__u64);
+        if (header.type == PERF_RECORD_SAMPLE) {
+            histogram_add(&IP_HISTOGRAM, fields[0], 0);
+            if (header.size > sizeof(header) + sizeof(__u64)) {
+                __u64 bnr = fields[1];
+                struct perf_branch_entry *branches = (struct perf_branch_entry *)&fields[2];
+                for (__u64 b = 0; b < bnr; ++b)
+                    histogram_add(&BRANCH_HISTOGRAM, branches[b].from, branches[b].to);
+            }
+        } else if (header.type == PERF_RECORD_LOST) {
+            // { id, lost }
+            LOST_SAMPLES += fields[1];
+        }
+        tail += header.size;
+    }
+    __atomic_store_n(&meta->data_tail, tail, __ATOMIC_RELEASE);
+}
+
+static int load_bias_callback(struct dl_phdr_info *info, size_t size, void *data) {
+    (void)size;
+    // The first object is the executable
+    *(__u64 *)data = info->dlpi_addr;
+    return 1;
+}
+
+// The file (PERF_PIPEDREAM_SAMPLES, or perf-pipedream.samples) holds, in
+// native 64-bit words: the magic, the load bias of the executable (to
+// subtract from the addresses), the sampling period, the number of lost
+// samples, the numbers of instruction pointers and of branches, then
+// { ip, count } for each instruction pointer and { from, to, count } for
+// each branch.
+static void dump_samples() {
+    if (IP_HISTOGRAM.used == 0 && BRANCH_HISTOGRAM.used == 0)
+        return;
+    const char *path = getenv("PERF_PIPEDREAM_SAMPLES");
+    if (path == NULL)
+        path = SAMPLE_DEFAULT_PATH;
+    FILE *f = fopen(path, "wb");
+    if (f == NULL) {
+        fprintf(stderr, "perf_pipedream: cannot write the samples to %s\n", path);
+        return;
+    }
+    __u64 load_bias = 0;
+    dl_iterate_phdr(load_bias_callback, &load_bias);
+    __u64 header[] = {load_bias, LAST_SAMPLE_PERIOD, LOST_SAMPLES,
+                      IP_HISTOGRAM.used, BRANCH_HISTOGRAM.used};
+    fwrite(SAMPLE_FILE_MAGIC, 1, 8, f);
+    fwrite(header, sizeof(*header), sizeof(header) / sizeof(*header), f);
+    for (size_t i = 0; i < IP_HISTOGRAM.size; ++i) {
+        s_histogram_entry_t *e = &IP_HISTOGRAM.entries[i];
+        if (e->count != 0) {
+            __u64 entry[] = {e->from, e->count};
+            fwrite(entry, sizeof(*entry), 2, f);
+        }
+    }
+    for (size_t i = 0; i < BRANCH_HISTOGRAM.size; ++i) {
+        s_histogram_entry_t *e = &BRANCH_HISTOGRAM.entries[i];
+        if (e->count != 0) {
+            __u64 entry[] = {e->from, e->to, e->count};
+            fwrite(entry, sizeof(*entry), 3, f);
+        }
+    }
+    fclose(f);
+    VERBOSE(DEBUG, "dump_samples(): %zu ips, %zu branches, %llu lost in %s",
+            IP_HISTOGRAM.used, BRANCH_HISTOGRAM.used, (unsigned long long)LOST_SAMPLES, path);
+}
+
+static int event_idx_to_config(int idx, __u32 *type, __u64 *config) {
+    *type = PERF_TYPE_HARDWARE;
     switch (idx) {
         // 0 is reserved as an end marker of the event list
     case 1: // PAPI_TOT_CYCLE
@@ -95,6 +302,19 @@ static int event_idx_to_config(int idx, __u64 *config) {
     case 2: // PAPI_TOT_INS
         *config = PERF_COUNT_HW_INSTRUCTIONS;
         return PERFPIPEDREAM_SUCCESS;
+    // Ice Lake and later: the slots, and the topdown metrics (read as a
+    // number of slots), which must be in a group led by the slots
+    case TOPDOWN_SLOTS_IDX: // TOPDOWN_SLOTS
+        *type = core_pmu_type();
+        *config = 0x0400;
+        return PERFPIPEDREAM_SUCCESS;
+    case 4: // TOPDOWN_RETIRING
+    case 5: // TOPDOWN_BAD_SPEC
+    case 6: // TOPDOWN_FE_BOUND
+    case 7: // TOPDOWN_BE_BOUND
+        *type = core_pmu_type();
+        *config = 0x8000 + 0x100 * (idx - 4);
+        return PERFPIPEDREAM_SUCCESS;
     default:
         *config = 0;
         return PERFPIPEDREAM_ENO_EVENT_IDX;
@@ -140,6 +360,14 @@ const char *perf_pipedream_strerror(int errcode) {
         return ("Event set is currently running");
     case PERFPIPEDREAM_EEVENTSET_NULL:
         return ("Event set is not initialized");
+    case PERFPIPEDREAM_EREAD:
+        return ("Error occured during the read of the counters");
+    case PERFPIPEDREAM_ETOPDOWN_NO_SLOTS:
+        return ("Topdown metrics require TOPDOWN_SLOTS in the event set");
+    case PERFPIPEDREAM_EMMAP:
+        return ("Error occured during the mmap of the sample buffer");
+    case PERFPIPEDREAM_ETHREADS:
+        return ("Error occured while listing the threads of the process");
     default:
         return ("Unknown error. Something *real bad* happened here");
     }
@@ -153,6 +381,23 @@ static long perf_event_open(struct perf_event_attr *hw_event, pid_t pid, int cpu
     return ret;
 }
 
+// The threads of the process, in RUNNING_TIDS
+static int list_threads() {
+    DIR *dir = opendir("/proc/self/task");
+    if (dir == NULL)
+        return PERFPIPEDREAM_ETHREADS;
+    struct dirent *entry;
+    while ((entry = readdir(dir)) != NULL) {
+        if (entry->d_name[0] == '.')
+            continue;
+        NUM_RUNNING_THREADS++;
+        RUNNING_TIDS = realloc(RUNNING_TIDS, sizeof(*RUNNING_TIDS) * NUM_RUNNING_THREADS);
+        RUNNING_TIDS[NUM_RUNNING_THREADS - 1] = atoi(entry->d_name);
+    }
+    closedir(dir);
+    return NUM_RUNNING_THREADS > 0 ? PERFPIPEDREAM_SUCCESS : PERFPIPEDREAM_ETHREADS;
+}
+
 int perf_pipedream_library_init(int version) {
     DEBUG = getenv("PERF_PIPEDREAM_DEBUG") != NULL;
     TRAP = getenv("PERF_PIPEDREAM_TRAP") != NULL;
@@ -172,6 +417,10 @@ void perf_pipedream_shutdown() {
     if (RUNNING) {
         perf_pipedream_stop(RUNNING, NULL);
     }
+    dump_samples();
+    histogram_free(&IP_HISTOGRAM);
+    histogram_free(&BRANCH_HISTOGRAM);
+    LOST_SAMPLES = 0;
     for (int i = 0; i < NUM_EVENT_SET; ++i) {
         if (ALL_EVENT_SET[i] != EVENTSET_FREE) {
             free(ALL_EVENT_SET[i]);
@@ -182,6 +431,14 @@ void perf_pipedream_shutdown() {
     ALL_EVENT_SET = NULL;
     free(NUM_PE);
     NUM_PE = NULL;
+    free(MULTIPLEX);
+    MULTIPLEX = NULL;
+    free(SAMPLE_PERIOD);
+    SAMPLE_PERIOD = NULL;
+    free(SAMPLE_FLAGS);
+    SAMPLE_FLAGS = NULL;
+    free(THREADS);
+    THREADS = NULL;
     NUM_EVENT_SET = 0;
     IS_INIT = 0;
 }
@@ -214,6 +471,10 @@ int perf_pipedream_create_eventset(int *event_set) {
         if (ALL_EVENT_SET[i] == EVENTSET_FREE) {
             ALL_EVENT_SET[i] = NULL;
             NUM_PE[i] = 0;
+            MULTIPLEX[i] = 0;
+            SAMPLE_PERIOD[i] = 0;
+            SAMPLE_FLAGS[i] = 0;
+            THREADS[i] = PERFPIPEDREAM_THREADS_CALLER;
             *event_set = i + 1;
             goto success;
         }
@@ -222,8 +483,16 @@ int perf_pipedream_create_eventset(int *event_set) {
     *event_set = NUM_EVENT_SET;
     ALL_EVENT_SET = realloc(ALL_EVENT_SET, sizeof(*ALL_EVENT_SET) * NUM_EVENT_SET);
     NUM_PE = realloc(NUM_PE, sizeof(*NUM_PE) * NUM_EVENT_SET);
+    MULTIPLEX = realloc(MULTIPLEX, sizeof(*MULTIPLEX) * NUM_EVENT_SET);
+    SAMPLE_PERIOD = realloc(SAMPLE_PERIOD, sizeof(*SAMPLE_PERIOD) * NUM_EVENT_SET);
+    SAMPLE_FLAGS = realloc(SAMPLE_FLAGS, sizeof(*SAMPLE_FLAGS) * NUM_EVENT_SET);
+    THREADS = realloc(THREADS, sizeof(*THREADS) * NUM_EVENT_SET);
     ALL_EVENT_SET[NUM_EVENT_SET - 1] = NULL;
     NUM_PE[NUM_EVENT_SET - 1] = 0;
+    MULTIPLEX[NUM_EVENT_SET - 1] = 0;
+    SAMPLE_PERIOD[NUM_EVENT_SET - 1] = 0;
+    SAMPLE_FLAGS[NUM_EVENT_SET - 1] = 0;
+    THREADS[NUM_EVENT_SET - 1] = PERFPIPEDREAM_THREADS_CALLER;
 
  success:
     VERBOSE(DEBUG, "perf_pipedream_create_event_set(%p) => event_set: %d", event_set, *event_set);
@@ -299,6 +568,38 @@ int perf_pipedream_remove_event(int event_set, int event_idx) {
     return PERFPIPEDREAM_SUCCESS;
 }
 
+// Closes and frees what perf_pipedream_start opened, so far: no event set
+// is running anymore
+static void release_running(void) {
+    if (RING != NULL) {
+        munmap(RING, sysconf(_SC_PAGESIZE) + RING_DATA_SIZE);
+        RING = NULL;
+    }
+    // The members before their leaders
+    for (int i = NUM_RUNNING_PE - 1; i >= 0; --i) {
+        if (RUNNING_PE_CONFIG[i]->fd != -1)
+            close(RUNNING_PE_CONFIG[i]->fd);
+        free(RUNNING_PE_CONFIG[i]);
+        free(RUNNING_PE[i]);
+    }
+
+    free(RUNNING_PE);
+    RUNNING_PE = NULL;
+    free(RUNNING_PE_CONFIG);
+    RUNNING_PE_CONFIG = NULL;
+    NUM_RUNNING_PE = 0;
+    free(RUNNING_TIDS);
+    RUNNING_TIDS = NULL;
+    NUM_RUNNING_THREADS = 0;
+    RUNNING = 0;
+}
+
+// A failed start leaves nothing running nor open
+static int start_failed(int errcode) {
+    release_running();
+    return MAY_TRAP(TRAP, errcode);
+}
+
 int perf_pipedream_start(int event_set) {
     VERBOSE(DEBUG, "perf_pipedream_start(%d)", event_set);
     if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
@@ -311,18 +612,63 @@ int perf_pipedream_start(int event_set) {
     if (UNFREQUENT(RUNNING))
         return MAY_TRAP(TRAP, PERFPIPEDREAM_EALREADY_RUNNING);
 
+    int *events = ALL_EVENT_SET[event_set];
+    int num_events = NUM_PE[event_set];
+    unsigned long long sample_period = SAMPLE_PERIOD[event_set];
+    // The leader samples the whole group, of the calling thread only
+    int multiplex = MULTIPLEX[event_set] && sample_period == 0;
+    int threads = sample_period == 0 ? THREADS[event_set] : PERFPIPEDREAM_THREADS_CALLER;
+    // The events are opened as a group, so that they are enabled, disabled
+    // and read at once. The slots must lead it if there are topdown metrics.
+    // A multiplexed event set has one group per event instead, so that the
+    // kernel can rotate them on the counters.
+    // Opening order: the slots, the topdown metrics, then the others.
+    int *order = alloca(sizeof(int) * (num_events + 1));
+    int num_ordered = 0;
+    int has_slots = 0;
+    int has_topdown_metrics = 0;
+    for (int i = 0; i < num_events; ++i)
+        if (events[i] == TOPDOWN_SLOTS_IDX) {
+            order[num_ordered++] = i;
+            has_slots = 1;
+        }
+    for (int i = 0; i < num_events; ++i)
+        if (events[i] > TOPDOWN_SLOTS_IDX) {
+            order[num_ordered++] = i;
+            has_topdown_metrics = 1;
+        }
+    for (int i = 0; i < num_events; ++i)
+        if (events[i] < TOPDOWN_SLOTS_IDX)
+            order[num_ordered++] = i;
+    if (has_topdown_metrics && !has_slots)
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_ETOPDOWN_NO_SLOTS);
+
     RUNNING = event_set + 1;
     NUM_RUNNING_PE = 0;
+    NUM_RUNNING_THREADS = 0;
+    // The groups are opened for every thread, which pass them on to the
+    // threads they create unless only the caller is counted
+    if (threads == PERFPIPEDREAM_THREADS_ALL) {
+        int errcode = list_threads();
+        if (errcode != PERFPIPEDREAM_SUCCESS)
+            return start_failed(errcode);
+    } else {
+        NUM_RUNNING_THREADS = 1;
+        RUNNING_TIDS = realloc(RUNNING_TIDS, sizeof(*RUNNING_TIDS));
+        RUNNING_TIDS[0] = syscall(__NR_gettid);
+    }
 
-    int *events = ALL_EVENT_SET[event_set];
-    int num_events = NUM_PE[event_set];
-    for (int i = 0; i < num_events; ++i) {
-        {
+    for (int t = 0; t < NUM_RUNNING_THREADS; ++t) {
+        for (int n = 0; n < num_events; ++n) {
+            int i = order[n];
             int event_idx = events[i];
+            int first = t * num_events;
+            int leader = first + (multiplex && event_idx <= TOPDOWN_SLOTS_IDX ? n : 0);
+            __u32 type;
             __u64 config;
-            int errcode = event_idx_to_config(event_idx, &config);
+            int errcode = event_idx_to_config(event_idx, &type, &config);
             if (errcode != PERFPIPEDREAM_SUCCESS)
-                return MAY_TRAP(TRAP, errcode);
+                return start_failed(errcode);
             NUM_RUNNING_PE++;
             RUNNING_PE = (struct perf_event_attr **)realloc(
                                                             RUNNING_PE, sizeof(struct perf_event_attr *) * NUM_RUNNING_PE);
@@ -330,27 +676,62 @@ int perf_pipedream_start(int event_set) {
             RUNNING_PE[NUM_RUNNING_PE - 1] = pe;
 
             memset(pe, 0, sizeof(*pe));
-            pe->type = PERF_TYPE_HARDWARE;
+            pe->type = type;
             pe->size = sizeof(*pe);
-            pe->disabled = 1;
+            // The members follow their leader
+            pe->disabled = leader == first + n;
+            pe->inherit = threads != PERFPIPEDREAM_THREADS_CALLER;
             pe->exclude_kernel = 1;
             pe->exclude_hv = 1;
             pe->config = config;
+            // The time each group was counting, to scale it when multiplexed
+            pe->read_format = PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED |
+                PERF_FORMAT_TOTAL_TIME_RUNNING;
+            if (n == 0 && sample_period != 0) {
+                pe->sample_period = sample_period;
+                pe->sample_type = PERF_SAMPLE_IP;
+                if (SAMPLE_FLAGS[event_set] & PERFPIPEDREAM_SAMPLE_BRANCH_STACK) {
+                    pe->sample_type |= PERF_SAMPLE_BRANCH_STACK;
+                    pe->branch_sample_type = PERF_SAMPLE_BRANCH_ANY | PERF_SAMPLE_BRANCH_USER;
+                }
+            }
 
             RUNNING_PE_CONFIG = (s_perf_event_config_t **)realloc(
                                                                   RUNNING_PE_CONFIG, sizeof(s_perf_event_config_t *) * NUM_RUNNING_PE);
             RUNNING_PE_CONFIG[NUM_RUNNING_PE - 1] = malloc(sizeof(s_perf_event_config_t));
             s_perf_event_config_t *pe_config = RUNNING_PE_CONFIG[NUM_RUNNING_PE - 1];
-            pe_config->fd = perf_event_open(pe, 0, -1, -1, 0);
+            int group_fd = leader == first + n ? -1 : RUNNING_PE_CONFIG[leader]->fd;
+            pe_config->fd = perf_event_open(pe, RUNNING_TIDS[t], -1, group_fd, 0);
+            pe_config->res_idx = i;
+            pe_config->leader = leader;
             if (pe_config->fd == -1)
-                return MAY_TRAP(TRAP, PERFPIPEDREAM_EPERF_OPEN);
+                return start_failed(PERFPIPEDREAM_EPERF_OPEN);
         }
     }
-    for (int i = 0; i < NUM_RUNNING_PE; ++i)
-        ioctl(RUNNING_PE_CONFIG[i]->fd, PERF_EVENT_IOC_RESET, 0);
-
-    for (int i = 0; i < NUM_RUNNING_PE; ++i)
-        ioctl(RUNNING_PE_CONFIG[i]->fd, PERF_EVENT_IOC_ENABLE, 0);
+    if (sample_period != 0 && NUM_RUNNING_PE > 0) {
+        long page_size = sysconf(_SC_PAGESIZE);
+        const char *pages = getenv("PERF_PIPEDREAM_SAMPLE_PAGES");
+        size_t data_pages = pages != NULL ? strtoul(pages, NULL, 10) : SAMPLE_DEFAULT_DATA_PAGES;
+        // The kernel wants a power of two
+        while (data_pages & (data_pages - 1))
+            data_pages &= data_pages - 1;
+        if (data_pages == 0)
+            data_pages = 1;
+        RING_DATA_SIZE = data_pages * page_size;
+        RING = mmap(NULL, page_size + RING_DATA_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED,
+                    RUNNING_PE_CONFIG[0]->fd, 0);
+        if (RING == MAP_FAILED) {
+            RING = NULL;
+            return start_failed(PERFPIPEDREAM_EMMAP);
+        }
+        LAST_SAMPLE_PERIOD = sample_period;
+    }
+    for (int i = 0; i < NUM_RUNNING_PE; ++i) {
+        if (RUNNING_PE_CONFIG[i]->leader != i)
+            continue;
+        ioctl(RUNNING_PE_CONFIG[i]->fd, PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP);
+        ioctl(RUNNING_PE_CONFIG[i]->fd, PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP);
+    }
 
     if (UNFREQUENT(DEBUG)) {
         int *fds = alloca(sizeof(int)*NUM_RUNNING_PE);
@@ -365,6 +746,48 @@ int perf_pipedream_start(int event_set) {
     return PERFPIPEDREAM_SUCCESS;
 }
 
+// One read of a leader returns its whole group (summed over the threads
+// which inherited it):
+// { nr, time_enabled, time_running, values[nr] }
+// The groups of the threads [first, last) are summed. With `ratio`, the
+// values are scaled by time_enabled / time_running, and time_running /
+// time_enabled is stored in `ratio` (0 if the group never counted, 1 if it
+// was never multiplexed).
+static int read_group(int first, int last, long_long res[], double ratio[]) {
+    int num_events = NUM_RUNNING_PE / NUM_RUNNING_THREADS;
+    __u64 *values = alloca(sizeof(__u64) * (num_events + 3));
+    double *scaled = alloca(sizeof(double) * num_events);
+    __u64 *enabled = alloca(sizeof(__u64) * num_events);
+    __u64 *running = alloca(sizeof(__u64) * num_events);
+    memset(scaled, 0, sizeof(double) * num_events);
+    memset(enabled, 0, sizeof(__u64) * num_events);
+    memset(running, 0, sizeof(__u64) * num_events);
+    for (int i = first * num_events; i < last * num_events;) {
+        int nr = 1;
+        while (i + nr < NUM_RUNNING_PE && RUNNING_PE_CONFIG[i + nr]->leader == i)
+            nr++;
+        size_t size = sizeof(__u64) * (nr + 3);
+        if (read(RUNNING_PE_CONFIG[i]->fd, values, size) != (ssize_t)size)
+            return PERFPIPEDREAM_EREAD;
+        for (int j = 0; j < nr; ++j) {
+            int res_idx = RUNNING_PE_CONFIG[i + j]->res_idx;
+            enabled[res_idx] += values[1];
+            running[res_idx] += values[2];
+            if (ratio == NULL)
+                scaled[res_idx] += values[j + 3];
+            else if (values[2] != 0)
+                scaled[res_idx] += (double)values[j + 3] * values[1] / values[2];
+        }
+        i += nr;
+    }
+    for (int e = 0; e < num_events; ++e) {
+        res[e] = (long_long)scaled[e];
+        if (ratio != NULL)
+            ratio[e] = running[e] == 0 ? 0. : (double)running[e] / enabled[e];
+    }
+    return PERFPIPEDREAM_SUCCESS;
+}
+
 int perf_pipedream_stop(int event_set, long_long res[]) {
     VERBOSE(DEBUG, "perf_pipedream_stop(%d, %p)", event_set, res);
     if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
@@ -377,34 +800,30 @@ int perf_pipedream_stop(int event_set, long_long res[]) {
     if (UNFREQUENT(RUNNING != event_set + 1))
         return MAY_TRAP(TRAP, PERFPIPEDREAM_ENOT_RUNNING);
 
+    int errcode = PERFPIPEDREAM_SUCCESS;
+    // The groups are frozen, then read
+    for (int i = 0; i < NUM_RUNNING_PE; ++i)
+        if (RUNNING_PE_CONFIG[i]->leader == i)
+            ioctl(RUNNING_PE_CONFIG[i]->fd, PERF_EVENT_IOC_DISABLE, PERF_IOC_FLAG_GROUP);
+    drain_samples();
+    if (RING != NULL) {
+        munmap(RING, sysconf(_SC_PAGESIZE) + RING_DATA_SIZE);
+        RING = NULL;
+    }
     if (res != NULL) {
-        for (int i = 0; i < NUM_RUNNING_PE; ++i) {
-            read(RUNNING_PE_CONFIG[i]->fd, res + i, sizeof(*res));
-        }
+        errcode = read_group(0, NUM_RUNNING_THREADS, res, NULL);
         if (UNFREQUENT(DEBUG)) {
             const char *buffer = SPRINT_LIST(alloca(sizeof(char)*4096),
                                              4096,
-                                             NUM_RUNNING_PE,
+                                             NUM_RUNNING_PE / NUM_RUNNING_THREADS,
                                              res);
             VERBOSE(DEBUG, "perf_pipedream_stop(%d, %p): results: {%s}", event_set + 1, res, buffer);
         }
     }
 
-    for (int i = 0; i < NUM_RUNNING_PE; ++i) {
-        ioctl(RUNNING_PE_CONFIG[i]->fd, PERF_EVENT_IOC_DISABLE, 0);
-        close(RUNNING_PE_CONFIG[i]->fd);
-        free(RUNNING_PE_CONFIG[i]);
-        free(RUNNING_PE[i]);
-    }
+    release_running();
 
-    free(RUNNING_PE);
-    RUNNING_PE = NULL;
-    free(RUNNING_PE_CONFIG);
-    RUNNING_PE_CONFIG = NULL;
-    NUM_RUNNING_PE = 0;
-    RUNNING = 0;
-
-    return PERFPIPEDREAM_SUCCESS;
+    return MAY_TRAP(TRAP, errcode);
 }
 
 int perf_pipedream_read(int event_set, long_long res[]) {
@@ -419,14 +838,15 @@ int perf_pipedream_read(int event_set, long_long res[]) {
     if (UNFREQUENT(RUNNING != event_set + 1))
         return MAY_TRAP(TRAP, PERFPIPEDREAM_ENOT_RUNNING);
 
+    drain_samples();
     if (res != NULL) {
-        for (int i = 0; i < NUM_RUNNING_PE; ++i) {
-            read(RUNNING_PE_CONFIG[i]->fd, res + i, sizeof(*res));
-        }
+        int errcode = read_group(0, NUM_RUNNING_THREADS, res, NULL);
+        if (errcode != PERFPIPEDREAM_SUCCESS)
+            return MAY_TRAP(TRAP, errcode);
         if (UNFREQUENT(DEBUG)) {
             const char *buffer = SPRINT_LIST(alloca(sizeof(char)*4096),
                                              4096,
-                                             NUM_RUNNING_PE,
+                                             NUM_RUNNING_PE / NUM_RUNNING_THREADS,
                                              res);
             VERBOSE(DEBUG, "perf_pipedream_read(%d, %p): results: {%s}", event_set + 1, res, buffer);
         }
@@ -435,6 +855,111 @@ int perf_pipedream_read(int event_set, long_long res[]) {
     return PERFPIPEDREAM_SUCCESS;
 }
 
+int perf_pipedream_read_scaled(int event_set, long_long res[], double ratio[]) {
+    VERBOSE(DEBUG, "perf_pipedream_read_scaled(%d, %p, %p)", event_set, res, ratio);
+    if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NULL);
+    event_set--;
+    if (UNFREQUENT(event_set < 0) ||
+	UNFREQUENT(event_set >= NUM_EVENT_SET) ||
+	UNFREQUENT(ALL_EVENT_SET[event_set] == EVENTSET_FREE))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NOTFOUND);
+    if (UNFREQUENT(RUNNING != event_set + 1))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_ENOT_RUNNING);
+
+    if (res != NULL) {
+        double *scale = ratio != NULL ? ratio : alloca(sizeof(double) * NUM_RUNNING_PE);
+        int errcode = read_group(0, NUM_RUNNING_THREADS, res, scale);
+        if (errcode != PERFPIPEDREAM_SUCCESS)
+            return MAY_TRAP(TRAP, errcode);
+        if (UNFREQUENT(DEBUG)) {
+            const char *buffer = SPRINT_LIST(alloca(sizeof(char)*4096),
+                                             4096,
+                                             NUM_RUNNING_PE / NUM_RUNNING_THREADS,
+                                             res);
+            VERBOSE(DEBUG, "perf_pipedream_read_scaled(%d, %p, %p): results: {%s}", event_set + 1, res, ratio, buffer);
+        }
+    }
+
+    return PERFPIPEDREAM_SUCCESS;
+}
+
+// The values of each counted thread, one thread after the other, scaled as
+// perf_pipedream_read_scaled. `*num_threads` is the capacity of `tids`
+// (and of `res` and `ratio`, in threads) on input, and the number of
+// counted threads on output.
+int perf_pipedream_read_threads(int event_set, int *num_threads, int tids[], long_long res[], double ratio[]) {
+    VERBOSE(DEBUG, "perf_pipedream_read_threads(%d, %p, %p, %p, %p)", event_set, num_threads, tids, res, ratio);
+    if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NULL);
+    event_set--;
+    if (UNFREQUENT(event_set < 0) ||
+	UNFREQUENT(event_set >= NUM_EVENT_SET) ||
+	UNFREQUENT(ALL_EVENT_SET[event_set] == EVENTSET_FREE))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NOTFOUND);
+    if (UNFREQUENT(RUNNING != event_set + 1))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_ENOT_RUNNING);
+
+    int num_events = NUM_PE[event_set];
+    double *scale = alloca(sizeof(double) * num_events);
+    for (int t = 0; t < *num_threads && t < NUM_RUNNING_THREADS; ++t) {
+        tids[t] = RUNNING_TIDS[t];
+        int errcode = read_group(t, t + 1, res + t * num_events,
+                                 ratio != NULL ? ratio + t * num_events : scale);
+        if (errcode != PERFPIPEDREAM_SUCCESS)
+            return MAY_TRAP(TRAP, errcode);
+    }
+    VERBOSE(DEBUG, "perf_pipedream_read_threads(%d, %p, %p, %p, %p) => num_threads: %d", event_set + 1, num_threads, tids, res, ratio, NUM_RUNNING_THREADS);
+    *num_threads = NUM_RUNNING_THREADS;
+    return PERFPIPEDREAM_SUCCESS;
+}
+
+int perf_pipedream_set_multiplex(int event_set) {
+    VERBOSE(DEBUG, "perf_pipedream_set_multiplex(%d)", event_set);
+    if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NULL);
+    if (UNFREQUENT(RUNNING == event_set))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENT_SET_RUNNING);
+    event_set--;
+    if (UNFREQUENT(event_set < 0) ||
+	UNFREQUENT(event_set >= NUM_EVENT_SET) ||
+	UNFREQUENT(ALL_EVENT_SET[event_set] == EVENTSET_FREE))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NOTFOUND);
+    MULTIPLEX[event_set] = 1;
+    return PERFPIPEDREAM_SUCCESS;
+}
+
+int perf_pipedream_set_sampling(int event_set, unsigned long long period, int flags) {
+    VERBOSE(DEBUG, "perf_pipedream_set_sampling(%d, %llu, %d)", event_set, period, flags);
+    if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NULL);
+    if (UNFREQUENT(RUNNING == event_set))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENT_SET_RUNNING);
+    event_set--;
+    if (UNFREQUENT(event_set < 0) ||
+	UNFREQUENT(event_set >= NUM_EVENT_SET) ||
+	UNFREQUENT(ALL_EVENT_SET[event_set] == EVENTSET_FREE))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NOTFOUND);
+    SAMPLE_PERIOD[event_set] = period;
+    SAMPLE_FLAGS[event_set] = flags;
+    return PERFPIPEDREAM_SUCCESS;
+}
+
+int perf_pipedream_set_threads(int event_set, int mode) {
+    VERBOSE(DEBUG, "perf_pipedream_set_threads(%d, %d)", event_set, mode);
+    if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NULL);
+    if (UNFREQUENT(RUNNING == event_set))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENT_SET_RUNNING);
+    event_set--;
+    if (UNFREQUENT(event_set < 0) ||
+	UNFREQUENT(event_set >= NUM_EVENT_SET) ||
+	UNFREQUENT(ALL_EVENT_SET[event_set] == EVENTSET_FREE))
+        return MAY_TRAP(TRAP, PERFPIPEDREAM_EEVENTSET_NOTFOUND);
+    THREADS[event_set] = mode;
+    return PERFPIPEDREAM_SUCCESS;
+}
+
 int perf_pipedream_cleanup_eventset(int event_set) {
     VERBOSE(DEBUG, "perf_pipedream_cleanup_event_set(%d)", event_set);
     if (UNFREQUENT(event_set == PERFPIPEDREAM_NULL))
@@ -449,6 +974,10 @@ int perf_pipedream_cleanup_eventset(int event_set) {
     free(ALL_EVENT_SET[event_set]);
     ALL_EVENT_SET[event_set] = NULL;
     NUM_PE[event_set] = 0;
+    MULTIPLEX[event_set] = 0;
+    SAMPLE_PERIOD[event_set] = 0;
+    SAMPLE_FLAGS[event_set] = 0;
+    THREADS[event_set] = PERFPIPEDREAM_THREADS_CALLER;
     return PERFPIPEDREAM_SUCCESS;
 }
 
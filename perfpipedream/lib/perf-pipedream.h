@@ -15,9 +15,23 @@
 #define PERFPIPEDREAM_EEVENT_NOT_IN_SET (-12)
 #define PERFPIPEDREAM_EEVENT_SET_RUNNING (-13)
 #define PERFPIPEDREAM_EEVENTSET_NULL (-14)
+#define PERFPIPEDREAM_EREAD (-15)
+#define PERFPIPEDREAM_ETOPDOWN_NO_SLOTS (-16)
+#define PERFPIPEDREAM_EMMAP (-17)
+#define PERFPIPEDREAM_ETHREADS (-18)
 
 #define PERFPIPEDREAM_NULL (-1)
 
+// Flags of perf_pipedream_set_sampling
+#define PERFPIPEDREAM_SAMPLE_BRANCH_STACK (1)
+
+// Modes of perf_pipedream_set_threads: the calling thread only, the calling
+// thread and the threads it creates while running, or every thread of the
+// process (and the threads they create while running)
+#define PERFPIPEDREAM_THREADS_CALLER (0)
+#define PERFPIPEDREAM_THREADS_INHERIT (1)
+#define PERFPIPEDREAM_THREADS_ALL (2)
+
 #define long_long long long
 
 const char *perf_pipedream_strerror(int errcode);
@@ -31,6 +45,11 @@ int perf_pipedream_remove_event(int event_set, int event_idx);
 int perf_pipedream_start(int event_set);
 int perf_pipedream_read(int event_set, long long res[]);
 int perf_pipedream_stop(int event_set, long long res[]);
+int perf_pipedream_read_scaled(int event_set, long long res[], double ratio[]);
+int perf_pipedream_set_multiplex(int event_set);
+int perf_pipedream_set_sampling(int event_set, unsigned long long period, int flags);
+int perf_pipedream_set_threads(int event_set, int mode);
+int perf_pipedream_read_threads(int event_set, int *num_threads, int tids[], long long res[], double ratio[]);
 int perf_pipedream_cleanup_eventset(int event_set);
 int perf_pipedream_destroy_eventset(int *event_set);
 void perf_pipedream_shutdown();
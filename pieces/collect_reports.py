@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+import pandas
+
+# The reports are parsed and indexed as shifumi.py does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from helpers import print_warning, read_commands_conf
+from report_index import ReportIndex, indexed, blueprint_of
+from text import RawText
+import wrappers
+from results import odd_bottlenecks_between
+
+REPORT_KINDS = ["perf", "gus", "sens"]
+
+def parse_report(path: str):
+    blueprint,kind = blueprint_of(path)
+    if kind == "perf":
+        with open(path,'r',errors='replace') as f:
+            text = f.read()
+        # Written by --perf-format table or csv, or in process (as csv)
+        perf_format = wrappers.perf_format_of(text)
+        return wrappers.tam_report_of(text,perf_format,blueprint,False,RawText(path))
+    elif kind == "gus":
+        return wrappers.gus_report_of(path,blueprint)
+    return wrappers.sens_report_of(path,blueprint)
+
+def main():
+    #
+    parser = argparse.ArgumentParser(
+        description="Gather the perf and Gus reports of a directory into a CSV file.",
+        epilog = '''Example:
+        ./collect_reports.py --reports-dir __reports__ --csv-output full_report.csv --verbose
+        '''
+    )
+    parser.add_argument(
+        "--reports-dir",
+        type=str,
+        help="The directory containing the reports",
+        required=True,
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="The index of the parsed reports, shared with shifumi.py (default: <reports-dir>/report_index.sqlite)",
+    )
+    parser.add_argument(
+        "--csv-output",
+        type=str,
+        default=None,
+        help="The CSV file in which write the results",
+    )
+    parser.add_argument(
+        "--compilers-conf",
+        type=str,
+        default=None,
+        help="The compilers used, to compare each version with its original and flag the suspicious bottlenecks",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print stuff",
+    )
+    args = parser.parse_args()
+    if not os.path.exists(args.reports_dir):
+        parser.error(f"{args.reports_dir} does not exist.")
+    db = args.db if args.db else f"{args.reports_dir}/report_index.sqlite"
+    # Only the new or modified reports are parsed
+    index = ReportIndex(db)
+    reports = {}
+    for f in sorted(os.listdir(args.reports_dir)):
+        radical,ext = os.path.splitext(f)
+        if ext[1:] in REPORT_KINDS:
+            path = f"{args.reports_dir}/{f}"
+            reports[blueprint_of(path)] = indexed(index,path,True,lambda: parse_report(path))
+    index.close()
+    # One row per blueprint
+    rows: dict[str,dict] = {}
+    for (blueprint,kind),r in reports.items():
+        row = rows.setdefault(blueprint, {
+            "blueprint": blueprint,
+            "kernel": "kernel_" + blueprint.split('.')[0].replace('-','_'),
+        })
+        row[f"{kind}.success"] = r.success
+        for m,v in (r.metrics or {}).items():
+            row[f"{kind}.{m}"] = v
+        if r.bottlenecks is not None:
+            row[f"{kind}.bottlenecks"] = ";".join(r.bottlenecks)
+    # Bottlenecks more saturated in a version which is faster than the
+    # original
+    if args.compilers_conf:
+        compilers = read_commands_conf(args.compilers_conf)
+        for (blueprint,kind),r in reports.items():
+            if kind != "perf" or not r.success:
+                continue
+            for cc in compilers:
+                if not blueprint.endswith(f".{cc}"):
+                    continue
+                original = blueprint.split('.')[0] + f".{cc}"
+                reference = reports.get((original,"perf"))
+                if original != blueprint and reference and reference.success:
+                    suspicious = odd_bottlenecks_between(reference,r)
+                    rows[blueprint]["perf.suspicious"] = ";".join(suspicious)
+    df = pandas.DataFrame(list(rows.values()))
+    print_warning(args.verbose, f"{len(df)} blueprints")
+    if args.csv_output:
+        df.to_csv(args.csv_output,index=False)
+    else:
+        df.to_csv(sys.stdout,index=False)
+
+if __name__ == "__main__":
+    main()
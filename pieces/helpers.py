@@ -1,6 +1,7 @@
-import subprocess
 import sys
 
+import usage
+
 def print_warning(debug: bool, warning: str):
     if debug:
         print(warning,file=sys.stderr)
@@ -8,25 +9,51 @@ def print_warning(debug: bool, warning: str):
 def run_command_output_free(
         command: str,
         timeout: int,
+        cwd: str | None = None,
 ):
-    subprocess.run(
+    completed, _ = usage.run(
         command,
         shell=True,
         text=True,
         capture_output=False,
-        timeout = timeout
+        timeout = timeout,
+        check = True,
+        cwd = cwd
     )
 
 def run_command(
         command: str,
         timeout: int,
+        cwd: str | None = None,
 ) -> (str,str) :
      #   
-    output = subprocess.run(
+    output, _ = usage.run(
         command,
         shell=True,
         text=True,
         capture_output=True,
-        timeout = timeout
+        timeout = timeout,
+        cwd = cwd
     )
     return output.stdout,output.stderr
+
+def read_sources_conf(path: str) -> list[str]:
+    # Lines are "<source> [<kernel>]"
+    sources = []
+    with open(path,'r') as f:
+        for l in f.readlines():
+            l = l.strip()
+            if l and not l.startswith('#'):
+                sources.append(l.split()[0])
+    return sources
+
+def read_commands_conf(path: str) -> dict[str,str]:
+    # Lines are "<name>=<command>"
+    commands = {}
+    with open(path,'r') as f:
+        for l in f.readlines():
+            l = l.strip()
+            if l and not l.startswith('#') and '=' in l:
+                splitted = l.split('=')
+                commands[splitted[0]] = "=".join(splitted[1:])
+    return commands
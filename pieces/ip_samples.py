@@ -0,0 +1,73 @@
+import struct
+import subprocess
+from collections import Counter
+from dataclasses import dataclass, field
+
+# The histograms of instruction pointers (and of branches) dumped at shutdown
+# by perf-pipedream's sampling event sets, mapped back to the source lines
+# with the debug info of the executable (addr2line).
+
+MAGIC = b"PPDSMPL1"
+WORD = struct.Struct("=Q")
+
+
+@dataclass
+class IpSamples:
+    # To subtract from the addresses (executables are position independent)
+    load_bias: int
+    period: int
+    lost: int
+    ips: dict[int, int] = field(default_factory=dict)
+    branches: dict[tuple[int, int], int] = field(default_factory=dict)
+
+
+def read_ip_samples(path: str) -> IpSamples:
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a perf-pipedream sample file")
+    words = struct.unpack_from(f"={(len(data) - len(MAGIC)) // 8}Q", data, len(MAGIC))
+    load_bias, period, lost, n_ips, n_branches = words[:5]
+    rest = words[5:]
+    ips = {rest[2 * i]: rest[2 * i + 1] for i in range(n_ips)}
+    rest = rest[2 * n_ips :]
+    branches = {
+        (rest[3 * i], rest[3 * i + 1]): rest[3 * i + 2] for i in range(n_branches)
+    }
+    return IpSamples(load_bias, period, lost, ips, branches)
+
+
+def addr2line(executable: str, addresses: list[int]) -> list[str]:
+    # One "file:line" (or "??:0") per address
+    if not addresses:
+        return []
+    output = subprocess.run(
+        ["addr2line", "-e", executable],
+        input="\n".join(hex(a) for a in addresses),
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    ).stdout
+    # e.g. "gemm.c:97 (discriminator 3)"
+    return [line.split(" ")[0] for line in output.splitlines()]
+
+
+def source_lines(executable: str, samples: IpSamples) -> Counter:
+    # Samples per "file:line"
+    addresses = list(samples.ips)
+    lines = addr2line(executable, [a - samples.load_bias for a in addresses])
+    histogram = Counter()
+    for address, line in zip(addresses, lines):
+        histogram[line] += samples.ips[address]
+    return histogram
+
+
+def source_branches(executable: str, samples: IpSamples) -> Counter:
+    # Taken branches per ("file:line", "file:line") of their source and target
+    pairs = list(samples.branches)
+    flat = [a - samples.load_bias for pair in pairs for a in pair]
+    lines = addr2line(executable, flat)
+    histogram = Counter()
+    for i, pair in enumerate(pairs):
+        histogram[(lines[2 * i], lines[2 * i + 1])] += samples.branches[pair]
+    return histogram
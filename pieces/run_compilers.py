@@ -1,11 +1,83 @@
 #!/usr/bin/env python3
 
+from typing import Tuple
 import argparse
 import os
 import sys
 import subprocess
+import tempfile
+
+# The building blocks shared with shifumi.py (usage accounting, CAS,
+# scheduler...)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 from helpers import print_warning, run_command_output_free
+from cas import Store, key_of, headers_of
+
+def library_it(name,command,args) -> Tuple[bool,str]:
+    # The --compile-with sources are the same for every benchmark: they are
+    # built once per compiler into a static library, the benchmarks being
+    # then linked against it
+    target = f"{args.target_dir}/libsupport.{name}.a"
+    includes = " ".join([f"-I {d}" for d in args.include_dirs])
+    store = None
+    if args.cas_dir:
+        store = Store(args.cas_dir,args.debug)
+        inputs = args.compile_with + headers_of(args.include_dirs)
+        key = key_of(f"{command} -c",inputs)
+        if store.fetch(key,target):
+            return True,target
+    # ar would add the objects to an existing archive
+    if os.path.exists(target):
+        os.remove(target)
+    with tempfile.TemporaryDirectory(prefix="lib-") as scratch:
+        objects = [f"{scratch}/{n}.o" for n in range(len(args.compile_with))]
+        commands = [
+            f"{command} {includes} -c {source} -o {obj}"
+            for source,obj in zip(args.compile_with,objects)
+        ]
+        commands.append(f"ar rcs {target} {' '.join(objects)}")
+        for full_command in commands:
+            try:
+                run_command_output_free(full_command,args.timeout)
+            except subprocess.CalledProcessError as e:
+                print_warning(args.debug,f"Failure: {full_command}")
+                return False,target
+            except subprocess.TimeoutExpired as e:
+                print_warning(args.debug,f"Timeout: {full_command}")
+                return False,target
+    if store:
+        store.store(key,target)
+    return True,target
+
+def compile_it(source,name,command,args,library=None) -> Tuple[bool,str]:
+    basename = os.path.basename(source)
+    radical,ext = os.path.splitext(basename)
+    # Binaries are named <radical>.<version>.<compiler>, like in __build__
+    target = f"{args.target_dir}/{radical}.{name}"
+    compile_with = [library] if library else args.compile_with
+    aux_c = " ".join(compile_with)
+    includes = " ".join([f"-I {d}" for d in args.include_dirs])
+    linker_options = " ".join(args.linker_options)
+    full_command = f"{command} {source} {aux_c} {includes} -o {target} {linker_options}"
+    store = None
+    if args.cas_dir:
+        store = Store(args.cas_dir,args.debug)
+        inputs = [source] + compile_with + headers_of(args.include_dirs)
+        key = key_of(f"{command} {linker_options}",inputs)
+        if store.fetch(key,target):
+            return True,target
+    try:
+        run_command_output_free(full_command,args.timeout)
+    except subprocess.CalledProcessError as e:
+        print_warning(args.debug,f"Failure: {command}")
+        return False,target
+    except subprocess.TimeoutExpired as e:
+        print_warning(args.debug,f"Timeout: {command}")
+        return False,target
+    if store:
+        store.store(key,target)
+    return True,target
 
 def main():
     #
@@ -50,6 +122,12 @@ def main():
         default=[],
         help="The directories where header files live",
     )
+    parser.add_argument(
+        "--cas-dir",
+        type=str,
+        default=None,
+        help="The content-addressed store of artifacts",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -114,21 +192,17 @@ def main():
             parser.error(f"{args.target_dir} does not exist.")
     #
     num_errors = 0
+    libraries = {}
+    for f,c in fuzzers.items():
+        libraries[f] = None
+        if args.compile_with:
+            correct,libraries[f] = library_it(f,c,args)
+            if not correct:
+                parser.error(f"{libraries[f]} cannot be built.")
     for s in sources_filenames:
-        basename = os.path.basename(s)
-        radical,ext = os.path.splitext(basename)
         for f,c in fuzzers.items():
-            target = f"{args.target_dir}/{radical}.{f}{ext}"
-            try:
-                aux_c = " ".join(args.compile_with)
-                includes = "-I " + "-I ".join(args.include_dirs)
-                command = f"{c} {s} {aux_c} {includes} -o {target} {args.linker_options}"
-                run_command_output_free(command,args.timeout)
-            except subprocess.CalledProcessError as e:
-                print_warning(args.debug,f"Failure: {c}")
-                num_errors += 1
-            except subprocess.TimeoutExpired as e:
-                print_warning(args.debug,f"Timeout: {c}")
+            correct,target = compile_it(s,f,c,args,libraries[f])
+            if not correct:
                 num_errors += 1
     print_warning(args.debug,f"Total number of errors: {num_errors}")
 
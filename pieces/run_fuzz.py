@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+from typing import Tuple
+import argparse
+import os
+import shutil
+import sys
+import subprocess
+import tempfile
+import concurrent.futures
+
+# The building blocks shared with shifumi.py (usage accounting, CAS,
+# scheduler...)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from helpers import print_warning, run_command_output_free, read_sources_conf, read_commands_conf
+from cas import Store, key_of, headers_of
+
+def fuzz_it(source,name,command,args) -> Tuple[bool,str]:
+    # Target path
+    basename = os.path.basename(source)
+    radical,ext = os.path.splitext(basename)
+    target = f"{args.target_dir}/{radical}.{name}{ext}"
+    store = None
+    if args.cas_dir:
+        store = Store(args.cas_dir,args.verbose)
+        # The headers are copied next to the source (see below)
+        headers = headers_of([os.path.dirname(source) or "."] + args.include_dirs)
+        key = key_of(f"{command} -o",[source] + headers)
+        if store.fetch(key,target):
+            return True,target
+    elif args.use_cache and os.path.exists(target):
+        print_warning(args.verbose, f"{target} reloaded from disk")
+        return True,target
+    # Pluto drops its temporary files in the current directory: each job
+    # runs in a private scratch directory holding the source and the headers
+    with tempfile.TemporaryDirectory(prefix="fuzz-",dir=args.scratch_dir) as scratch:
+        headers_dirs = [os.path.dirname(source) or "."] + args.include_dirs
+        for d in headers_dirs:
+            for h in os.listdir(d):
+                if h.endswith('.h'):
+                    shutil.copy(f"{d}/{h}",scratch)
+        shutil.copy(source,scratch)
+        output = f"{radical}.{name}{ext}"
+        full_command = f"{command} {basename} -o {output}"
+        print_warning(args.verbose, f"Launching in {scratch}: {full_command}")
+        try:
+            run_command_output_free(full_command,args.timeout,cwd=scratch)
+        except subprocess.CalledProcessError as e:
+            print_warning(args.verbose,f"Failure: {full_command}")
+            return False,target
+        except subprocess.TimeoutExpired as e:
+            print_warning(args.verbose,f"Timeout: {full_command}")
+            return False,target
+        # Pluto sometimes exits normally without producing anything
+        if not os.path.exists(f"{scratch}/{output}"):
+            return False,target
+        shutil.move(f"{scratch}/{output}",target)
+    if store:
+        store.store(key,target)
+    return True,target
+
+def main():
+    #
+    parser = argparse.ArgumentParser(
+        description="Generate versions of the initial benchmarks with polyhedral compilers.",
+    )
+    group_sources = parser.add_mutually_exclusive_group(required=True)
+    group_sources.add_argument(
+        "--sources", nargs="+", help="The C files to transform"
+    )
+    group_sources.add_argument(
+        "--sources-conf", type=str, help="The C files to transform"
+    )
+    parser.add_argument(
+        "--versions-conf",
+        type=str,
+        help="The versions to generate",
+        required=True,
+    )
+    parser.add_argument(
+        "--target-dir",
+        type=str,
+        help="The directory in which to generate output files",
+        required=True,
+    )
+    parser.add_argument(
+        "--include-dirs",
+        nargs="*",
+        default=[],
+        help="The directories where header files live",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=str,
+        default=None,
+        help="The directory in which to create the private working directories of the jobs",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Max number of concurrent fuzzing jobs",
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="Use cache",
+    )
+    parser.add_argument(
+        "--cas-dir",
+        type=str,
+        default=None,
+        help="The content-addressed store of artifacts (supersedes --use-cache)",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print stuff",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=300,
+        help="Timeout of the commands",
+    )
+    args = parser.parse_args()
+    # Sources
+    sources_filenames: list[str] = []
+    if args.sources_conf:
+        if os.path.exists(args.sources_conf):
+            sources_filenames = read_sources_conf(args.sources_conf)
+        else:
+            parser.error(f"{args.sources_conf} does not exist.")
+    else:
+        for s in args.sources:
+            if not os.path.exists(s):
+                parser.error(f"{s} does not exist.")
+        sources_filenames = args.sources
+    # Versions
+    if not os.path.exists(args.versions_conf):
+        parser.error(f"{args.versions_conf} does not exist.")
+    versions = read_commands_conf(args.versions_conf)
+    # Directories
+    for d in [args.target_dir] + args.include_dirs:
+        if not os.path.exists(d):
+            parser.error(f"{d} does not exist.")
+    if args.scratch_dir and not os.path.exists(args.scratch_dir):
+        parser.error(f"{args.scratch_dir} does not exist.")
+    # Each job has its own working directory, so they can run in parallel
+    num_errors = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(fuzz_it, s, name, command, args)
+            for s in sources_filenames
+            for name,command in versions.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            correct,target = future.result()
+            if not correct:
+                num_errors += 1
+    print_warning(args.verbose,f"Total number of errors: {num_errors}")
+
+if __name__ == "__main__":
+    main()
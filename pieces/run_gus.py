@@ -3,25 +3,26 @@
 from typing import Tuple
 import argparse
 import os
+import shutil
 import sys
 import subprocess
-import concurrent.futures
+import tempfile
+
+# The building blocks shared with shifumi.py (usage accounting, CAS,
+# scheduler...)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 from helpers import print_warning, run_command
+from cas import Store, key_of
+from scheduler import Scheduler
+from history import History, history_key
+from usage import ledger
 
-def gus_it(binary,args) -> Tuple[bool,str]:
-    load_from_cache = args.use_cache or args.use_cache_only
-    skip_if_no_in_cache = args.use_cache_only
-    # Report path
+# The sensitivity analysis is much longer than the detailed report
+SENS_TIMEOUT = 900
+
+def gus_command(binary,args) -> str:
     bb = os.path.basename(binary)
-    radical,ext = os.path.splitext(bb)
-    report_path = f"{args.target_dir}/{bb}.gus"
-    if load_from_cache and os.path.exists(report_path):
-        print_warning(args.verbose, f"{report_path} reloaded from disk")
-        return True,report_path
-    elif skip_if_no_in_cache:
-        print_warning(args.verbose, f"{report_path} no on disk")
-        return False,report_path
     # Kernel
     bbs = bb.split('.')
     kernel = "kernel_" + bbs[0].replace('-','_')
@@ -34,18 +35,42 @@ def gus_it(binary,args) -> Tuple[bool,str]:
         "--L3-size",
         args.l3_size
     ])
-    full_command = f"gus {cache_sizes} --kernel {kernel} {binary}"
+    return f"gus {cache_sizes} --kernel {kernel}"
+
+def gus_it(binary,args,timeout=None) -> Tuple[bool,str]:
+    load_from_cache = args.use_cache or args.use_cache_only
+    skip_if_no_in_cache = args.use_cache_only
+    # Report path
+    bb = os.path.basename(binary)
+    radical,ext = os.path.splitext(bb)
+    report_path = f"{args.target_dir}/{bb}.gus"
+    command = gus_command(binary,args)
+    full_command = f"{command} {binary}"
+    store = None
+    if args.cas_dir:
+        store = Store(args.cas_dir,args.verbose)
+        key = key_of(command,[binary])
+        if store.fetch(key,report_path):
+            return True,report_path
+    elif load_from_cache and os.path.exists(report_path):
+        print_warning(args.verbose, f"{report_path} reloaded from disk")
+        return True,report_path
+    if skip_if_no_in_cache:
+        print_warning(args.verbose, f"{report_path} no on disk")
+        return False,report_path
     print_warning(args.verbose, f"Launching: {full_command}")
     # Go
     correct = True
     try:
         stdout,stderr = run_command(
             command = full_command,
-            timeout = args.timeout,
+            timeout = timeout or args.timeout,
         )
         with open(report_path,'w') as f:
             f.write(stdout)
             print_warning(args.very_verbose, f"{stdout}")
+        if store:
+            store.store(key,report_path)
     except subprocess.CalledProcessError as e:
         print_warning(args.verbose,f"Failure: {full_command}")
         correct=False
@@ -55,6 +80,56 @@ def gus_it(binary,args) -> Tuple[bool,str]:
     print_warning(args.verbose, f"Success on producting {report_path}")
     return correct,report_path
 
+def sens_it(binary,args,timeout=None) -> Tuple[bool,str]:
+    load_from_cache = args.use_cache or args.use_cache_only
+    skip_if_no_in_cache = args.use_cache_only
+    # Report path
+    bb = os.path.basename(binary)
+    report_path = f"{args.target_dir}/{bb}.sens"
+    pdf_path = f"{args.target_dir}/{bb}.sens.pdf"
+    command = f"{gus_command(binary,args)} --sensitivity"
+    store = None
+    if args.cas_dir:
+        store = Store(args.cas_dir,args.verbose)
+        key = key_of(command,[binary])
+        if store.fetch(key,report_path):
+            return True,report_path
+    elif load_from_cache and os.path.exists(report_path):
+        print_warning(args.verbose, f"{report_path} reloaded from disk")
+        return True,report_path
+    if skip_if_no_in_cache:
+        print_warning(args.verbose, f"{report_path} no on disk")
+        return False,report_path
+    # Concurrent analyses must not share their output files: each one works
+    # in its own scratch directory, and the PDF is rendered only on demand
+    with tempfile.TemporaryDirectory(prefix="sens-") as scratch:
+        full_command = command
+        if args.render_pdf:
+            full_command += f" --pdf-out {scratch}/out.pdf"
+        full_command += f" {os.path.abspath(binary)}"
+        print_warning(args.verbose, f"Launching: {full_command}")
+        try:
+            stdout,stderr = run_command(
+                command = full_command,
+                timeout = timeout or args.sens_timeout,
+                cwd = scratch,
+            )
+        except subprocess.CalledProcessError as e:
+            print_warning(args.verbose,f"Failure: {full_command}")
+            return False,report_path
+        except subprocess.TimeoutExpired as e:
+            print_warning(args.verbose,f"Timeout: {full_command}")
+            return False,report_path
+        with open(report_path,'w') as f:
+            f.write(stdout)
+        print_warning(args.very_verbose, f"{stdout}")
+        if args.render_pdf and os.path.exists(f"{scratch}/out.pdf"):
+            shutil.move(f"{scratch}/out.pdf",pdf_path)
+    if store:
+        store.store(key,report_path)
+    print_warning(args.verbose, f"Success on producing {report_path}")
+    return True,report_path
+
 def main():
     #
     parser = argparse.ArgumentParser(
@@ -99,6 +174,12 @@ def main():
         action="store_true",
         help="Use cache",
     )
+    parser.add_argument(
+        "--cas-dir",
+        type=str,
+        default=None,
+        help="The content-addressed store of artifacts (supersedes --use-cache)",
+    )
     parser.add_argument(
         "--parallel",
         action="store_true",
@@ -110,6 +191,22 @@ def main():
         default=8,
         help="Threads max",
     )
+    parser.add_argument(
+        "--enable-sensitivity",
+        action="store_true",
+        help="Also run Gus's sensitivity analysis",
+    )
+    parser.add_argument(
+        "--render-pdf",
+        action="store_true",
+        help="Render the PDF of the sensitivity analysis",
+    )
+    parser.add_argument(
+        "--sens-timeout",
+        type=int,
+        default=SENS_TIMEOUT,
+        help="Timeout of the sensitivity analysis",
+    )
     parser.add_argument(
         "--use-cache-only",
         action="store_true",
@@ -131,6 +228,12 @@ def main():
         default=120,
         help="Timeout of the commands",
     )
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=None,
+        help="The database of the durations of the previous runs (default: <target-dir>/history.sqlite)",
+    )
     args = parser.parse_args()
     # Binaries
     binaries: list[str] = []
@@ -164,29 +267,46 @@ def main():
     if args.target_dir:
         if not os.path.exists(args.target_dir):
             parser.error(f"{args.target_dir} does not exist.")
-    # The big loop
+    # The big loop: the longest expected analyses first
+    history = History(args.history or f"{args.target_dir}/history.sqlite",args.very_verbose)
+    analyses = {"gus": (gus_it,args.timeout)}
+    if args.enable_sensitivity:
+        analyses["sens"] = (sens_it,args.sens_timeout)
+    # Both analyses share the same workers
+    scheduler = Scheduler(
+        limits = {"gus": args.threads_max if args.parallel else 1},
+        verbose = args.very_verbose,
+    )
+    for binary in binaries:
+        key = os.path.basename(binary)
+        for tool,(analysis,default_timeout) in analyses.items():
+            scheduler.add(
+                name = f"{binary}.{tool}",
+                stage = "gus",
+                function = lambda binary=binary,analysis=analysis,t=history.timeout(key,tool,default_timeout): analysis(binary,args,t),
+                expected = history.expected(key,tool),
+            )
     num_errors = 0
     count = 0
-    if args.parallel:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            futures = {
-                executor.submit(gus_it, binary, args)
-                for binary in binaries
-            }
-            for future in concurrent.futures.as_completed(futures):
-                correct, report_path = future.result()
-                if not correct:
-                    print(correct)
-                    assert(False)
-                    num_errors += 1
-    else:
-        for binary in binaries:
-            count += 1
-            print_warning(args.verbose, f"{count}/{len(binaries)} - Analyzing {binary}")
-            correct,report_path = gus_it(binary,args)
-            if not correct:
-                num_errors += 1
+    total = len(scheduler.tasks)
+    print_warning(args.verbose, f"Estimated makespan: {scheduler.estimate():.0f}s")
+    def on_done(task,result):
+        nonlocal count, num_errors
+        count += 1
+        correct,report_path = result
+        tool = os.path.splitext(task.name)[1][1:]
+        # Only the analyses which ran Gus (not the cache hits)
+        if task.usage is not None:
+            history.record(history_key(task.name,tool),tool,task.duration,correct)
+            history.record_usage(history_key(task.name,tool),tool,task.usage)
+        if not correct:
+            num_errors += 1
+        print_warning(args.verbose, f"{count}/{total} - Analyzed {task.name}")
+    scheduler.run(on_done)
+    history.close()
     print_warning(args.verbose,f"Total number of errors: {num_errors}")
+    if args.verbose:
+        ledger.print()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,124 @@
 #!/usr/bin/env python3
 
+from typing import Tuple
 import argparse
 import os
 import sys
 import subprocess
+import concurrent.futures
+
+# The reports are written and parsed as shifumi.py does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 from helpers import print_warning, run_command
+from core_pool import CorePool, numa_node_of, pinned
+from text import REPETITION_MARKER
+from wrappers import counters_of, converged
 
 DYNAMORIO_DIR_NAME = "DynamoRIO-Linux-10.93.20000"
 
+def perf_it(binary,args,core=None,node=None) -> Tuple[bool,str]:
+    if core is None:
+        core = args.perf_core
+        node = numa_node_of(core)
+    load_from_cache = args.use_cache or args.use_cache_only
+    skip_if_no_in_cache = args.use_cache_only
+    # Report path
+    bb = os.path.basename(binary)
+    radical,ext = os.path.splitext(bb)
+    report_path = f"{args.target_dir}/{bb}.perf"
+    if load_from_cache and os.path.exists(report_path):
+        print_warning(args.verbose, f"{report_path} reloaded from disk")
+        return True,report_path
+    elif skip_if_no_in_cache:
+        print_warning(args.verbose, f"{report_path} no on disk")
+        return False,report_path
+    # Kernel
+    bbs = bb.split('.')
+    kernel = "kernel_" + bbs[0].replace('-','_')
+    # Default command
+    command_list = [
+            "perf",
+            "stat",
+            binary,
+    ]
+    env_vars = {}
+    if args.use_huge_pages:
+        env_vars['LD_PRELOAD'] = args.lib_hugepages
+    # The arrays of the benchmark only (see polybench.c)
+    if args.huge_pages:
+        env_vars["POLYBENCH_HUGE_PAGES"] = args.huge_pages
+    # If tma-scope
+    if args.tma_scope_install_dir:
+        command_list = [
+            f"{args.tma_scope_install_dir}/{DYNAMORIO_DIR_NAME}/bin64/drrun",
+            "-c",
+            f"{args.tma_scope_install_dir}/build/libtmascope.so",
+            "--",
+            binary,
+        ]
+        env_vars["TMA_FUNCTION"] = kernel
+        env_vars["TMA_OUTPUT_FILE"] = report_path
+        env_vars["TMA_LEVEL"] = "TopdownL1"
+        env_vars["TMA_CORE"] = str(core)
+    # The measurement and its memory stay on the reserved core
+    command = " ".join(pinned(command_list,core,node))
+    # Repeat until the confidence intervals are narrow enough
+    outputs = []
+    samples = []
+    for i in range(max(args.repetitions_max,1)):
+        if args.tma_scope_install_dir:
+            env_vars["TMA_OUTPUT_FILE"] = f"{report_path}.{i}"
+        env_str = ""
+        for k in env_vars:
+            env_str += f"{k}={env_vars[k]} "
+        full_command = f"{env_str} {command}"
+        print_warning(args.verbose, f"Launching: {full_command}")
+        # Go
+        try:
+            stdout,stderr = run_command(
+                command = full_command,
+                timeout = args.timeout,
+            )
+        except subprocess.CalledProcessError as e:
+            print_warning(args.verbose,f"Failure: {full_command}")
+            return False,report_path
+        except subprocess.TimeoutExpired as e:
+            print_warning(args.verbose,f"Timeout: {full_command}")
+            return False,report_path
+        # tma-scope writes the report by itself
+        if args.tma_scope_install_dir:
+            if not os.path.exists(env_vars["TMA_OUTPUT_FILE"]):
+                print_warning(args.verbose,f"Failure: {full_command}")
+                return False,report_path
+            with open(env_vars["TMA_OUTPUT_FILE"],'r') as f:
+                output = f.read()
+            os.remove(env_vars["TMA_OUTPUT_FILE"])
+        else:
+            output = stderr
+        print_warning(args.very_verbose, f"{output}")
+        # Nothing to converge without the counters (e.g. with tma-scope):
+        # the first run is the report, and an unparsable one after it is not
+        # a repetition
+        sample = counters_of(output)
+        if sample is None:
+            if not outputs:
+                outputs.append(output)
+            break
+        outputs.append(output)
+        samples.append(sample)
+        if len(samples) >= args.repetitions_min and converged(samples,args.ci_target,args.ci_level):
+            break
+    print_warning(args.verbose, f"Success on producing {report_path} ({len(outputs)} repetitions)")
+    with open(report_path,'w') as f:
+        if len(outputs) == 1:
+            f.write(outputs[0])
+        else:
+            for i,o in enumerate(outputs):
+                f.write(REPETITION_MARKER.format(i) + "\n")
+                f.write(o)
+    return True,report_path
+
 def main():
     #
     parser = argparse.ArgumentParser(
@@ -43,6 +153,12 @@ def main():
         type=str, default="libhugelbfs-2.23.so",
         help="The huge pages library to use"
     )
+    parser.add_argument(
+        "--huge-pages",
+        choices=["thp","hugetlb"],
+        default=None,
+        help="Allocate the arrays of the benchmarks (linked with polybench.c) on huge pages",
+    )
     parser.add_argument(
         "--tma-scope-install-dir",
         type=str,
@@ -55,6 +171,37 @@ def main():
         default=0,
         help="The core on which perf should run"
     )
+    parser.add_argument(
+        "--perf-cores",
+        nargs="+",
+        type=int,
+        default=None,
+        help="The isolated cores on which concurrent measurements run (one per core, no sibling hyperthreads)"
+    )
+    parser.add_argument(
+        "--repetitions-min",
+        type=int,
+        default=1,
+        help="Min number of measurements of each binary",
+    )
+    parser.add_argument(
+        "--repetitions-max",
+        type=int,
+        default=1,
+        help="Max number of measurements of each binary",
+    )
+    parser.add_argument(
+        "--ci-target",
+        type=float,
+        default=0.01,
+        help="Repeat until the half-width of the confidence interval of the cycles (relative) and of the top-down fractions (absolute) is below this",
+    )
+    parser.add_argument(
+        "--ci-level",
+        type=float,
+        default=0.95,
+        help="The confidence level of the intervals",
+    )
     parser.add_argument(
         "--use-cache",
         action="store_true",
@@ -118,72 +265,28 @@ def main():
     if args.tma_scope_install_dir:
         if not os.path.exists(args.tma_scope_install_dir):
             parser.error(f"{args.tma_scope_install_dir} does not exist.")
+    # Cores
+    try:
+        pool = CorePool(args.perf_cores if args.perf_cores else [args.perf_core])
+    except ValueError as e:
+        parser.error(str(e))
     # The big loop
+    def measure(binary):
+        with pool.reserve() as (core,node):
+            return perf_it(binary,args,core,node)
     num_errors = 0
     count = 0
-    load_from_cache = args.use_cache or args.use_cache_only
-    skip_if_no_in_cache = args.use_cache_only
-    for binary in binaries:
-        count += 1
-        print_warning(args.verbose, f"{count}/{len(binaries)} - Analyzing {binary}")
-        # Report path
-        bb = os.path.basename(binary)
-        radical,ext = os.path.splitext(bb)
-        report_path = f"{args.target_dir}/{bb}.perf"
-        if load_from_cache and os.path.exists(report_path):
-            print_warning(args.verbose, f"{report_path} reloaded from disk")
-            continue
-        elif skip_if_no_in_cache:
-            print_warning(args.verbose, f"{report_path} no on disk")
-            continue
-        # Kernel
-        bbs = bb.split('.')
-        kernel = "kernel_" + bbs[0].replace('-','_')
-        # Default command
-        command_list = [
-                "perf",
-                "stat",
-                binary,
-        ]
-        env_vars = {}
-        if args.use_huge_pages:
-            env_vars['LD_PRELOAD'] = args.lib_hugepages
-        # If tma-scope
-        if args.tma_scope_install_dir:
-            command_list = [
-                f"{args.tma_scope_install_dir}/{DYNAMORIO_DIR_NAME}/bin64/drrun",
-                "-c",
-                f"{args.tma_scope_install_dir}/build/libtmascope.so",
-                "--",
-                binary,
-            ]
-            env_vars["TMA_FUNCTION"] = kernel
-            env_vars["TMA_OUTPUT_FILE"] = report_path
-            env_vars["TMA_LEVEL"] = "TopdownL1"
-            env_vars["TMA_CORE"] = str(args.perf_core)
-        #
-        command = " ".join(command_list)
-        env_str = ""
-        for k in env_vars:
-            env_str += f"{k}={env_vars[k]} "
-        full_command = f"{env_str} {command}"
-        print_warning(args.verbose, f"Launching: {full_command}")
-        # Go
-        try:
-            stdout,stderr = run_command(
-                command = full_command,
-                timeout = args.timeout,
-            )
-        except subprocess.CalledProcessError as e:
-            print_warning(args.verbose,f"Failure: {full_command}")
-            num_errors += 1
-        except subprocess.TimeoutExpired as e:
-            print_warning(args.verbose,f"Timeout: {full_command}")
-            num_errors += 1
-        print_warning(args.verbose, f"Success on producing {report_path}")
-        with open(report_path,'w') as f:
-            f.write(stderr)
-        print_warning(args.very_verbose, f"{stderr}")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(pool.cores)) as executor:
+        futures = {
+            executor.submit(measure, binary)
+            for binary in binaries
+        }
+        for future in concurrent.futures.as_completed(futures):
+            count += 1
+            correct,report_path = future.result()
+            print_warning(args.verbose, f"{count}/{len(binaries)} - {report_path}")
+            if not correct:
+                num_errors += 1
     print_warning(args.verbose,f"Total number of errors: {num_errors}")
 
 if __name__ == "__main__":
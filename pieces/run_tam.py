@@ -5,6 +5,10 @@ import os
 import sys
 import subprocess
 
+# The building blocks shared with shifumi.py (usage accounting, CAS,
+# scheduler...)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
 from helpers import print_warning, run_command_output_free
 
 def main():
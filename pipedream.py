@@ -0,0 +1,167 @@
+import ctypes
+import ctypes.util
+import os
+
+# ctypes bindings of perf-pipedream (perfpipedream/lib/perf-pipedream.h),
+# built as a shared library (libperf-pipedream.so). Only one event set may
+# run at a time in a process, and it counts the thread which started it (or
+# the other threads, see THREADS_*).
+
+CURRENT_VERSION = 1
+SUCCESS = 0
+NULL = -1
+SAMPLE_BRANCH_STACK = 1
+THREADS_CALLER = 0
+THREADS_INHERIT = 1
+THREADS_ALL = 2
+MAX_THREADS = 1024
+
+class PipedreamError(Exception):
+    pass
+
+
+def load_library(path: str | None = None) -> ctypes.CDLL:
+    # PERF_PIPEDREAM_LIBRARY, or the one installed
+    path = path or os.environ.get("PERF_PIPEDREAM_LIBRARY")
+    path = path or ctypes.util.find_library("perf-pipedream")
+    if path is None:
+        raise PipedreamError("libperf-pipedream.so not found")
+    lib = ctypes.CDLL(path)
+    lib.perf_pipedream_strerror.restype = ctypes.c_char_p
+    lib.perf_pipedream_read_scaled.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(ctypes.c_longlong),
+        ctypes.POINTER(ctypes.c_double),
+    ]
+    lib.perf_pipedream_read_threads.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_longlong),
+        ctypes.POINTER(ctypes.c_double),
+    ]
+    lib.perf_pipedream_set_sampling.argtypes = [
+        ctypes.c_int,
+        ctypes.c_ulonglong,
+        ctypes.c_int,
+    ]
+    return lib
+
+
+class Pipedream:
+    def __init__(self, path: str | None = None):
+        self.lib = load_library(path)
+        if not self.lib.perf_pipedream_is_initialized():
+            version = self.lib.perf_pipedream_library_init(CURRENT_VERSION)
+            if version != CURRENT_VERSION:
+                self.check(version)
+
+    def check(self, errcode: int):
+        if errcode != SUCCESS:
+            raise PipedreamError(self.lib.perf_pipedream_strerror(errcode).decode())
+
+    def code_of(self, name: str) -> int:
+        code = ctypes.c_int()
+        self.check(
+            self.lib.perf_pipedream_event_name_to_code(name.encode(), ctypes.byref(code))
+        )
+        return code.value
+
+    def shutdown(self):
+        self.lib.perf_pipedream_shutdown()
+
+
+class EventSet:
+    def __init__(
+        self,
+        pipedream: Pipedream,
+        names: list[str],
+        multiplex: bool = False,
+        threads: int = THREADS_CALLER,
+    ):
+        self.pipedream = pipedream
+        self.lib = pipedream.lib
+        self.names = names
+        self.handle = ctypes.c_int(NULL)
+        pipedream.check(self.lib.perf_pipedream_create_eventset(ctypes.byref(self.handle)))
+        for name in names:
+            pipedream.check(
+                self.lib.perf_pipedream_add_event(self.handle, pipedream.code_of(name))
+            )
+        if multiplex:
+            pipedream.check(self.lib.perf_pipedream_set_multiplex(self.handle))
+        if threads != THREADS_CALLER:
+            pipedream.check(self.lib.perf_pipedream_set_threads(self.handle, threads))
+        self.values = (ctypes.c_longlong * len(names))()
+        self.ratios = (ctypes.c_double * len(names))()
+
+    def start(self):
+        self.pipedream.check(self.lib.perf_pipedream_start(self.handle))
+
+    def stop(self) -> tuple[dict[str, int], dict[str, float]]:
+        # The values scaled by their running ratio, and the ratios
+        self.pipedream.check(
+            self.lib.perf_pipedream_read_scaled(self.handle, self.values, self.ratios)
+        )
+        self.pipedream.check(self.lib.perf_pipedream_stop(self.handle, None))
+        return dict(zip(self.names, self.values)), dict(zip(self.names, self.ratios))
+
+    def read_threads(self) -> dict[int, dict[str, int]]:
+        # The scaled values of each counted thread, by thread id
+        count = ctypes.c_int(MAX_THREADS)
+        tids = (ctypes.c_int * MAX_THREADS)()
+        values = (ctypes.c_longlong * (MAX_THREADS * len(self.names)))()
+        self.pipedream.check(
+            self.lib.perf_pipedream_read_threads(
+                self.handle, ctypes.byref(count), tids, values, None
+            )
+        )
+        n = len(self.names)
+        return {
+            tids[t]: dict(zip(self.names, values[t * n : (t + 1) * n]))
+            for t in range(min(count.value, MAX_THREADS))
+        }
+
+    def destroy(self):
+        self.pipedream.check(self.lib.perf_pipedream_cleanup_eventset(self.handle))
+        self.pipedream.check(self.lib.perf_pipedream_destroy_eventset(ctypes.byref(self.handle)))
+
+
+HOOK = ctypes.CFUNCTYPE(None)
+
+
+class SharedKernel:
+    # A benchmark built as a shared object with -DPOLYBENCH_HOOKS and
+    # -Dmain=polybench_main: each run calls the hooks right around the kernel
+    # (around each repetition with -DPOLYBENCH_REPEAT)
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lib = ctypes.CDLL(os.path.abspath(path), mode=ctypes.RTLD_LOCAL)
+        self.lib.polybench_main.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(ctypes.c_char_p),
+        ]
+
+    def set_hooks(
+        self, start, stop, flush_cache: bool = True, huge_pages: str | None = None
+    ):
+        # The callbacks must outlive the runs
+        self.hooks = (HOOK(start), HOOK(stop))
+        for name, hook in zip(("polybench_hook_start", "polybench_hook_stop"), self.hooks):
+            ctypes.c_void_p.in_dll(self.lib, name).value = ctypes.cast(
+                hook, ctypes.c_void_p
+            ).value
+        ctypes.c_int.in_dll(self.lib, "polybench_hook_flush_cache").value = int(
+            flush_cache
+        )
+        # What POLYBENCH_HUGE_PAGES would say to a process of its own: the
+        # environment of this one is left alone
+        self.huge_pages = ctypes.create_string_buffer((huge_pages or "none").encode())
+        ctypes.c_void_p.in_dll(self.lib, "polybench_hook_huge_pages").value = (
+            ctypes.addressof(self.huge_pages)
+        )
+
+    def run(self) -> int:
+        argv = (ctypes.c_char_p * 2)(self.path.encode(), None)
+        return self.lib.polybench_main(1, argv)
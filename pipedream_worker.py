@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+import wrappers
+import pipedream
+
+# The measurement worker of wrappers.pipedream_tam_l1: loads a benchmark built
+# as a shared object, counts its kernel with perf-pipedream from its main
+# thread, pinned on the core, and writes the report. Nothing is written if
+# the measurement fails (the kernel may as well crash or exit the worker).
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the kernel of a shared object with perf-pipedream."
+    )
+    parser.add_argument("shared_object", help="The benchmark built with -DPOLYBENCH_HOOKS")
+    parser.add_argument("report", help="The report to write")
+    parser.add_argument("--core", type=int, required=True, help="The core to run on")
+    parser.add_argument("--repetitions-min", type=int, default=1)
+    parser.add_argument("--repetitions-max", type=int, default=1)
+    parser.add_argument("--ci-target", type=float, default=0.01)
+    parser.add_argument("--ci-level", type=float, default=0.95)
+    parser.add_argument("--huge-pages", choices=["thp", "hugetlb"], default=None)
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    os.sched_setaffinity(0, {args.core})
+    try:
+        windows = wrappers.pipedream_windows(
+            args.shared_object,
+            args.debug,
+            args.repetitions_min,
+            args.repetitions_max,
+            args.ci_target,
+            args.ci_level,
+            args.huge_pages,
+        )
+    except (OSError, AttributeError, ValueError, pipedream.PipedreamError) as e:
+        print(f"In-process measurement of {args.shared_object}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not windows:
+        sys.exit(1)
+    # Complete or absent
+    partial = f"{args.report}.tmp"
+    with open(partial, "w") as f:
+        f.write(wrappers.pipedream_report_of(windows))
+    os.replace(partial, args.report)
+
+
+if __name__ == "__main__":
+    main()
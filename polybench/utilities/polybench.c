@@ -22,6 +22,9 @@
 #ifdef _OPENMP
 # include <omp.h>
 #endif
+#ifdef __linux__
+# include <sys/mman.h>
+#endif
 
 #if defined(POLYBENCH_PAPI)
 # undef POLYBENCH_PAPI
@@ -31,6 +34,15 @@
 # include "polybench.h"
 #endif
 
+/* The in-process repetitions collect all the counters during each run of
+   the kernel: there may be more events than hardware counters, which are
+   then multiplexed. */
+#if defined(POLYBENCH_PAPI) && defined(POLYBENCH_REPEAT)
+# ifndef POLYBENCH_PAPI_MULTIPLEX
+#  define POLYBENCH_PAPI_MULTIPLEX
+# endif
+#endif
+
 
 /* By default, collect PAPI counters on thread 0. */
 #ifndef POLYBENCH_THREAD_MONITOR
@@ -63,6 +75,14 @@ double polybench_program_total_flops = 0;
 #include "gem5/m5ops.h"
 #endif
 
+#ifdef POLYBENCH_PERF_CTL
+# include <fcntl.h>
+#endif
+
+#if defined(POLYBENCH_PAPI_THREADS) && !defined(POLYBENCH_PIPEDREAM)
+# error "POLYBENCH_PAPI_THREADS requires POLYBENCH_PIPEDREAM"
+#endif
+
 #ifdef POLYBENCH_PIPEDREAM
 # include <perf-pipedream.h>
 # define POLYBENCH_PAPI
@@ -80,6 +100,9 @@ double polybench_program_total_flops = 0;
 # define PAPI_cleanup_eventset perf_pipedream_cleanup_eventset
 # define PAPI_destroy_eventset perf_pipedream_destroy_eventset
 # define PAPI_shutdown perf_pipedream_shutdown
+# define PAPI_set_multiplex perf_pipedream_set_multiplex
+# define PAPI_multiplex_init perf_pipedream_multiplex_init
+# define PAPI_assign_eventset_component perf_pipedream_assign_eventset_component
 # define PAPI_get_event_info perf_pipedream_get_event_info
 # define PAPI_event_code_to_name perf_pipedream_event_code_to_name
 
@@ -90,6 +113,28 @@ static int perf_pipedream_event_code_to_name(int EventCode, char *out) {
 static int perf_pipedream_get_event_info(int code, void *ev) {
   return PAPI_OK;
 }
+
+#ifdef POLYBENCH_PAPI_MULTIPLEX
+static int perf_pipedream_multiplex_init() {
+  return PAPI_OK;
+}
+
+static int perf_pipedream_assign_eventset_component(int event_set, int cidx) {
+  return PAPI_OK;
+}
+#endif
+
+/* Fraction of the time each counter was actually counting: below 1 when
+   the kernel multiplexed it, its value being then scaled accordingly. */
+double polybench_papi_ratios[POLYBENCH_MAX_NB_PAPI_COUNTERS];
+# ifdef POLYBENCH_PAPI_THREADS
+/* The counters of each thread of the process, with POLYBENCH_PAPI_THREADS */
+#  define POLYBENCH_MAX_NB_PAPI_THREADS 256
+int polybench_papi_nb_threads = 0;
+int polybench_papi_tids[POLYBENCH_MAX_NB_PAPI_THREADS];
+long_long polybench_papi_thread_values[POLYBENCH_MAX_NB_PAPI_THREADS]
+				      [POLYBENCH_MAX_NB_PAPI_COUNTERS];
+# endif
 #define PAPI_VER_CURRENT PERFPIPEDREAM_CURRENT_VERSION
 
 #endif
@@ -201,6 +246,63 @@ void polybench_gem5_print()
 }
 #endif
 
+#ifdef POLYBENCH_PERF_CTL
+
+/* perf stat --delay=-1 --control fifo:<ctl>,<ack> starts with its counters
+   disabled, and enables or disables them on the commands written to the
+   control FIFO. The harness gives the paths of the FIFOs in the
+   environment; without them, the instruments do nothing. */
+static int polybench_perf_ctl_fd = -1;
+static int polybench_perf_ack_fd = -1;
+
+static
+void polybench_perf_ctl_send(const char* command)
+{
+  char ack[8];
+  const char* path;
+
+  if (polybench_perf_ctl_fd < 0)
+    {
+      path = getenv ("POLYBENCH_PERF_CTL");
+      if (path == NULL)
+	return;
+      polybench_perf_ctl_fd = open (path, O_WRONLY | O_CLOEXEC);
+      path = getenv ("POLYBENCH_PERF_ACK");
+      if (path != NULL)
+	polybench_perf_ack_fd = open (path, O_RDONLY | O_CLOEXEC);
+      if (polybench_perf_ctl_fd < 0)
+	{
+	  fprintf (stderr, "[PolyBench] cannot open the perf control FIFO\n");
+	  return;
+	}
+    }
+  if (write (polybench_perf_ctl_fd, command, strlen (command)) < 0)
+    return;
+  /* Wait for perf to apply the command before going on. */
+  if (polybench_perf_ack_fd >= 0
+      && read (polybench_perf_ack_fd, ack, sizeof(ack)) < 0)
+    fprintf (stderr, "[PolyBench] no acknowledgement from perf\n");
+}
+
+
+void polybench_perf_ctl_start()
+{
+  polybench_perf_ctl_send ("enable\n");
+}
+
+
+void polybench_perf_ctl_stop()
+{
+  polybench_perf_ctl_send ("disable\n");
+}
+
+
+void polybench_perf_ctl_print()
+{
+
+}
+#endif
+
 #ifdef POLYBENCH_PAPI
 
 static
@@ -262,9 +364,38 @@ void polybench_papi_init()
 	polybench_papi_eventset = PAPI_NULL;
 	if ((retval = PAPI_library_init (PAPI_VER_CURRENT)) != PAPI_VER_CURRENT)
 	  test_fail (__FILE__, __LINE__, "PAPI_library_init", retval);
+#ifdef POLYBENCH_PAPI_MULTIPLEX
+	if ((retval = PAPI_multiplex_init ()) != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "PAPI_multiplex_init", retval);
+#endif
 	if ((retval = PAPI_create_eventset (&polybench_papi_eventset))
 	    != PAPI_OK)
 	  test_fail (__FILE__, __LINE__, "PAPI_create_eventset", retval);
+#ifdef POLYBENCH_PIPEDREAM_SAMPLE_PERIOD
+	/* The instruction pointers within the kernel, dumped at shutdown */
+	if ((retval = perf_pipedream_set_sampling
+	     (polybench_papi_eventset, POLYBENCH_PIPEDREAM_SAMPLE_PERIOD,
+# ifdef POLYBENCH_PIPEDREAM_BRANCH_STACK
+	      PERFPIPEDREAM_SAMPLE_BRANCH_STACK
+# else
+	      0
+# endif
+	      )) != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "perf_pipedream_set_sampling", retval);
+#endif
+#ifdef POLYBENCH_PAPI_THREADS
+	/* Every thread of the process: the OpenMP pool exists by now */
+	if ((retval = perf_pipedream_set_threads
+	     (polybench_papi_eventset, PERFPIPEDREAM_THREADS_ALL)) != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "perf_pipedream_set_threads", retval);
+#endif
+#ifdef POLYBENCH_PAPI_MULTIPLEX
+	if ((retval = PAPI_assign_eventset_component (polybench_papi_eventset, 0))
+	    != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "PAPI_assign_eventset_component", retval);
+	if ((retval = PAPI_set_multiplex (polybench_papi_eventset)) != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "PAPI_set_multiplex", retval);
+#endif
 	int k;
 	for (k = 0; _polybench_papi_eventlist[k]; ++k)
 	  {
@@ -307,6 +438,32 @@ void polybench_papi_close()
 # endif
 }
 
+#ifdef POLYBENCH_PAPI_THREADS
+/* The counters of each thread for the events [evid, evid + nb_events) of
+   the running event set */
+static
+void polybench_papi_read_threads(int evid, int nb_events)
+{
+  int retval;
+  int nb_threads = POLYBENCH_MAX_NB_PAPI_THREADS;
+  long_long* values =
+    malloc (sizeof(long_long) * POLYBENCH_MAX_NB_PAPI_THREADS * nb_events);
+  if ((retval = perf_pipedream_read_threads (polybench_papi_eventset,
+					     &nb_threads, polybench_papi_tids,
+					     values, NULL)) != PAPI_OK)
+    test_fail (__FILE__, __LINE__, "perf_pipedream_read_threads", retval);
+  if (nb_threads > POLYBENCH_MAX_NB_PAPI_THREADS)
+    nb_threads = POLYBENCH_MAX_NB_PAPI_THREADS;
+  int t, e;
+  for (t = 0; t < nb_threads; t++)
+    for (e = 0; e < nb_events; e++)
+      polybench_papi_thread_values[t][evid + e] = values[t * nb_events + e];
+  polybench_papi_nb_threads = nb_threads;
+  free (values);
+}
+#endif
+
+
 int polybench_papi_start_counter(int evid)
 {
 # ifndef POLYBENCH_NO_FLUSH_CACHE
@@ -352,9 +509,20 @@ void polybench_papi_stop_counter(int evid)
 	int retval;
 	long_long values[1];
 	values[0] = 0;
+#ifdef POLYBENCH_PIPEDREAM
+	if ((retval = perf_pipedream_read_scaled (polybench_papi_eventset,
+						  &values[0],
+						  &polybench_papi_ratios[evid]))
+	    != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "perf_pipedream_read_scaled", retval);
+#else
 	if ((retval = PAPI_read (polybench_papi_eventset, &values[0]))
 	    != PAPI_OK)
 	  test_fail (__FILE__, __LINE__, "PAPI_read", retval);
+#endif
+#ifdef POLYBENCH_PAPI_THREADS
+	polybench_papi_read_threads (evid, 1);
+#endif
 
 	if ((retval = PAPI_stop (polybench_papi_eventset, NULL)) != PAPI_OK)
 	  test_fail (__FILE__, __LINE__, "PAPI_stop", retval);
@@ -373,6 +541,81 @@ void polybench_papi_stop_counter(int evid)
 }
 
 
+/* With POLYBENCH_PAPI_MULTIPLEX (implied by POLYBENCH_REPEAT), all the
+   counters are collected during a single run of the kernel, in a
+   multiplexed event set. */
+void polybench_papi_start_all()
+{
+# ifndef POLYBENCH_NO_FLUSH_CACHE
+    polybench_flush_cache();
+# endif
+
+# ifdef _OPENMP
+# pragma omp parallel
+  {
+    if (omp_get_thread_num () == polybench_papi_counters_threadid)
+      {
+# endif
+	int retval;
+	int evid;
+	for (evid = 0; polybench_papi_eventlist[evid] != 0; evid++)
+	  if (PAPI_add_event (polybench_papi_eventset,
+			      polybench_papi_eventlist[evid]) != PAPI_OK)
+	    test_fail (__FILE__, __LINE__, "PAPI_add_event", 1);
+	if ((retval = PAPI_start (polybench_papi_eventset)) != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "PAPI_start", retval);
+# ifdef _OPENMP
+      }
+  }
+#pragma omp barrier
+# endif
+}
+
+
+void polybench_papi_stop_all()
+{
+# ifdef _OPENMP
+# pragma omp parallel
+  {
+    if (omp_get_thread_num () == polybench_papi_counters_threadid)
+      {
+# endif
+	int retval;
+	int evid;
+#ifdef POLYBENCH_PIPEDREAM
+	if ((retval = perf_pipedream_read_scaled (polybench_papi_eventset,
+						  polybench_papi_values,
+						  polybench_papi_ratios))
+	    != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "perf_pipedream_read_scaled", retval);
+#else
+	if ((retval = PAPI_read (polybench_papi_eventset, polybench_papi_values))
+	    != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "PAPI_read", retval);
+#endif
+#ifdef POLYBENCH_PAPI_THREADS
+	for (evid = 0; polybench_papi_eventlist[evid] != 0; evid++)
+	  ;
+	polybench_papi_read_threads (0, evid);
+#endif
+
+	if ((retval = PAPI_stop (polybench_papi_eventset, NULL)) != PAPI_OK)
+	  test_fail (__FILE__, __LINE__, "PAPI_stop", retval);
+	/* Not PAPI_cleanup_eventset, which would turn off the multiplexing
+	   of the event set for the next repetitions */
+	for (evid = 0; polybench_papi_eventlist[evid] != 0; evid++)
+	  if ((retval = PAPI_remove_event
+	       (polybench_papi_eventset,
+		polybench_papi_eventlist[evid])) != PAPI_OK)
+	    test_fail (__FILE__, __LINE__, "PAPI_remove_event", retval);
+# ifdef _OPENMP
+      }
+  }
+#pragma omp barrier
+# endif
+}
+
+
 void polybench_papi_print()
 {
   int verbose = 0;
@@ -393,10 +636,44 @@ void polybench_papi_print()
 	    if (verbose)
 	      printf ("%s=", _polybench_papi_eventlist[evid]);
 	    printf ("%llu ", polybench_papi_values[evid]);
+#ifdef POLYBENCH_PIPEDREAM
+	    if (verbose)
+	      printf ("(running %.3f)", polybench_papi_ratios[evid]);
+#endif
 	    if (verbose)
 	      printf ("\n");
 	  }
 	printf ("\n");
+#ifdef POLYBENCH_PIPEDREAM
+	/* The running ratios, in the same order */
+	if (!verbose)
+	  {
+	    for (evid = 0; polybench_papi_eventlist[evid] != 0; ++evid)
+	      printf ("%.3f ", polybench_papi_ratios[evid]);
+	    printf ("\n");
+	  }
+#endif
+#ifdef POLYBENCH_PAPI_THREADS
+	/* Then the counters of each thread, after its id */
+	int t;
+	for (t = 0; t < polybench_papi_nb_threads; ++t)
+	  {
+	    if (verbose)
+	      printf ("Thread %d:\n", polybench_papi_tids[t]);
+	    else
+	      printf ("%d: ", polybench_papi_tids[t]);
+	    for (evid = 0; polybench_papi_eventlist[evid] != 0; ++evid)
+	      {
+		if (verbose)
+		  printf ("%s=", _polybench_papi_eventlist[evid]);
+		printf ("%llu ", polybench_papi_thread_values[t][evid]);
+		if (verbose)
+		  printf ("\n");
+	      }
+	    if (!verbose)
+	      printf ("\n");
+	  }
+#endif
 # ifdef _OPENMP
       }
   }
@@ -407,6 +684,202 @@ void polybench_papi_print()
 #endif
 /* ! POLYBENCH_PAPI */
 
+#ifdef POLYBENCH_HOOKS
+
+/* The benchmark is built as a shared object (with -Dmain=polybench_main),
+   which a host loads once and runs as many times as it wants: the
+   instruments call it back right around the kernel. The host sets these
+   variables beforehand. */
+void (*polybench_hook_start)(void) = NULL;
+void (*polybench_hook_stop)(void) = NULL;
+int polybench_hook_flush_cache = 1;
+/* What POLYBENCH_HUGE_PAGES would be in the environment of the run: the
+   host does not have to change its own environment. */
+const char* polybench_hook_huge_pages = NULL;
+
+
+void polybench_hooks_start()
+{
+  if (polybench_hook_flush_cache)
+    polybench_flush_cache ();
+  if (polybench_hook_start != NULL)
+    polybench_hook_start ();
+}
+
+
+void polybench_hooks_stop()
+{
+  if (polybench_hook_stop != NULL)
+    polybench_hook_stop ();
+}
+
+#endif
+/* ! POLYBENCH_HOOKS */
+
+#ifdef POLYBENCH_REPEAT
+
+/* In-process repetitions: the kernel runs POLYBENCH_REPEAT times in the
+   same process, on inputs restored from a snapshot taken before the first
+   run, so that the initialization, the page faults and the dynamic
+   loading are paid once. Every array allocated with polybench_alloc_data
+   is part of the snapshot. Each repetition is timed, and counted when
+   built with PAPI or perf-pipedream. */
+# define POLYBENCH_MAX_NB_REPEAT_ARRAYS 64
+struct polybench_repeat_array
+{
+  void* data;
+  void* snapshot;
+  size_t size;
+};
+static struct polybench_repeat_array
+polybench_repeat_arrays[POLYBENCH_MAX_NB_REPEAT_ARRAYS];
+static int polybench_repeat_nb_arrays = 0;
+static double polybench_repeat_t_start;
+static double polybench_repeat_times[POLYBENCH_REPEAT];
+# ifdef POLYBENCH_PAPI
+static long_long* polybench_repeat_values = NULL;
+static int polybench_repeat_nb_counters = 0;
+# endif
+
+static
+double polybench_repeat_clock()
+{
+  struct timespec ts;
+  clock_gettime (CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec * 1.0e-9;
+}
+
+static
+void polybench_repeat_register(void* data, size_t size)
+{
+  if (polybench_repeat_nb_arrays == POLYBENCH_MAX_NB_REPEAT_ARRAYS)
+    {
+      fprintf (stderr, "[PolyBench] too many arrays to snapshot\n");
+      exit (1);
+    }
+  polybench_repeat_arrays[polybench_repeat_nb_arrays].data = data;
+  polybench_repeat_arrays[polybench_repeat_nb_arrays].snapshot = NULL;
+  polybench_repeat_arrays[polybench_repeat_nb_arrays].size = size;
+  polybench_repeat_nb_arrays++;
+}
+
+
+void polybench_repeat_init()
+{
+  int i;
+  for (i = 0; i < polybench_repeat_nb_arrays; ++i)
+    {
+      struct polybench_repeat_array* a = &polybench_repeat_arrays[i];
+      a->snapshot = malloc (a->size);
+      if (a->snapshot == NULL)
+	{
+	  fprintf (stderr, "[PolyBench] cannot allocate the snapshot\n");
+	  exit (1);
+	}
+      memcpy (a->snapshot, a->data, a->size);
+    }
+# ifdef POLYBENCH_PAPI
+  polybench_papi_init ();
+  polybench_repeat_nb_counters = 0;
+  while (polybench_papi_eventlist[polybench_repeat_nb_counters] != 0)
+    polybench_repeat_nb_counters++;
+  free (polybench_repeat_values);
+  polybench_repeat_values = (long_long*)
+    calloc (POLYBENCH_REPEAT * polybench_repeat_nb_counters, sizeof(long_long));
+# endif
+}
+
+
+void polybench_repeat_start(int rep)
+{
+  int i;
+  if (rep > 0)
+    for (i = 0; i < polybench_repeat_nb_arrays; ++i)
+      memcpy (polybench_repeat_arrays[i].data,
+	      polybench_repeat_arrays[i].snapshot,
+	      polybench_repeat_arrays[i].size);
+# ifdef POLYBENCH_PAPI
+  /* Flushes the cache (but with POLYBENCH_NO_FLUSH_CACHE) */
+  polybench_papi_start_all ();
+# else
+  polybench_prepare_instruments ();
+# endif
+# ifdef POLYBENCH_PERF_CTL
+  polybench_perf_ctl_start ();
+# endif
+# ifdef POLYBENCH_HOOKS
+  if (polybench_hook_start != NULL)
+    polybench_hook_start ();
+# endif
+  polybench_repeat_t_start = polybench_repeat_clock ();
+}
+
+
+void polybench_repeat_stop(int rep)
+{
+  double t_end = polybench_repeat_clock ();
+# ifdef POLYBENCH_HOOKS
+  polybench_hooks_stop ();
+# endif
+# ifdef POLYBENCH_PERF_CTL
+  polybench_perf_ctl_stop ();
+# endif
+# ifdef POLYBENCH_PAPI
+  polybench_papi_stop_all ();
+  memcpy (&polybench_repeat_values[rep * polybench_repeat_nb_counters],
+	  polybench_papi_values,
+	  polybench_repeat_nb_counters * sizeof(long_long));
+# endif
+# ifdef POLYBENCH_LINUX_FIFO_SCHEDULER
+  polybench_linux_standard_scheduler ();
+# endif
+  polybench_repeat_times[rep] = t_end - polybench_repeat_t_start;
+}
+
+
+void polybench_repeat_close()
+{
+  int i;
+# ifdef POLYBENCH_PAPI
+  polybench_papi_close ();
+# endif
+  for (i = 0; i < polybench_repeat_nb_arrays; ++i)
+    {
+      free (polybench_repeat_arrays[i].snapshot);
+      polybench_repeat_arrays[i].snapshot = NULL;
+    }
+  /* The host of a shared object may run the benchmark again */
+  polybench_repeat_nb_arrays = 0;
+}
+
+
+/* One line per repetition, after a header naming the columns. */
+void polybench_repeat_print()
+{
+  int rep;
+  printf ("==BEGIN REPETITIONS== time");
+# ifdef POLYBENCH_PAPI
+  int evid;
+  for (evid = 0; evid < polybench_repeat_nb_counters; ++evid)
+    printf (" %s", _polybench_papi_eventlist[evid]);
+# endif
+  printf ("\n");
+  for (rep = 0; rep < POLYBENCH_REPEAT; ++rep)
+    {
+      printf ("%d %0.9f", rep, polybench_repeat_times[rep]);
+# ifdef POLYBENCH_PAPI
+      for (evid = 0; evid < polybench_repeat_nb_counters; ++evid)
+	printf (" %llu",
+		polybench_repeat_values[rep * polybench_repeat_nb_counters + evid]);
+# endif
+      printf ("\n");
+    }
+  printf ("==END   REPETITIONS==\n");
+}
+
+#endif
+/* ! POLYBENCH_REPEAT */
+
 void polybench_prepare_instruments()
 {
 #ifndef POLYBENCH_NO_FLUSH_CACHE
@@ -463,6 +936,198 @@ void polybench_timer_print()
 #endif
 }
 
+#ifdef __linux__
+/*
+ * Huge pages for the arrays, chosen at run time by the environment
+ * variable POLYBENCH_HUGE_PAGES (or by polybench_hook_huge_pages, set by
+ * the host of a shared object built with -DPOLYBENCH_HOOKS):
+ *  - "thp": transparent huge pages, requested with madvise (with
+ *    /sys/kernel/mm/transparent_hugepage/enabled set to madvise or always);
+ *  - "hugetlb": pages of the hugetlb pool (/proc/sys/vm/nr_hugepages),
+ *    mapped with MAP_HUGETLB, or transparent huge pages if the pool is
+ *    empty.
+ * The arrays are rounded up to POLYBENCH_HUGE_PAGE_SIZE. How many of their
+ * bytes are actually backed by huge pages is printed on stderr when the
+ * first of them is freed (they have been touched by then), or at exit.
+ */
+# ifndef POLYBENCH_HUGE_PAGE_SIZE
+#  define POLYBENCH_HUGE_PAGE_SIZE (2 * 1024 * 1024)
+# endif
+# define POLYBENCH_HUGE_PAGES_NONE 0
+# define POLYBENCH_HUGE_PAGES_THP 1
+# define POLYBENCH_HUGE_PAGES_HUGETLB 2
+struct polybench_huge_array
+{
+  void* data;
+  size_t size;
+  int hugetlb;
+};
+static int polybench_huge_pages = -1;
+static struct polybench_huge_array* polybench_huge_arrays = NULL;
+static int polybench_huge_nb_arrays = 0;
+static int polybench_huge_reported = 0;
+static int polybench_huge_atexit = 0;
+
+static
+int polybench_huge_pages_mode()
+{
+  if (polybench_huge_pages < 0)
+    {
+#ifdef POLYBENCH_HOOKS
+      const char* mode = polybench_hook_huge_pages;
+      if (mode == NULL)
+	mode = getenv ("POLYBENCH_HUGE_PAGES");
+#else
+      const char* mode = getenv ("POLYBENCH_HUGE_PAGES");
+#endif
+      polybench_huge_pages = POLYBENCH_HUGE_PAGES_NONE;
+      if (mode != NULL && ! strcmp (mode, "thp"))
+	polybench_huge_pages = POLYBENCH_HUGE_PAGES_THP;
+      else if (mode != NULL && ! strcmp (mode, "hugetlb"))
+	polybench_huge_pages = POLYBENCH_HUGE_PAGES_HUGETLB;
+      else if (mode != NULL && *mode && strcmp (mode, "none"))
+	fprintf (stderr, "[PolyBench] unknown POLYBENCH_HUGE_PAGES: %s\n",
+		 mode);
+    }
+  return polybench_huge_pages;
+}
+
+/* The bytes of the huge arrays backed by huge pages, from the mappings
+   which overlap them */
+static
+void polybench_huge_pages_report()
+{
+  if (polybench_huge_reported || polybench_huge_nb_arrays == 0)
+    return;
+  polybench_huge_reported = 1;
+  size_t requested = 0;
+  int i;
+  for (i = 0; i < polybench_huge_nb_arrays; ++i)
+    requested += polybench_huge_arrays[i].size;
+  FILE* smaps = fopen ("/proc/self/smaps", "r");
+  if (smaps == NULL)
+    return;
+  char line[512];
+  int overlaps = 0;
+  unsigned long long huge_kb = 0;
+  while (fgets (line, sizeof(line), smaps) != NULL)
+    {
+      unsigned long start, end, kb;
+      if (sscanf (line, "%lx-%lx ", &start, &end) == 2)
+	{
+	  overlaps = 0;
+	  for (i = 0; i < polybench_huge_nb_arrays; ++i)
+	    {
+	      unsigned long data = (unsigned long)polybench_huge_arrays[i].data;
+	      if (data < end && data + polybench_huge_arrays[i].size > start)
+		overlaps = 1;
+	    }
+	}
+      else if (overlaps &&
+	       (sscanf (line, "AnonHugePages: %lu kB", &kb) == 1 ||
+		sscanf (line, "Private_Hugetlb: %lu kB", &kb) == 1 ||
+		sscanf (line, "Shared_Hugetlb: %lu kB", &kb) == 1))
+	huge_kb += kb;
+    }
+  fclose (smaps);
+  fprintf (stderr, "[PolyBench] huge pages: %llu of %zu bytes\n",
+	   huge_kb * 1024, requested);
+}
+
+/* An array on huge pages if requested, NULL otherwise */
+static
+void* polybench_huge_alloc(size_t size)
+{
+  int mode = polybench_huge_pages_mode ();
+  if (mode == POLYBENCH_HUGE_PAGES_NONE)
+    return NULL;
+  size = (size + POLYBENCH_HUGE_PAGE_SIZE - 1)
+    / POLYBENCH_HUGE_PAGE_SIZE * POLYBENCH_HUGE_PAGE_SIZE;
+  void* ret = NULL;
+  int hugetlb = 0;
+  if (mode == POLYBENCH_HUGE_PAGES_HUGETLB)
+    {
+      ret = mmap (NULL, size, PROT_READ | PROT_WRITE,
+		  MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+      if (ret == MAP_FAILED)
+	{
+	  ret = NULL;
+	  /* Once and for all: the pool is empty */
+	  polybench_huge_pages = POLYBENCH_HUGE_PAGES_THP;
+	  fprintf (stderr, "[PolyBench] MAP_HUGETLB failed, falling back to "
+		   "transparent huge pages\n");
+	}
+      else
+	hugetlb = 1;
+    }
+  if (ret == NULL)
+    {
+      if (posix_memalign (&ret, POLYBENCH_HUGE_PAGE_SIZE, size) || ! ret)
+	{
+	  fprintf (stderr, "[PolyBench] posix_memalign: cannot allocate memory");
+	  exit (1);
+	}
+# ifdef MADV_HUGEPAGE
+      if (madvise (ret, size, MADV_HUGEPAGE))
+	perror ("[PolyBench] madvise");
+# endif
+    }
+  if (! polybench_huge_atexit)
+    {
+      atexit (polybench_huge_pages_report);
+      polybench_huge_atexit = 1;
+    }
+  polybench_huge_arrays = realloc (polybench_huge_arrays,
+				   sizeof(struct polybench_huge_array)
+				   * (polybench_huge_nb_arrays + 1));
+  assert(polybench_huge_arrays != NULL);
+  polybench_huge_arrays[polybench_huge_nb_arrays].data = ret;
+  polybench_huge_arrays[polybench_huge_nb_arrays].size = size;
+  polybench_huge_arrays[polybench_huge_nb_arrays].hugetlb = hugetlb;
+  polybench_huge_nb_arrays++;
+  return ret;
+}
+
+/* Whether the array was on huge pages (and is now freed) */
+static
+int polybench_huge_free(void* ptr)
+{
+  int i;
+  for (i = 0; i < polybench_huge_nb_arrays; ++i)
+    if (polybench_huge_arrays[i].data == ptr)
+      break;
+  if (i == polybench_huge_nb_arrays)
+    return 0;
+  polybench_huge_pages_report ();
+  if (polybench_huge_arrays[i].hugetlb)
+    munmap (ptr, polybench_huge_arrays[i].size);
+  else
+    free (ptr);
+  /* The entry is released: a shared object run again and again (see
+     POLYBENCH_HOOKS) must not grow the table, and reports each run */
+  polybench_huge_arrays[i] = polybench_huge_arrays[--polybench_huge_nb_arrays];
+  if (polybench_huge_nb_arrays == 0)
+    {
+      free (polybench_huge_arrays);
+      polybench_huge_arrays = NULL;
+      polybench_huge_reported = 0;
+    }
+  return 1;
+}
+#endif
+
+
+static
+void xfree(void* ptr)
+{
+#ifdef __linux__
+  if (polybench_huge_free (ptr))
+    return;
+#endif
+  free (ptr);
+}
+
+
 /*
  * These functions are used only if the user defines a specific
  * inter-array padding. It grows a global structure,
@@ -526,7 +1191,7 @@ free_data_from_alloc_table (void* ptr)
 	  break;
       if (i != _polybench_alloc_table->nb_entries)
 	{
-	  free (_polybench_alloc_table->real_ptr[i]);
+	  xfree (_polybench_alloc_table->real_ptr[i]);
 	  for (; i < _polybench_alloc_table->nb_entries - 1; ++i)
 	    {
 	      _polybench_alloc_table->user_view[i] =
@@ -577,7 +1242,12 @@ xmalloc(size_t alloc_sz)
   /* By default, post-pad the arrays. Safe behavior, but likely useless. */
   polybench_inter_array_padding_sz += POLYBENCH_INTER_ARRAY_PADDING_FACTOR;
   size_t padded_sz = alloc_sz + polybench_inter_array_padding_sz;
-  int err = posix_memalign (&ret, 4096, padded_sz);
+#ifdef __linux__
+  ret = polybench_huge_alloc (padded_sz);
+#endif
+  int err = 0;
+  if (ret == NULL)
+    err = posix_memalign (&ret, 4096, padded_sz);
   if (! ret || err)
     {
       fprintf (stderr, "[PolyBench] posix_memalign: cannot allocate memory");
@@ -606,7 +1276,7 @@ void polybench_free_data(void* ptr)
 #ifdef POLYBENCH_ENABLE_INTARRAY_PAD
   free_data_from_alloc_table (ptr);
 #else
-  free (ptr);
+  xfree (ptr);
 #endif
 }
 
@@ -621,6 +1291,9 @@ void* polybench_alloc_data(unsigned long long int n, int elt_size)
   size_t val = n;
   val *= elt_size;
   void* ret = xmalloc (val);
+#ifdef POLYBENCH_REPEAT
+  polybench_repeat_register (ret, val);
+#endif
 
   return ret;
 }
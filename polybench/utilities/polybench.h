@@ -19,6 +19,26 @@
  * -DPOLYBENCH_TIME, to report the execution time,
  *   OR (exclusive):
  * -DPOLYBENCH_PAPI, to use PAPI H/W counters (defined in polybench.c)
+ *   with -DPOLYBENCH_PAPI_MULTIPLEX, to collect all of them in a single
+ *   run of the kernel, multiplexed
+ *   with -DPOLYBENCH_PIPEDREAM_SAMPLE_PERIOD=P (and perf-pipedream), to
+ *   sample the instruction pointers within the kernel every P events
+ *   (with their branch stacks with -DPOLYBENCH_PIPEDREAM_BRANCH_STACK)
+ *   with -DPOLYBENCH_PAPI_THREADS (and perf-pipedream), to count every
+ *   thread of the process (e.g. of OpenMP), and report each one as well
+ *
+ * POLYBENCH_HUGE_PAGES=thp or hugetlb in the environment of a run puts the
+ *   arrays on huge pages (see polybench.c)
+ *
+ * -DPOLYBENCH_REPEAT=N, to run the kernel N times in the process, on the
+ *   same inputs, and report each run (with the PAPI counters if any, which
+ *   are then multiplexed)
+ *
+ * -DPOLYBENCH_HOOKS, in a shared object built with -Dmain=polybench_main,
+ *   to call back the host which loaded it around the kernel
+ *   OR (exclusive):
+ * -DPOLYBENCH_PERF_CTL, to restrict the counters of
+ *   perf stat --delay=-1 --control fifo:... to the kernel (see polybench.c)
  *
  *
  * See README or utilities/polybench.c for additional options.
@@ -82,11 +102,8 @@
 */
 # ifndef POLYBENCH_STACK_ARRAYS
 #  define POLYBENCH_ARRAY(x) *x
-#  ifdef POLYBENCH_ENABLE_INTARRAY_PAD
-#   define POLYBENCH_FREE_ARRAY(x) polybench_free_data((void*)x);
-#  else
-#   define POLYBENCH_FREE_ARRAY(x) free((void*)x);
-#  endif
+/* polybench_free_data knows the padded and the huge arrays */
+#  define POLYBENCH_FREE_ARRAY(x) polybench_free_data((void*)x);
 #  define POLYBENCH_DECL_VAR(x) (*x)
 # else
 #  define POLYBENCH_ARRAY(x) x
@@ -201,6 +218,18 @@ extern int polybench_papi_eventlist[];
   polybench_papi_close();			\
 
 #  define polybench_print_instruments polybench_papi_print();
+/* All the counters in one run of the kernel, multiplexed. */
+#  ifdef POLYBENCH_PAPI_MULTIPLEX
+#   undef polybench_start_instruments
+#   undef polybench_stop_instruments
+#   define polybench_start_instruments	\
+  polybench_prepare_instruments();	\
+  polybench_papi_init();		\
+  polybench_papi_start_all();
+#   define polybench_stop_instruments	\
+  polybench_papi_stop_all();		\
+  polybench_papi_close();
+#  endif
 # endif
 
 /* GEM5 support. */
@@ -216,6 +245,19 @@ extern void polybench_gem5_stop();
 extern void polybench_gem5_print();
 # endif
 
+/* perf stat support: the counters are only enabled around the kernel. */
+# ifdef POLYBENCH_PERF_CTL
+#  undef polybench_start_instruments
+#  undef polybench_stop_instruments
+#  undef polybench_print_instruments
+#  define polybench_start_instruments polybench_perf_ctl_start();
+#  define polybench_stop_instruments polybench_perf_ctl_stop();
+#  define polybench_print_instruments polybench_perf_ctl_print();
+extern void polybench_perf_ctl_start();
+extern void polybench_perf_ctl_stop();
+extern void polybench_perf_ctl_print();
+# endif
+
 /* Timing support. */
 # if defined(POLYBENCH_TIME) || defined(POLYBENCH_GFLOPS)
 #  undef polybench_start_instruments
@@ -230,10 +272,51 @@ extern void polybench_timer_stop();
 extern void polybench_timer_print();
 # endif
 
+/* Shared object whose host is called back around the kernel (see
+   polybench.c). */
+# ifdef POLYBENCH_HOOKS
+#  undef polybench_start_instruments
+#  undef polybench_stop_instruments
+#  undef polybench_print_instruments
+#  define polybench_start_instruments polybench_hooks_start();
+#  define polybench_stop_instruments polybench_hooks_stop();
+#  define polybench_print_instruments
+extern void polybench_hooks_start();
+extern void polybench_hooks_stop();
+# endif
+
+/* In-process repetitions of the kernel (see polybench.c). */
+# ifdef POLYBENCH_REPEAT
+#  ifdef POLYBENCH_STACK_ARRAYS
+#   error "POLYBENCH_REPEAT needs the arrays of polybench_alloc_data"
+#  endif
+#  undef polybench_start_instruments
+#  undef polybench_stop_instruments
+#  undef polybench_print_instruments
+#  define polybench_start_instruments					\
+  polybench_repeat_init();						\
+  int polybench_rep;							\
+  for (polybench_rep = 0; polybench_rep < POLYBENCH_REPEAT; polybench_rep++) \
+    {									\
+      polybench_repeat_start(polybench_rep);
+#  define polybench_stop_instruments		\
+      polybench_repeat_stop(polybench_rep);	\
+    }						\
+  polybench_repeat_close();
+#  define polybench_print_instruments polybench_repeat_print();
+extern void polybench_repeat_init();
+extern void polybench_repeat_start(int rep);
+extern void polybench_repeat_stop(int rep);
+extern void polybench_repeat_close();
+extern void polybench_repeat_print();
+# endif
+
 /* PAPI support. */
 # ifdef POLYBENCH_PAPI
 extern int polybench_papi_start_counter(int evid);
 extern void polybench_papi_stop_counter(int evid);
+extern void polybench_papi_start_all();
+extern void polybench_papi_stop_all();
 extern void polybench_papi_init();
 extern void polybench_papi_close();
 extern void polybench_papi_print();
@@ -1,15 +1,117 @@
+#include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#ifdef __linux__
+#include <sys/mman.h>
+#endif
 #include "polybench.h"
 
 #define POLYBENCH_MAX_NB_PPAPI_COUNTERS 96
 
+#ifdef POLYBENCH_HOOKS
+/* The in-process measurements (see polybench.c) */
+void (*polybench_hook_start)(void) = NULL;
+void (*polybench_hook_stop)(void) = NULL;
+int polybench_hook_flush_cache = 1;
+const char *polybench_hook_huge_pages = NULL;
+#endif
+
+#ifdef __linux__
+/* POLYBENCH_HUGE_PAGES=thp or hugetlb, as in polybench.c, which also
+   reports how many bytes end up on huge pages */
+#ifndef POLYBENCH_HUGE_PAGE_SIZE
+#define POLYBENCH_HUGE_PAGE_SIZE (2 * 1024 * 1024)
+#endif
+struct polybench_huge_mapping {
+  void *data;
+  size_t size;
+  struct polybench_huge_mapping *next;
+};
+static struct polybench_huge_mapping *polybench_huge_mappings = NULL;
+/* Warned once and for all */
+static int polybench_huge_unknown = 0;
+static int polybench_hugetlb_failed = 0;
+
+static const char *polybench_huge_pages_mode() {
+  const char *mode = NULL;
+#ifdef POLYBENCH_HOOKS
+  mode = polybench_hook_huge_pages;
+#endif
+  if (mode == NULL)
+    mode = getenv("POLYBENCH_HUGE_PAGES");
+  if (mode != NULL && *mode && strcmp(mode, "none") && strcmp(mode, "thp") &&
+      strcmp(mode, "hugetlb")) {
+    if (!polybench_huge_unknown++)
+      fprintf(stderr, "[PolyBench] unknown POLYBENCH_HUGE_PAGES: %s\n", mode);
+    return NULL;
+  }
+  return mode;
+}
+
+static void *polybench_huge_alloc(size_t size) {
+  const char *mode = polybench_huge_pages_mode();
+  if (mode == NULL || !*mode || !strcmp(mode, "none"))
+    return NULL;
+  size = (size + POLYBENCH_HUGE_PAGE_SIZE - 1) / POLYBENCH_HUGE_PAGE_SIZE *
+         POLYBENCH_HUGE_PAGE_SIZE;
+  if (!strcmp(mode, "hugetlb") && !polybench_hugetlb_failed) {
+    void *ret = mmap(NULL, size, PROT_READ | PROT_WRITE,
+                     MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+    if (ret != MAP_FAILED) {
+      struct polybench_huge_mapping *m = malloc(sizeof(*m));
+      m->data = ret;
+      m->size = size;
+      m->next = polybench_huge_mappings;
+      polybench_huge_mappings = m;
+      return ret;
+    }
+    polybench_hugetlb_failed = 1;
+    fprintf(stderr, "[PolyBench] MAP_HUGETLB failed, falling back to "
+                    "transparent huge pages\n");
+  }
+  void *ret = NULL;
+  if (posix_memalign(&ret, POLYBENCH_HUGE_PAGE_SIZE, size))
+    return NULL;
+#ifdef MADV_HUGEPAGE
+  if (madvise(ret, size, MADV_HUGEPAGE))
+    perror("[PolyBench] madvise");
+#endif
+  return ret;
+}
+
+static int polybench_huge_unmap(void *ptr) {
+  for (struct polybench_huge_mapping **m = &polybench_huge_mappings; *m;
+       m = &(*m)->next)
+    if ((*m)->data == ptr) {
+      struct polybench_huge_mapping *found = *m;
+      munmap(ptr, found->size);
+      *m = found->next;
+      free(found);
+      return 1;
+    }
+  return 0;
+}
+#endif
+
 int polybench_papi_eventlist[POLYBENCH_MAX_NB_PPAPI_COUNTERS] = {0,1};
 void *polybench_alloc_data(unsigned long long int n, int elt_size) {
   size_t val = n;
   val *= elt_size;
+#ifdef __linux__
+  void *huge = polybench_huge_alloc(val);
+  if (huge != NULL)
+    return huge;
+#endif
   void *ret = malloc(val);
   return ret;
 }
+void polybench_free_data(void *ptr) {
+#ifdef __linux__
+  if (polybench_huge_unmap(ptr))
+    return;
+#endif
+  free(ptr);
+}
 void polybench_prepare_instruments() {}
 void polybench_papi_init() {}
 int polybench_papi_start_counter(int evid) {
@@ -18,3 +120,29 @@ int polybench_papi_start_counter(int evid) {
 void polybench_papi_stop_counter(int evid) {}
 void polybench_papi_close() {}
 void polybench_papi_print() {}
+
+#ifndef POLYBENCH_CACHE_SIZE_KB
+# define POLYBENCH_CACHE_SIZE_KB 32770
+#endif
+
+void polybench_flush_cache() {
+  int cs = POLYBENCH_CACHE_SIZE_KB * 1024 / sizeof(double);
+  volatile double *flush = (double *)calloc(cs, sizeof(double));
+  double tmp = 0.0;
+  for (int i = 0; i < cs; i++)
+    tmp += flush[i];
+  free((void *)flush);
+}
+
+#ifdef POLYBENCH_HOOKS
+void polybench_hooks_start() {
+  if (polybench_hook_flush_cache)
+    polybench_flush_cache();
+  if (polybench_hook_start != NULL)
+    polybench_hook_start();
+}
+void polybench_hooks_stop() {
+  if (polybench_hook_stop != NULL)
+    polybench_hook_stop();
+}
+#endif
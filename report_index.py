@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import threading
+
+from text import RawText, Report
+
+# Index of the parsed reports, keyed by blueprint and kind (the raw report
+# <reports-directory>/<blueprint>.<kind>). It is loaded at once, and a raw
+# report is parsed again only if its size or modification time changed since
+# it was indexed. The raw text itself is left on disk (see RawText).
+
+# Bump it when the schema or the parsing changes: the index is then rebuilt
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    blueprint TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    success INTEGER NOT NULL,
+    desc TEXT NOT NULL,
+    benchmark TEXT NOT NULL,
+    bottlenecks TEXT,
+    metrics TEXT,
+    samples TEXT,
+    drilldown TEXT,
+    PRIMARY KEY (blueprint, kind)
+);
+"""
+
+
+def blueprint_of(path: str) -> tuple[str, str]:
+    blueprint, ext = os.path.splitext(os.path.basename(path))
+    return blueprint, ext[1:]
+
+
+class ReportIndex:
+    def __init__(self, path: str):
+        # The stages save their reports from the threads of the scheduler
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS reports")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.executescript(SCHEMA)
+        self.entries = {}
+        for b, k, p, m, s, su, d, be, bn, me, sa, dd in self.connection.execute(
+            "SELECT * FROM reports"
+        ):
+            report = Report(
+                success=bool(su),
+                desc=d,
+                benchmark=be,
+                bottlenecks=json.loads(bn),
+                metrics=json.loads(me),
+                samples=json.loads(sa),
+                drilldown=json.loads(dd),
+                report=RawText(p),
+            )
+            self.entries[(b, k)] = (p, m, s, report)
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, path: str) -> Report | None:
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(blueprint_of(path))
+        if entry is None or entry[:3] != (path, st.st_mtime_ns, st.st_size):
+            return None
+        return entry[3]
+
+    def save(self, path: str, report: Report):
+        if not os.path.exists(path):
+            return
+        st = os.stat(path)
+        blueprint, kind = blueprint_of(path)
+        with self.lock:
+            self.entries[(blueprint, kind)] = (path, st.st_mtime_ns, st.st_size, report)
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        blueprint,
+                        kind,
+                        path,
+                        st.st_mtime_ns,
+                        st.st_size,
+                        int(report.success),
+                        report.desc,
+                        report.benchmark,
+                        json.dumps(report.bottlenecks),
+                        json.dumps(report.metrics),
+                        json.dumps(report.samples),
+                        json.dumps(report.drilldown),
+                    ),
+                )
+
+
+def indexed(index: ReportIndex | None, path: str, reuse: bool, produce) -> Report:
+    # The report of path, parsed again or produced only if needed
+    report = index.lookup(path) if index and reuse else None
+    if report is None:
+        report = produce()
+        if index:
+            index.save(path, report)
+    return report
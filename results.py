@@ -0,0 +1,297 @@
+from os import path
+from typing import cast
+
+import numpy as np
+import pandas
+
+import wrappers
+from text import Report
+from stats import welch_greater
+
+# The results of a run, as a table of one row per blueprint (in the order of
+# the output: compiler, original, version) and one typed column per metric.
+# The columns are filled as the reports arrive, from the threads of the
+# scheduler (each report fills its own row only). What derives from them
+# (relative errors, bottlenecks, mean errors, aggregates) is computed over
+# whole columns.
+
+LIFT_MRE_DISMISS_BEYOND = 10.0
+TAM_MARGIN_FRACTION = 5
+# With repeated measurements, the significance level of the speedups
+TAM_SIGNIFICANCE = 0.05
+
+NAME_KW = "Benchmark"
+TAM_BT_BUGGY_KW = "Odd TAM bottlenecks"
+GUS_BT_BUGGY_KW = "Odd Gus bottlenecks"
+TAM_BT_KW = "TAM bottlenecks"
+TAM_DRILL_KW = "TAM drill-down"
+GUS_BT_KW = "gus sens. bottlenecks"
+PERF_CYCLES_KW = "perf cycles"
+GUS_CYCLES_KW = "gus cycles"
+GUS_RE_KW = "gus relative error"
+TAM_CPU_KW = "TAM CPU seconds"
+TAM_RSS_KW = "TAM max RSS (kB)"
+GUS_CPU_KW = "gus CPU seconds"
+GUS_RSS_KW = "gus max RSS (kB)"
+FAMILY_KW = "Family"
+COMPILER_KW = "Compiler"
+COUNT_KW = "Benchmarks"
+GUS_MRE_KW = "gus MRE"
+
+
+def integers(values: np.ndarray) -> pandas.api.extensions.ExtensionArray:
+    # NaN for missing, as None in the CSV
+    return pandas.array(values, dtype="Int64")
+
+
+def float_of(value) -> float:
+    return np.nan if value is None else value
+
+
+def odd_bottlenecks_between(report_orig: Report, report_mut: Report) -> list[str]:
+    # The bottlenecks of the original more saturated in a faster version
+    # (also flagged by pieces/collect_reports.py on the indexed reports)
+    odd_bottlenecks = []
+    assert report_orig.metrics
+    assert report_mut.metrics
+    original_time = report_orig.metrics[wrappers.CYCLES]
+    version_time = report_mut.metrics[wrappers.CYCLES]
+    assert original_time
+    assert version_time
+    # The mutant opimizes the original.
+    if report_orig.samples and report_mut.samples:
+        # The improvement is significant according to a Welch test
+        faster = (
+            welch_greater(
+                report_orig.samples[wrappers.CYCLES],
+                report_mut.samples[wrappers.CYCLES],
+            )
+            < TAM_SIGNIFICANCE
+        )
+    else:
+        # We take a security offset of 1/TAM_MARGIN_FRACTION in order to be
+        # sure that the improvement is not just a sampling artifact.
+        fraction_of_original_time = int(original_time / TAM_MARGIN_FRACTION)
+        faster = version_time + fraction_of_original_time < original_time
+    if faster:
+        for counter in cast(list[str], report_orig.bottlenecks):
+            original_metric = report_orig.metrics[counter]
+            version_metric = report_mut.metrics[counter]
+            assert original_metric
+            assert version_metric
+            # The bottleneck is more saturated in the mutant.
+            # No need for security offset here because the point is made
+            # even if the bottleneck is just as saturated as the former
+            # one.
+            if version_metric > original_metric:
+                odd_bottlenecks.append(counter)
+
+    return odd_bottlenecks
+
+
+class Results:
+    def __init__(
+        self,
+        names: list[str],
+        originals: list[str],
+        compilers: list[str],
+        families: list[str],
+        disable_tam: bool,
+        enable_gus: bool,
+        enable_sensitivity: bool,
+    ):
+        self.disable_tam = disable_tam
+        self.enable_gus = enable_gus
+        self.enable_sensitivity = enable_sensitivity
+        self.rows = {n: i for i, n in enumerate(names)}
+        size = len(names)
+        self.name = np.array(names, dtype=object)
+        self.compiler = np.array(compilers, dtype=object)
+        self.family = np.array(families, dtype=object)
+        # The row of the original of each blueprint (its own on an original)
+        self.original = np.array([self.rows[o] for o in originals], dtype=np.intp)
+        # Whether each stage succeeded
+        self.tam = np.zeros(size, dtype=bool)
+        self.gus = np.zeros(size, dtype=bool)
+        self.sens = np.zeros(size, dtype=bool)
+        # The counters of TAM (their means over the repetitions)
+        self.counters = {c: np.full(size, np.nan) for c in wrappers.counters}
+        self.drilldown = np.full(size, None, dtype=object)
+        self.gus_cycles = np.full(size, np.nan)
+        self.sens_bottlenecks = np.full(size, None, dtype=object)
+        self.odd = {
+            TAM_BT_BUGGY_KW: np.full(size, None, dtype=object),
+            GUS_BT_BUGGY_KW: np.full(size, None, dtype=object),
+        }
+        # The resources consumed by the children of each stage
+        self.cpu = {s: np.full(size, np.nan) for s in ("tam", "gus", "sens")}
+        self.max_rss = {s: np.full(size, np.nan) for s in ("tam", "gus", "sens")}
+
+    @staticmethod
+    def of(
+        sorted_blueprints: dict[str, dict[str, list]],
+        disable_tam: bool,
+        enable_gus: bool,
+        enable_sensitivity: bool,
+    ) -> "Results":
+        rows = [
+            (b, compiler)
+            for compiler, matrix in sorted_blueprints.items()
+            for vector in matrix.values()
+            for b in vector
+        ]
+        return Results(
+            names=[b.binary for b, _ in rows],
+            originals=[b.original_binary for b, _ in rows],
+            compilers=[c for _, c in rows],
+            families=[path.splitext(path.basename(b.source_original))[0] for b, _ in rows],
+            disable_tam=disable_tam,
+            enable_gus=enable_gus,
+            enable_sensitivity=enable_sensitivity,
+        )
+
+    def _usage(self, stage: str, row: int, report: Report):
+        if report.usage:
+            self.cpu[stage][row] = report.usage.cpu
+            self.max_rss[stage][row] = report.usage.max_rss
+
+    def add_tam(self, name: str, report: Report):
+        row = self.rows[name]
+        self.tam[row] = report.success
+        if report.success:
+            for c in wrappers.counters:
+                self.counters[c][row] = float_of(report.metrics.get(c))
+            self.drilldown[row] = report.drilldown
+        self._usage("tam", row, report)
+
+    def add_gus(self, name: str, report: Report):
+        row = self.rows[name]
+        self.gus[row] = report.success
+        if report.success:
+            self.gus_cycles[row] = float_of(report.metrics.get(wrappers.CYCLES))
+        self._usage("gus", row, report)
+
+    def add_sens(self, name: str, report: Report):
+        row = self.rows[name]
+        self.sens[row] = report.success
+        if report.success:
+            self.sens_bottlenecks[row] = report.bottlenecks
+        self._usage("sens", row, report)
+
+    def add_odd(self, kw: str, odd_bottlenecks: dict[str, list[str]]):
+        for name, bottlenecks in odd_bottlenecks.items():
+            self.odd[kw][self.rows[name]] = bottlenecks
+
+    def gus_success(self) -> np.ndarray:
+        # As the reports of Gus combined with those of the sensitivity
+        # analysis, when both are enabled
+        if self.enable_gus and self.enable_sensitivity:
+            return self.gus & self.sens
+        return self.gus if self.enable_gus else self.sens
+
+    def relative_errors(self) -> np.ndarray:
+        perf = self.counters[wrappers.CYCLES]
+        return (self.gus_cycles - perf) / perf
+
+    def bottleneck_flags(self) -> dict[str, np.ndarray]:
+        # As wrappers.tma_percents, against wrappers.tma_thresholds
+        slots = self.counters[wrappers.SLOTS]
+        return {
+            c: (self.counters[c] / slots) * 100 >= t
+            for c, t in wrappers.tma_thresholds.items()
+        }
+
+    def bottlenecks(self, rows: np.ndarray) -> list[list[str]]:
+        flags = self.bottleneck_flags()
+        names = np.array(list(flags), dtype=object)
+        matrix = np.column_stack([flags[c][rows] for c in flags])
+        return [list(names[r]) for r in matrix]
+
+    def gus_mre(self) -> tuple[float, float]:
+        # The mean relative error of Gus over the blueprints on which both
+        # TAM and Gus worked, and the same without the errors beyond
+        # LIFT_MRE_DISMISS_BEYOND
+        measured = self.tam & self.gus_success() & ~np.isnan(self.gus_cycles)
+        errors = np.abs(self.relative_errors()[measured])
+        lifted = errors[errors < LIFT_MRE_DISMISS_BEYOND]
+        return (
+            round(float(errors.mean()), 2) if errors.size else np.nan,
+            round(float(lifted.mean()), 2) if lifted.size else np.nan,
+        )
+
+    def selected(self, names, fool_tam: bool) -> np.ndarray:
+        # The rows of the output: those of the given blueprints which all
+        # the enabled stages measured
+        mask = np.zeros(len(self.name), dtype=bool)
+        mask[[self.rows[n] for n in names]] = True
+        # Without the original, trying to fool TAM makes no sense
+        if fool_tam:
+            mask &= self.tam[self.original]
+        if not self.disable_tam:
+            mask &= self.tam
+        if self.enable_gus:
+            mask &= self.gus_success()
+        return mask
+
+    def table(
+        self,
+        names,
+        fool_tam: bool,
+        fool_gus: bool,
+        tma_level: int = 1,
+    ) -> pandas.DataFrame:
+        rows = np.flatnonzero(self.selected(names, fool_tam))
+        data = {NAME_KW: self.name[rows]}
+        if not self.disable_tam:
+            data[PERF_CYCLES_KW] = integers(self.counters[wrappers.CYCLES][rows])
+            data[TAM_BT_KW] = self.bottlenecks(rows)
+            if tma_level > 1:
+                data[TAM_DRILL_KW] = self.drilldown[rows]
+            if fool_tam:
+                data[TAM_BT_BUGGY_KW] = self.odd[TAM_BT_BUGGY_KW][rows]
+        if self.enable_gus:
+            data[GUS_CYCLES_KW] = integers(self.gus_cycles[rows])
+        if self.enable_sensitivity:
+            data[GUS_BT_KW] = self.sens_bottlenecks[rows]
+            if fool_gus:
+                data[GUS_BT_BUGGY_KW] = self.odd[GUS_BT_BUGGY_KW][rows]
+        if not self.disable_tam and self.enable_gus:
+            data[GUS_RE_KW] = np.round(self.relative_errors()[rows], 2)
+        # The resources consumed by the children (None if the report was
+        # reused): Gus and the sensitivity analysis together
+        if not self.disable_tam:
+            data[TAM_CPU_KW] = np.round(self.cpu["tam"][rows], 2)
+            data[TAM_RSS_KW] = integers(self.max_rss["tam"][rows])
+        if self.enable_gus or self.enable_sensitivity:
+            gus, sens = self.cpu["gus"][rows], self.cpu["sens"][rows]
+            cpu = np.where(np.isnan(gus) & np.isnan(sens), np.nan, np.nansum([gus, sens], axis=0))
+            data[GUS_CPU_KW] = np.round(cpu, 2)
+            data[GUS_RSS_KW] = integers(np.fmax(self.max_rss["gus"][rows], self.max_rss["sens"][rows]))
+        return pandas.DataFrame(data)
+
+    def families(self, names, fool_tam: bool) -> pandas.DataFrame:
+        # Per family (the original source) and compiler: the number of
+        # blueprints in the output, their median cycles, the share of them
+        # bound by each TAM bottleneck, and the mean relative error of Gus
+        rows = np.flatnonzero(self.selected(names, fool_tam))
+        data = {
+            FAMILY_KW: self.family[rows],
+            COMPILER_KW: self.compiler[rows],
+            COUNT_KW: np.ones(len(rows), dtype=np.int64),
+        }
+        if not self.disable_tam:
+            data[PERF_CYCLES_KW] = self.counters[wrappers.CYCLES][rows]
+            for c, flags in self.bottleneck_flags().items():
+                data[c] = flags[rows]
+        if not self.disable_tam and self.enable_gus:
+            data[GUS_MRE_KW] = np.abs(self.relative_errors()[rows])
+        aggregates = {k: "mean" for k in data if k not in (FAMILY_KW, COMPILER_KW)}
+        aggregates[COUNT_KW] = "sum"
+        if PERF_CYCLES_KW in aggregates:
+            aggregates[PERF_CYCLES_KW] = "median"
+        return (
+            pandas.DataFrame(data)
+            .groupby([FAMILY_KW, COMPILER_KW], sort=False)
+            .agg(aggregates)
+            .round(2)
+        )
@@ -0,0 +1,188 @@
+import concurrent.futures
+import heapq
+import math
+import statistics
+import time
+from typing import Callable, Tuple
+
+from ihm import print_debug
+from usage import Usage, ledger, shutdown, staged
+
+# A task returns (correct, path), like gus_it
+TaskResult = Tuple[bool, str]
+
+
+class Task:
+    def __init__(
+        self,
+        name: str,
+        stage: str,
+        function: Callable[[], TaskResult],
+        expected: float | None = None,
+    ):
+        self.name = name
+        self.stage = stage
+        self.function = function
+        self.children: list["Task"] = []
+        self.missing = 0
+        self.result: TaskResult | None = None
+        # Expected and actual wall times, in seconds
+        self.expected = expected
+        self.duration: float | None = None
+        # The resources consumed by its children
+        self.usage: Usage | None = None
+
+    def priority(self) -> float:
+        # Unknown durations go first: they may well be the longest ones
+        return math.inf if self.expected is None else self.expected
+
+
+# Dependency-graph executor. A task is launched as soon as all its
+# dependencies succeeded, within the concurrency limit of its stage. The
+# stages are given from upstream to downstream, and downstream tasks are
+# dispatched first so that results flow out as early as possible. Within a
+# stage, the longest expected tasks are started first, so that the run does
+# not end with a single long job on an otherwise idle machine.
+class Scheduler:
+
+    def __init__(self, limits: dict[str, int], verbose: bool = False):
+        self.limits = limits
+        self.verbose = verbose
+        self.tasks: dict[str, Task] = {}
+        self.ready: dict[str, list[Task]] = {s: [] for s in limits}
+        self.running: dict[str, int] = {s: 0 for s in limits}
+        # Added after one of their dependencies failed: reported by run
+        self.failed: list[Task] = []
+
+    def add(
+        self,
+        name: str,
+        stage: str,
+        function: Callable[[], TaskResult],
+        deps: list[Task] = [],
+        expected: float | None = None,
+    ) -> Task:
+        assert stage in self.limits, f"Unknown stage {stage}"
+        if name in self.tasks:
+            return self.tasks[name]
+        task = Task(name, stage, function, expected)
+        self.tasks[name] = task
+        for d in deps:
+            if d.result is None:
+                d.children.append(task)
+                task.missing += 1
+            elif not d.result[0] and task.result is None:
+                task.result = (False, f"{d.name} failed")
+        if task.result is not None:
+            self.failed.append(task)
+        elif task.missing == 0:
+            self.ready[stage].append(task)
+        return task
+
+    def _fail(self, task: Task, reason: str, on_done):
+        for c in task.children:
+            if c.result is None:
+                c.result = (False, reason)
+                if on_done:
+                    on_done(c, c.result)
+                self._fail(c, reason, on_done)
+
+    def _pop(self, stage: str) -> Task:
+        ready = self.ready[stage]
+        i = max(range(len(ready)), key=lambda i: ready[i].priority())
+        return ready.pop(i)
+
+    def _timed(self, task: Task) -> TaskResult:
+        start = time.monotonic()
+        with staged(task.stage):
+            try:
+                return task.function()
+            finally:
+                task.duration = time.monotonic() - start
+                task.usage = ledger.current()
+
+    def estimate(self) -> float:
+        # Simulate the run with the expected durations. The tasks of unknown
+        # duration are assumed to take the median of their stage.
+        medians = {}
+        for s in self.limits:
+            known = [t.expected for t in self.tasks.values() if t.stage == s and t.expected is not None]
+            medians[s] = statistics.median(known) if known else 0.0
+        def duration(t: Task) -> float:
+            return medians[t.stage] if t.expected is None else t.expected
+        missing = {n: t.missing for n, t in self.tasks.items()}
+        ready = {s: list(r) for s, r in self.ready.items()}
+        running = {s: 0 for s in self.limits}
+        events: list[tuple[float, int, Task]] = []
+        now = 0.0
+        count = 0
+        while True:
+            for s in list(self.limits)[::-1]:
+                ready[s].sort(key=Task.priority)
+                while ready[s] and running[s] < self.limits[s]:
+                    t = ready[s].pop()
+                    running[s] += 1
+                    count += 1
+                    heapq.heappush(events, (now + duration(t), count, t))
+            if not events:
+                return now
+            now, _, t = heapq.heappop(events)
+            running[t.stage] -= 1
+            for c in t.children:
+                missing[c.name] -= 1
+                if missing[c.name] == 0 and c.result is None:
+                    ready[c.stage].append(c)
+
+    def run(
+        self,
+        on_done: Callable[[Task, TaskResult], None] | None = None,
+    ) -> dict[str, TaskResult]:
+        stages_downstream_first = list(self.limits)[::-1]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=sum(self.limits.values())
+        ) as executor:
+            futures: dict[concurrent.futures.Future, Task] = {}
+            while True:
+                # Through on_done like any failure, so that the progress
+                # reaches the total
+                while self.failed:
+                    task = self.failed.pop(0)
+                    if on_done:
+                        on_done(task, task.result)
+                    self._fail(task, f"{task.name} failed", on_done)
+                # Fill the free slots of each stage
+                for s in stages_downstream_first:
+                    while self.ready[s] and self.running[s] < self.limits[s]:
+                        task = self._pop(s)
+                        self.running[s] += 1
+                        print_debug(self.verbose, f"[{s}] {task.name}")
+                        futures[executor.submit(self._timed, task)] = task
+                if not futures:
+                    break
+                try:
+                    done, _ = concurrent.futures.wait(
+                        futures, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                except KeyboardInterrupt:
+                    # The running tasks fail as soon as their children are
+                    # killed, and the others never start
+                    shutdown()
+                    executor.shutdown(cancel_futures=True)
+                    raise
+                for f in done:
+                    task = futures.pop(f)
+                    self.running[task.stage] -= 1
+                    try:
+                        task.result = f.result()
+                    except Exception as e:
+                        task.result = (False, f"{task.name}: {e}")
+                    if on_done:
+                        on_done(task, task.result)
+                    if not task.result[0]:
+                        self._fail(task, f"{task.name} failed", on_done)
+                        continue
+                    for c in task.children:
+                        c.missing -= 1
+                        if c.missing == 0 and c.result is None:
+                            self.ready[c.stage].append(c)
+        return {n: t.result for n, t in self.tasks.items() if t.result is not None}
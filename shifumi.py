@@ -2,31 +2,23 @@
 
 from os import path
 import os
-import sys
 import random
-import pandas
-from typing import Union, Tuple, cast
+from typing import Tuple
 from dataclasses import dataclass
-import concurrent.futures
 import time
 import shutil
+import shlex
 
 import ihm
 from ihm import print_debug
 import wrappers
 from text import Report
-
-TAM_MARGIN_FRACTION = 5
-LIFT_MRE_DISMISS_BEYOND = 10.0
-
-NAME_KW = "Benchmark"
-TAM_BT_BUGGY_KW = "Odd TAM bottlenecks"
-GUS_BT_BUGGY_KW = "Odd Gus bottlenecks"
-TAM_BT_KW = "TAM bottlenecks"
-GUS_BT_KW = "gus sens. bottlenecks"
-PERF_CYCLES_KW = "perf cycles"
-GUS_CYCLES_KW = "gus cycles"
-GUS_RE_KW = "gus relative error"
+from scheduler import Scheduler, Task
+from core_pool import CorePool
+from report_index import ReportIndex, indexed
+from history import History, history_key
+from usage import ledger
+from results import Results, TAM_BT_BUGGY_KW, GUS_BT_BUGGY_KW, odd_bottlenecks_between
 
 CC_TIMEOUT = 120  # two minutes
 
@@ -39,6 +31,7 @@ class Blueprint:
     fuzz_command_list: list[str] | None
     source: str
     compile_command_string: str
+    support_library: str
     binary: str
     gus_report_path: str
     sens_report_path: str
@@ -48,6 +41,11 @@ class Blueprint:
     def __eq__(self, other):
         return self.binary == self.binary
 
+    @property
+    def shared_object(self) -> str:
+        # The benchmark built to be measured in process
+        return f"{self.binary}.so"
+
 
 def fuzz_it(
     blueprint: Blueprint,
@@ -58,15 +56,18 @@ def fuzz_it(
         or blueprint.fuzz_command_list == None
     ):
         return
-    if use_cache and path.exists(blueprint.source):
+    if use_cache and not args.cas_dir and path.exists(blueprint.source):
         pass
     else:
-        res = wrappers.pocc_compile(
+        wrappers.pocc_compile(
             source=blueprint.source_original,
             destination=blueprint.source,
             compiler=blueprint.fuzz_command_list[0],
             compiler_options=blueprint.fuzz_command_list[1:],
             debug=args.debug,
+            cas_dir=args.cas_dir,
+            include=args.include_dir,
+            scratch_dir=args.scratch_dir,
         )
     return
 
@@ -78,15 +79,16 @@ def compile_it(
     use_cache: bool,
     linker_options: list[str],
     debug: bool,
+    cas_dir: str | None = None,
 ):
     if not path.exists(blueprint.source):
         print_debug(debug, f"CC aborted: {blueprint.source} does not exist.")
-    elif use_cache and path.exists(blueprint.binary):
+    elif use_cache and not cas_dir and path.exists(blueprint.binary):
         print_debug(debug, f"CC skipped: {blueprint.binary} exists.")
     else:
         dir_name = path.dirname(blueprint.source_original)
-        compile_command_list = blueprint.compile_command_string.split()
-        res = wrappers.compile(
+        compile_command_list = shlex.split(blueprint.compile_command_string)
+        wrappers.compile(
             source=blueprint.source,
             destination=blueprint.binary,
             include=include_dir + [dir_name],
@@ -96,18 +98,78 @@ def compile_it(
             linker_options=linker_options,
             timeout=CC_TIMEOUT,
             debug=debug,
+            cas_dir=cas_dir,
         )
     return
 
 
+def shared_it(
+    blueprint: Blueprint,
+    include_dir: list[str],
+    compile_with: list[str],
+    use_cache: bool,
+    linker_options: list[str],
+    debug: bool,
+    cas_dir: str | None = None,
+):
+    # The auxiliary C files are built in the shared object, position
+    # independent, rather than taken from the support library
+    if not path.exists(blueprint.source):
+        print_debug(debug, f"CC aborted: {blueprint.source} does not exist.")
+    elif use_cache and not cas_dir and path.exists(blueprint.shared_object):
+        print_debug(debug, f"CC skipped: {blueprint.shared_object} exists.")
+    else:
+        dir_name = path.dirname(blueprint.source_original)
+        compile_command_list = shlex.split(blueprint.compile_command_string)
+        wrappers.compile(
+            source=blueprint.source,
+            destination=blueprint.shared_object,
+            include=include_dir + [dir_name],
+            compile_with=compile_with,
+            compiler=compile_command_list[0],
+            compiler_options=compile_command_list[1:] + wrappers.SHARED_KERNEL_OPTIONS,
+            linker_options=linker_options,
+            timeout=CC_TIMEOUT,
+            debug=debug,
+            cas_dir=cas_dir,
+        )
+
+
+def library_it(
+    blueprint: Blueprint,
+    include_dir: list[str],
+    compile_with: list[str],
+    use_cache: bool,
+    debug: bool,
+    cas_dir: str | None = None,
+    scratch_dir: str | None = None,
+):
+    if use_cache and not cas_dir and path.exists(blueprint.support_library):
+        print_debug(debug, f"CC skipped: {blueprint.support_library} exists.")
+        return
+    compile_command_list = shlex.split(blueprint.compile_command_string)
+    wrappers.compile_library(
+        sources=compile_with,
+        destination=blueprint.support_library,
+        include=include_dir,
+        compiler=compile_command_list[0],
+        compiler_options=compile_command_list[1:],
+        timeout=CC_TIMEOUT,
+        debug=debug,
+        cas_dir=cas_dir,
+        scratch_dir=scratch_dir,
+    )
+
+
 def compile_it_parallel(blueprint, args):
     compile_it(
         blueprint=blueprint,
         include_dir=args.include_dir,
-        compile_with=args.always_link_with,
+        compile_with=[blueprint.support_library] if args.always_link_with else [],
         use_cache=args.use_cache,
         linker_options=args.linker_options,
         debug=args.debug,
+        cas_dir=args.cas_dir,
     )
 
 
@@ -118,6 +180,8 @@ def gus_it(
     l3_size: str,
     use_cache: bool,
     debug: bool,
+    cas_dir: str | None = None,
+    timeout: int = wrappers.GUS_TIMEOUT,
 ) -> Report:
     if not path.exists(blueprint.binary):
         print_debug(debug, f"Gus aborted: {blueprint.binary} does not exist.")
@@ -137,11 +201,13 @@ def gus_it(
             gus_report_path=blueprint.gus_report_path,
             use_cache=use_cache,
             debug=debug,
+            cas_dir=cas_dir,
+            timeout=timeout,
         )
     return gus_report
 
 
-def gus_it_parallel(blueprint, args):
+def gus_it_parallel(blueprint, args, timeout=wrappers.GUS_TIMEOUT):
     gus_report = gus_it(
         blueprint=blueprint,
         l1_size=args.l1_size,
@@ -149,10 +215,66 @@ def gus_it_parallel(blueprint, args):
         l3_size=args.l3_size,
         use_cache=args.use_cache,
         debug=args.debug,
+        cas_dir=args.cas_dir,
+        timeout=timeout,
     )
     return blueprint.binary, gus_report
 
 
+def sens_it(
+    blueprint: Blueprint,
+    l1_size: str,
+    l2_size: str,
+    l3_size: str,
+    use_cache: bool,
+    debug: bool,
+    cas_dir: str | None = None,
+    render_pdf: bool = False,
+    scratch_dir: str | None = None,
+    timeout: int = wrappers.SENS_TIMEOUT,
+) -> Report:
+    if not path.exists(blueprint.binary):
+        print_debug(debug, f"Sens. aborted: {blueprint.binary} does not exist.")
+        sens_report = Report(
+            success=False,
+            desc=wrappers.SENS_REPORT,
+            benchmark=blueprint.binary,
+        )
+    else:
+        print_debug(debug, f"Sens. report on {blueprint.binary}.")
+        sens_report = wrappers.gus_sensitivity(
+            executable_path=blueprint.binary,
+            l1_size=l1_size,
+            l2_size=l2_size,
+            l3_size=l3_size,
+            kernel=blueprint.kernel,
+            sens_report_path=blueprint.sens_report_path,
+            use_cache=use_cache,
+            debug=debug,
+            cas_dir=cas_dir,
+            render_pdf=render_pdf,
+            scratch_dir=scratch_dir,
+            timeout=timeout,
+        )
+    return sens_report
+
+
+def sens_it_parallel(blueprint, args, timeout=wrappers.SENS_TIMEOUT):
+    sens_report = sens_it(
+        blueprint=blueprint,
+        l1_size=args.l1_size,
+        l2_size=args.l2_size,
+        l3_size=args.l3_size,
+        use_cache=args.use_cache,
+        debug=args.debug,
+        cas_dir=args.cas_dir,
+        render_pdf=args.render_pdf,
+        scratch_dir=args.scratch_dir,
+        timeout=timeout,
+    )
+    return blueprint.binary, sens_report
+
+
 def tam_it(
     blueprint: Blueprint,
     disable_tam: bool,
@@ -162,6 +284,16 @@ def tam_it(
     lib_huge: str,
     core: int,
     debug: bool,
+    node: int | None = None,
+    repetitions_min: int = 1,
+    repetitions_max: int = 1,
+    ci_target: float = 0.01,
+    ci_level: float = 0.95,
+    perf_format: str = wrappers.PERF_TABLE,
+    tma_level: int = 1,
+    kernel_window: bool = False,
+    in_process: bool = False,
+    huge_pages: str | None = None,
 ) -> Report:
     if disable_tam:
         tam_report = Report(
@@ -172,6 +304,21 @@ def tam_it(
         tam_report = Report(
             success=False, desc=wrappers.TAM_REPORT, benchmark=blueprint.binary
         )
+    elif in_process:
+        print_debug(debug, f"Apply TAM on {blueprint.shared_object}.")
+        tam_report = wrappers.pipedream_tam_l1(
+            shared_object=blueprint.shared_object,
+            report_path=blueprint.perf_report_path,
+            reuse_perf_reports=reuse_perf_reports,
+            core=core,
+            debug=debug,
+            node=node,
+            repetitions_min=repetitions_min,
+            repetitions_max=repetitions_max,
+            ci_target=ci_target,
+            ci_level=ci_level,
+            huge_pages=huge_pages,
+        )
     else:
         print_debug(debug, f"Apply TAM on {blueprint.binary}.")
         tam_report = wrappers.perf_tam_l1(
@@ -184,6 +331,15 @@ def tam_it(
             lib_huge=lib_huge,
             core=core,
             debug=debug,
+            node=node,
+            repetitions_min=repetitions_min,
+            repetitions_max=repetitions_max,
+            ci_target=ci_target,
+            ci_level=ci_level,
+            perf_format=perf_format,
+            tma_level=tma_level,
+            kernel_window=kernel_window,
+            huge_pages=huge_pages,
         )
     return tam_report
 
@@ -246,120 +402,15 @@ def suspicious_bottlenecks_of(
     blueprint: Blueprint,
     reports: dict[str, Report],
 ) -> list[str]:
-    report_orig = reports[blueprint.original_binary]
-    report_mut = reports[blueprint.binary]
-    odd_bottlenecks = []
-    assert report_orig.metrics
-    assert report_mut.metrics
-    original_time = report_orig.metrics[wrappers.CYCLES]
-    version_time = report_mut.metrics[wrappers.CYCLES]
-    assert original_time
-    assert version_time
-    # The mutant opimizes the original.
-    # We take a security offset of 1/TAM_MARGIN_FRACTION in order to be sure
-    # that the improvement is not just a sampling artifact.
-    fraction_of_original_time = int(original_time / TAM_MARGIN_FRACTION)
-    if version_time + fraction_of_original_time < original_time:
-        for counter in cast(list[str], report_orig.bottlenecks):
-            original_metric = report_orig.metrics[counter]
-            version_metric = report_mut.metrics[counter]
-            assert original_metric
-            assert version_metric
-            # The bottleneck is more saturated in the mutant.
-            # No need for security offset here because the point is made
-            # even if the bottleneck is just as saturated as the former
-            # one.
-            if version_metric > original_metric:
-                odd_bottlenecks.append(counter)
-
-    return odd_bottlenecks
-
-
-def pack_data(
-    all_blueprints: dict[str, Blueprint],
-    sorted_blueprints: dict[str, dict[str, list[Blueprint]]],
-    tam_reports: dict[str, Report],
-    tam_buggy: dict[str, list[str]],
-    gus_buggy: dict[str, list[str]],
-    enable_gus: bool,
-    enable_sensitivity: bool,
-    gus_reports: dict[str, Report],
-    disable_tam: bool,
-    fool_tam: bool,
-    fool_gus: bool,
-):
-    data = {NAME_KW: []}
-    if not disable_tam:
-        data[PERF_CYCLES_KW] = []
-        data[TAM_BT_KW] = []
-        if fool_tam:
-            data[TAM_BT_BUGGY_KW] = []
-    if enable_gus:
-        data[GUS_CYCLES_KW] = []
-    if enable_sensitivity:
-        data[GUS_BT_KW] = []
-        if fool_gus:
-            data[GUS_BT_BUGGY_KW] = []
-    if not disable_tam and enable_gus:
-        data[GUS_RE_KW] = []
+    return odd_bottlenecks_between(
+        reports[blueprint.original_binary], reports[blueprint.binary]
+    )
 
-    for compiler, matrix in sorted_blueprints.items():
-        for original, vector in matrix.items():
-            # Skip the whole row if you are trying to fool the TAM and the
-            # original benchmark is missing
-            if fool_tam and not tam_reports[original].success:
-                continue
-            for blueprint in vector:
-                name = blueprint.binary
 
-                # Pre-conditions
-                has_been_pruned = name not in all_blueprints
-                tam_failed = not disable_tam and (
-                    name not in tam_reports or not tam_reports[name].success
-                )
-                gus_failed = enable_gus and (
-                    name not in gus_reports or not gus_reports[name].success
-                )
-                if has_been_pruned or tam_failed or gus_failed:
-                    continue
-
-                data[NAME_KW].append(blueprint.binary)
-
-                if not disable_tam:
-                    # TAM data
-                    tam_metrics = cast(dict[str, int], tam_reports[name].metrics)
-                    data[PERF_CYCLES_KW] += [tam_metrics[wrappers.CYCLES]]
-                    data[TAM_BT_KW] += [tam_reports[name].bottlenecks]
-                    # The buggy bottlenecks
-                    if fool_tam:
-                        if name in tam_buggy:
-                            data[TAM_BT_BUGGY_KW] += [tam_buggy[name]]
-                        else:
-                            data[TAM_BT_BUGGY_KW] += [None]
-                if enable_gus:
-                    # Gus data
-                    gus_metrics = cast(dict[str, int], gus_reports[name].metrics)
-                    data[GUS_CYCLES_KW] += [gus_metrics[wrappers.CYCLES]]
-                if enable_sensitivity:
-                    # Sensitivity data
-                    data[GUS_BT_KW] += [gus_reports[name].bottlenecks]
-                    if fool_tam:
-                        if name in gus_buggy:
-                            data[GUS_BT_BUGGY_KW] += [gus_buggy[name]]
-                        else:
-                            data[GUS_BT_BUGGY_KW] += [None]
-                if not disable_tam and enable_gus:
-                    # The relative error of gus prediction
-                    gus_metrics = cast(dict[str, int], gus_reports[name].metrics)
-                    tam_metrics = cast(dict[str, int], tam_reports[name].metrics)
-                    gus_attempt = gus_metrics[wrappers.CYCLES]
-                    perf_truth = tam_metrics[wrappers.CYCLES]
-                    assert gus_attempt
-                    assert perf_truth
-                    relative_error = round((gus_attempt - perf_truth) / perf_truth, 2)
-                    data[GUS_RE_KW] += [relative_error]
-    df = pandas.DataFrame(data)
-    return df
+def combined(*values):
+    # The sum of those known (raw reports, usages)
+    known = [v for v in values if v is not None]
+    return sum(known[1:], known[0]) if known else None
 
 
 def enumerate_blueprints(
@@ -427,6 +478,8 @@ def enumerate_blueprints(
             basename = path.basename(original)
             dirname = path.dirname(original)
             radical, ext = path.splitext(basename)
+            # The --always-link-with sources, built once per compiler
+            support_library = f"{build_directory}/libsupport.{csuffix}.a"
             # The true non-mutant original
             binary_base = f"{radical}.{csuffix}"
             original_binary = f"{build_directory}/{binary_base}"
@@ -441,6 +494,7 @@ def enumerate_blueprints(
                 fuzz_command_list=None,
                 source=original,
                 compile_command_string=ccommand,
+                support_library=support_library,
                 binary=original_binary,
                 kernel=kernel,
                 gus_report_path=original_gus_report,
@@ -461,9 +515,10 @@ def enumerate_blueprints(
                 blueprint = Blueprint(
                     source_original=original,
                     original_binary=original_binary,
-                    fuzz_command_list=fcommand.split(),
+                    fuzz_command_list=shlex.split(fcommand),
                     source=fuzzed_path,
                     compile_command_string=ccommand,
+                    support_library=support_library,
                     binary=binary,
                     kernel=kernel,
                     gus_report_path=gus_report,
@@ -477,6 +532,191 @@ def enumerate_blueprints(
     return all_blueprints, of_compilers
 
 
+def schedule_blueprint(
+    scheduler: Scheduler,
+    blueprint: Blueprint,
+    tam_reports: dict[str, Report],
+    detailed_reports: dict[str, Report],
+    sens_reports: dict[str, Report],
+    results: Results,
+    index: ReportIndex,
+    pool: CorePool,
+    history: History,
+    args,
+) -> list[Task]:
+    # The raw reports reused as such are not parsed again
+    reuse_gus_reports = args.use_cache and not args.cas_dir
+
+    def fuzz():
+        fuzz_it(blueprint=blueprint, use_cache=args.use_cache)
+        return path.exists(blueprint.source), blueprint.source
+
+    def build_library():
+        library_it(
+            blueprint=blueprint,
+            include_dir=args.include_dir,
+            compile_with=args.always_link_with,
+            use_cache=args.use_cache,
+            debug=args.debug,
+            cas_dir=args.cas_dir,
+            scratch_dir=args.scratch_dir,
+        )
+        return path.exists(blueprint.support_library), blueprint.support_library
+
+    def build():
+        compile_it_parallel(blueprint, args)
+        if args.in_process:
+            shared_it(
+                blueprint=blueprint,
+                include_dir=args.include_dir,
+                compile_with=args.always_link_with,
+                use_cache=args.use_cache,
+                linker_options=args.linker_options,
+                debug=args.debug,
+                cas_dir=args.cas_dir,
+            )
+            if not path.exists(blueprint.shared_object):
+                return False, blueprint.shared_object
+        return path.exists(blueprint.binary), blueprint.binary
+
+    def measure():
+        with pool.reserve() as (core, node):
+            return tam_it(
+                blueprint=blueprint,
+                disable_tam=args.disable_tam,
+                tma_scope_install_dir=args.tma_scope_install_dir,
+                reuse_perf_reports=args.reuse_perf_reports,
+                use_huge_pages=args.use_huge_pages,
+                lib_huge=args.lib_huge,
+                core=core,
+                debug=args.debug,
+                node=node,
+                repetitions_min=args.repetitions_min,
+                repetitions_max=args.repetitions_max,
+                ci_target=args.ci_target,
+                ci_level=args.ci_level,
+                perf_format=args.perf_format,
+                tma_level=args.tma_level,
+                kernel_window=args.kernel_window,
+                in_process=args.in_process,
+                huge_pages=args.huge_pages,
+            )
+
+    def tam():
+        tam_report = indexed(
+            index,
+            blueprint.perf_report_path,
+            args.reuse_perf_reports,
+            measure,
+        )
+        tam_report.usage = ledger.current()
+        tam_reports[blueprint.binary] = tam_report
+        results.add_tam(blueprint.binary, tam_report)
+        tam_report.print(args.verbose_output)
+        return tam_report.success, blueprint.binary
+
+    def gus():
+        binary = blueprint.binary
+        gus_report = indexed(
+            index,
+            blueprint.gus_report_path,
+            reuse_gus_reports,
+            lambda: gus_it_parallel(blueprint, args, gus_timeout)[1],
+        )
+        gus_report.usage = ledger.current()
+        detailed_reports[binary] = gus_report
+        results.add_gus(binary, gus_report)
+        gus_report.print(args.verbose_output)
+        return gus_report.success, binary
+
+    def sens():
+        binary = blueprint.binary
+        sens_report = indexed(
+            index,
+            blueprint.sens_report_path,
+            reuse_gus_reports,
+            lambda: sens_it_parallel(blueprint, args, sens_timeout)[1],
+        )
+        sens_report.usage = ledger.current()
+        sens_reports[binary] = sens_report
+        results.add_sens(binary, sens_report)
+        sens_report.print(args.verbose_output)
+        return sens_report.success, binary
+
+    # The longest expected tasks are started first, and the simulations get
+    # their timeouts from the previous runs
+    key = path.basename(blueprint.binary)
+    gus_timeout = history.timeout(key, "gus", wrappers.GUS_TIMEOUT)
+    sens_timeout = history.timeout(key, "sens", wrappers.SENS_TIMEOUT)
+    # The fuzzed source is shared by the blueprints of all the compilers: the
+    # scheduler merges the tasks of the same name
+    deps = []
+    if blueprint.fuzz_command_list != None:
+        deps = [
+            scheduler.add(
+                name=blueprint.source,
+                stage="fuzz",
+                function=fuzz,
+                expected=history.expected(path.basename(blueprint.source), "fuzz"),
+            )
+        ]
+    # The support library is shared by all the blueprints of a compiler
+    if args.always_link_with:
+        deps.append(
+            scheduler.add(
+                name=blueprint.support_library,
+                stage="compile",
+                function=build_library,
+                expected=history.expected(
+                    path.basename(blueprint.support_library), "compile"
+                ),
+            )
+        )
+    compile_task = scheduler.add(
+        name=blueprint.binary,
+        stage="compile",
+        function=build,
+        deps=deps,
+        expected=history.expected(key, "compile"),
+    )
+    # The tasks of the blueprint itself: its row is complete once they are
+    # all done
+    tasks = [compile_task]
+    deps = [compile_task]
+    if not args.disable_tam:
+        deps = [
+            scheduler.add(
+                name=f"{blueprint.binary}.tam",
+                stage="tam",
+                function=tam,
+                deps=deps,
+                expected=history.expected(key, "tam"),
+            )
+        ]
+        tasks += deps
+    if args.enable_gus:
+        tasks.append(
+            scheduler.add(
+                name=f"{blueprint.binary}.gus",
+                stage="gus",
+                function=gus,
+                deps=deps,
+                expected=history.expected(key, "gus"),
+            )
+        )
+    if args.enable_sensitivity:
+        tasks.append(
+            scheduler.add(
+                name=f"{blueprint.binary}.sens",
+                stage="sens",
+                function=sens,
+                deps=deps,
+                expected=history.expected(key, "sens"),
+            )
+        )
+    return tasks
+
+
 def main(args):
     
     for s in args.sources:
@@ -519,84 +759,133 @@ def main(args):
                     original_blueprints[b.original_binary] = all_blueprints[b.original_binary]
         all_blueprints = {**original_blueprints, **sampled_blueprints}
 
-    # Fuzz.  Parallelism is not a good idea because Pluto is messy.
-    fuzz_tot = len(all_blueprints)
-    fuzz_num = 1
-    for _, blueprint in all_blueprints.items():
-        print_debug(args.debug, f"Fuzz {blueprint.source} ({fuzz_num}/{fuzz_tot}).")
-        fuzz_it(blueprint=blueprint, use_cache=args.use_cache)
-        fuzz_num += 1
-
-    # Compile.
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {
-            executor.submit(compile_it_parallel, blueprint, args)
-            for _, blueprint in all_blueprints.items()
-        }
-        for future in concurrent.futures.as_completed(futures):
-            future.result()
-
-    # perf/TAM.
+    # Fuzz, compile, TAM, Gus and sensitivity, each blueprint flowing through
+    # the stages as soon as its own inputs are ready.
     tam_reports = {}
-    blueprints_for_gus = {}
+    detailed_reports = {}
+    sens_reports = {}
+    results = Results.of(
+        sorted_blueprints,
+        disable_tam=args.disable_tam,
+        enable_gus=args.enable_gus,
+        enable_sensitivity=args.enable_sensitivity,
+    )
+    # The measurements run concurrently, one per reserved core
+    pool = CorePool(args.perf_cores if args.perf_cores else [args.perf_core])
+    history = History(
+        args.history or f"{args.reports_directory}/history.sqlite", args.debug
+    )
+    index = ReportIndex(
+        args.reports_index or f"{args.reports_directory}/report_index.sqlite"
+    )
+    scheduler = Scheduler(
+        limits={
+            # Each Pluto run works in its own scratch directory
+            "fuzz": args.fuzz_jobs,
+            "compile": args.compile_jobs,
+            "tam": len(pool.cores),
+            "gus": args.gus_jobs,
+            "sens": args.sens_jobs,
+        },
+        verbose=args.debug,
+    )
+    # The blueprint of each of its own tasks, and how many are not done yet
+    owners = {}
+    remaining = {}
     for _, blueprint in all_blueprints.items():
-        tam_report = tam_it(
+        tasks = schedule_blueprint(
+            scheduler=scheduler,
             blueprint=blueprint,
-            disable_tam=args.disable_tam,
-            tma_scope_install_dir=args.tma_scope_install_dir,
-            reuse_perf_reports=args.reuse_perf_reports,
-            use_huge_pages=args.use_huge_pages,
-            lib_huge=args.lib_huge,
-            core=args.perf_core,
-            debug=args.debug,
+            tam_reports=tam_reports,
+            detailed_reports=detailed_reports,
+            sens_reports=sens_reports,
+            results=results,
+            index=index,
+            pool=pool,
+            history=history,
+            args=args,
         )
-        tam_reports[blueprint.binary] = tam_report
-        tam_report.print(args.verbose_output)
-        if tam_report.success:
-            blueprints_for_gus[blueprint.binary] = blueprint
+        owners.update({t.name: blueprint.binary for t in tasks})
+        remaining[blueprint.binary] = len(tasks)
+    count = 0
+    total = len(scheduler.tasks)
+    unknown = sum(1 for t in scheduler.tasks.values() if t.expected is None)
+    print_debug(
+        args.debug,
+        f"Estimated makespan: {scheduler.estimate():.0f}s ({unknown}/{total} tasks without history)",
+    )
+
+    # The rows are written as they complete, then the file is rewritten at
+    # the end, in the order of the blueprints, with the odd bottlenecks (and
+    # without the versions on whose original TAM failed, with --fool-tam)
+    csv_stream = None
+    streamed = 0
+
+    def table(names, fool_tam):
+        return results.table(
+            names=names,
+            fool_tam=fool_tam,
+            fool_gus=args.fool_gus,
+            tma_level=args.tma_level,
+        )
+
+    def stream_row(binary):
+        nonlocal streamed
+        row = table([binary], fool_tam=False)
+        row.index = range(streamed, streamed + len(row))
+        streamed += len(row)
+        row.to_csv(csv_stream, header=False)
+        csv_stream.flush()
+
+    def on_done(task, result):
+        nonlocal count
+        count += 1
+        # Only the tasks which spawned their tool (not the cache hits)
+        if task.usage is not None:
+            key = history_key(task.name, task.stage)
+            history.record(key, task.stage, task.duration, result[0])
+            history.record_usage(key, task.stage, task.usage)
+        status = "ok" if result[0] else "failed"
+        print_debug(args.debug, f"{count}/{total} - [{task.stage}] {task.name}: {status}")
+        # The row of the blueprint, as soon as all its stages are done
+        binary = owners.get(task.name)
+        if binary is not None:
+            remaining[binary] -= 1
+            if remaining[binary] == 0 and csv_stream:
+                stream_row(binary)
+
+    if args.csv_output:
+        csv_stream = open(args.csv_output, "w")
+        table([], fool_tam=False).to_csv(csv_stream)
+    try:
+        scheduler.run(on_done)
+    finally:
+        if csv_stream:
+            csv_stream.close()
+    index.close()
+    history.close()
+    # The blueprints that did not make it to TAM, Gus or the sensitivity
+    # analysis
+    for n, blueprint in all_blueprints.items():
+        if n not in tam_reports:
+            tam_reports[n] = Report(
+                success=False, desc=wrappers.TAM_REPORT, benchmark=blueprint.binary
+            )
+        if args.enable_gus and n not in detailed_reports:
+            detailed_reports[n] = Report(
+                success=False, desc=wrappers.GUS_REPORT, benchmark=blueprint.binary
+            )
+        if args.enable_sensitivity and n not in sens_reports:
+            sens_reports[n] = Report(
+                success=False, desc=wrappers.SENS_REPORT, benchmark=blueprint.binary
+            )
+    # Gus (fed only by benchmarks on which TAM works)
     if args.disable_tam:
         blueprints_for_gus = all_blueprints
-    # Gus (fed only by benchmarks on which TAM works)
-    # Detailed reports
-    detailed_reports = {}
-    if args.enable_gus:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {
-                executor.submit(gus_it_parallel, blueprint, args)
-                for _, blueprint in blueprints_for_gus.items()
-            }
-            for future in concurrent.futures.as_completed(futures):
-                binary, gus_report = future.result()
-                detailed_reports[binary] = gus_report
-                detailed_reports[binary].print(args.verbose_output)
-    sens_reports = {}
-    # Sensitivity
-    if args.enable_sensitivity:
-        sens_tot = len(blueprints_for_gus)
-        sens_num = 1
-        for n,blueprint in blueprints_for_gus.items():
-            print_debug(args.debug, f"Sens. {n} ({sens_num}/{sens_tot}).")
-            sens_num += 1
-            if not path.exists(blueprint.binary):
-                print_debug(args.debug, f"Sens. aborted: {blueprint.binary} does not exist.")
-                gus_report = Report(
-                    success=False,
-                    desc=wrappers.GUS_REPORT,
-                    benchmark=blueprint.binary,
-                )
-            else:
-                gus_report = wrappers.gus_sensitivity(
-                    executable_path=blueprint.binary,
-                    l1_size=args.l1_size,
-                    l2_size=args.l2_size,
-                    l3_size=args.l3_size,
-                    kernel=blueprint.kernel,
-                    sens_report_path=blueprint.sens_report_path,
-                    use_cache=args.use_cache,
-                    debug=args.debug,
-                )
-                sens_reports[blueprint.binary] = gus_report
-                sens_reports[blueprint.binary].print(args.verbose_output)
+    else:
+        blueprints_for_gus = {
+            n: b for n, b in all_blueprints.items() if tam_reports[n].success
+        }
     gus_reports = {}
     if args.enable_sensitivity and args.enable_gus:
         for n,b in sens_reports.items():
@@ -606,40 +895,20 @@ def main(args):
                     desc = f"{wrappers.GUS_REPORT} + {wrappers.SENS_REPORT}",
                     benchmark = n,
                     bottlenecks = sens_reports[n].bottlenecks,
-                    metrics = {**sens_reports[n].metrics,**detailed_reports[n].metrics},
-                    report = sens_reports[n].metrics + detailed_reports[n].report,
+                    metrics = {**(sens_reports[n].metrics or {}),**(detailed_reports[n].metrics or {})},
+                    report = combined(sens_reports[n].report, detailed_reports[n].report),
+                    usage = combined(sens_reports[n].usage, detailed_reports[n].usage),
+                    timed_out = sens_reports[n].timed_out or detailed_reports[n].timed_out,
                 )
     elif args.enable_sensitivity:
         gus_reports = sens_reports
     elif args.enable_gus:
         gus_reports = detailed_reports
-    # Compute the mean relative error for gus
-    sum_relative_errors = 0.0
-    sum_relative_errors_lifted = 0.0
-    count = 0
-    count_lifted = 0
-    if args.enable_gus and not args.disable_tam:
-        for _, b in blueprints_for_gus.items():
-            name = b.binary
-            if not gus_reports[name].success:
-                continue
-            gus_metrics = cast(dict[str, int], gus_reports[name].metrics)
-            tam_metrics = cast(dict[str, int], tam_reports[name].metrics)
-            gus_attempt = gus_metrics[wrappers.CYCLES]
-            perf_truth = tam_metrics[wrappers.CYCLES]
-            relative_error = abs(gus_attempt - perf_truth) / perf_truth
-            sum_relative_errors += relative_error
-            count += 1
-            if relative_error < LIFT_MRE_DISMISS_BEYOND:
-                sum_relative_errors_lifted += relative_error
-                count_lifted += 1
-            mean_relative_error = round(sum_relative_errors / count, 2)
-            mean_relative_error_lifted = round(
-                sum_relative_errors_lifted / count_lifted, 2
-            )
-            if args.verbose_output:
-                print(f"Gus MRE: {mean_relative_error}")
-                print(f"Gus MRE lifted: {mean_relative_error_lifted}")
+    # The mean relative error of Gus
+    if args.enable_gus and not args.disable_tam and args.verbose_output:
+        mean_relative_error, mean_relative_error_lifted = results.gus_mre()
+        print(f"Gus MRE: {mean_relative_error}")
+        print(f"Gus MRE lifted: {mean_relative_error_lifted}")
 
     # Find odd bottlenecks
     tam_buggy = {}
@@ -654,23 +923,19 @@ def main(args):
             all_blueprints=blueprints_for_gus,
             reports=gus_reports,
         )
+    results.add_odd(TAM_BT_BUGGY_KW, tam_buggy)
+    results.add_odd(GUS_BT_BUGGY_KW, gus_buggy)
 
     # Produce the output
     if args.csv_output:
-        df = pack_data(
-            all_blueprints=all_blueprints,
-            sorted_blueprints=sorted_blueprints,
-            tam_reports=tam_reports,
-            tam_buggy=tam_buggy,
-            gus_buggy=gus_buggy,
-            enable_gus=args.enable_gus,
-            enable_sensitivity=args.enable_sensitivity,
-            gus_reports=gus_reports,
-            disable_tam=args.disable_tam,
-            fool_tam=args.fool_tam,
-            fool_gus = args.fool_gus,
-        )
-        df.to_csv(args.csv_output)
+        table(all_blueprints, fool_tam=args.fool_tam).to_csv(args.csv_output)
+    if args.families_output:
+        results.families(all_blueprints, args.fool_tam).to_csv(args.families_output)
+    # The resources consumed, by stage and by tool
+    if args.debug:
+        ledger.print()
+    if args.usage_output:
+        ledger.write_csv(args.usage_output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from text import parse_int
+from wrappers import counters, perf_scanner
+
+
+def generate_reports(directory: str, count: int, output_lines: int, seed: int):
+    # perf stat reports preceded by the output of the benchmark
+    random.seed(seed)
+    for i in range(count):
+        with open(os.path.join(directory, f"bench{i}.perf"), "w") as f:
+            for _ in range(output_lines):
+                f.write(f"{random.random():.6f} {random.random():.6f}\n")
+            f.write(f"\n Performance counter stats for './bench{i}':\n\n")
+            for c in counters:
+                f.write(f"{random.randrange(10**12):>20,}      {c}\n")
+            f.write(f"\n       {random.random():.9f} seconds time elapsed\n")
+
+
+def parse_int_per_counter(path: str) -> dict[str, int | None]:
+    # The former parser: the whole report, then one scan per counter
+    with open(path, "r") as f:
+        report = f.read()
+    return {c: parse_int("(.*)" + c, report) for c in counters}
+
+
+def parse_single_pass(path: str) -> dict[str, int | None]:
+    with open(path, "r") as f:
+        return perf_scanner.scan(f)
+
+
+def measure(parser: callable, paths: list[str], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        for p in paths:
+            parser(p)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the perf report parsers"
+    )
+    parser.add_argument(
+        "--reports_directory",
+        help="Directory of .perf reports (default: generated ones)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--generate", help="Number of reports to generate", type=int, default=5000
+    )
+    parser.add_argument(
+        "--output_lines",
+        help="Lines of benchmark output in each generated report",
+        type=int,
+        default=200,
+    )
+    parser.add_argument("--repeat", help="Best of this many runs", type=int, default=5)
+    parser.add_argument(
+        "--seed", help="Seed for random number generator", type=int, default=0
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="reports-") as scratch:
+        directory = args.reports_directory
+        if directory is None:
+            directory = scratch
+            generate_reports(directory, args.generate, args.output_lines, args.seed)
+        paths = sorted(glob.glob(os.path.join(directory, "*.perf")))
+        size = sum(os.path.getsize(p) for p in paths)
+
+        # Both parsers must agree before being compared
+        for p in paths:
+            assert parse_int_per_counter(p) == {
+                c: parse_single_pass(p).get(c) for c in counters
+            }, p
+
+        print(f"{len(paths)} reports, {size / 2**20:.1f} MiB")
+        for name, fn in [
+            ("parse_int per counter", parse_int_per_counter),
+            ("single pass", parse_single_pass),
+        ]:
+            elapsed = measure(fn, paths, args.repeat)
+            print(
+                f"{name:>22}: {len(paths) / elapsed:10.0f} reports/s"
+                + f" {size / 2**20 / elapsed:8.1f} MiB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,12 @@ import os
 import multiprocessing
 import glob
 import subprocess
+import sys
 from timeit import default_timer as timer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import usage
+
 def run_gus(executable, gem5scripts_directory, output_directory, gus_directory):
     file_name = os.path.basename(executable)
     gus_path = os.path.join(gus_directory, 'gem5.fast')
@@ -15,20 +19,32 @@ def run_gus(executable, gem5scripts_directory, output_directory, gus_directory):
     command = [gem5_executable, '--outdir', output_directory, script, '--processor_type', 'skx', '--bench', executable, '--args']
     try:
         start_time = timer()
-        subprocess.run(command, check=True)
+        _, used = usage.run(command, check=True)
         end_time = timer()
 
         with open(os.path.join(output_directory, 'time'), 'w') as f:
             f.write('gus_runtime_seconds {}\n'.format(end_time - start_time))
+            f.write(used.lines('gus'))
     except subprocess.CalledProcessError as e:
         print('Error running gus on {}'.format(executable))
         print('Error: {}'.format(e))
         return 
 
+def run_gus_accounted(*args):
+    # The children of the job (the retries and the failed runs too), for the
+    # parent: the ledger of the worker is lost with it
+    with usage.staged('gem5'):
+        run_gus(*args)
+        return usage.ledger.current()
+
 def run_gem5_parallel(input_dir, gem5scripts_directory, output_directory, gem5_directory, threads):
     executables = glob.glob(os.path.join(input_dir, '*.GEM5'))
-    with multiprocessing.Pool(int(threads)) as pool:
-        pool.starmap(run_gus, [(executable, gem5scripts_directory, output_directory, gem5_directory) for executable in executables])
+    with multiprocessing.Pool(int(threads), initializer=usage.shutdown_on_terminate) as pool:
+        results = pool.starmap(run_gus_accounted, [(executable, gem5scripts_directory, output_directory, gem5_directory) for executable in executables])
+    for used in results:
+        if used is not None:
+            usage.merge('gem5', 'gem5.fast', used)
+    usage.ledger.print()
     
 def main():
     parser = argparse.ArgumentParser(description='Generate GUS reports')
@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../pieces"))
+from ip_samples import read_ip_samples, source_branches, source_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Map the samples of perf-pipedream back to the source lines"
+    )
+    parser.add_argument("executable", help="The sampled executable (built with -g)")
+    parser.add_argument(
+        "samples",
+        help="The samples it dumped (PERF_PIPEDREAM_SAMPLES, by default perf-pipedream.samples)",
+    )
+    parser.add_argument(
+        "--top", help="Number of lines to print", type=int, default=20
+    )
+    parser.add_argument(
+        "--branches", help="Print the most taken branches as well", action="store_true"
+    )
+    args = parser.parse_args()
+
+    samples = read_ip_samples(args.samples)
+    lines = source_lines(args.executable, samples)
+    total = sum(lines.values())
+    print(
+        f"{total} samples (period {samples.period}), {samples.lost} lost"
+    )
+    if total == 0:
+        # e.g. a kernel too short for the sampling period
+        print("no samples")
+    else:
+        for line, count in lines.most_common(args.top):
+            print(f"{100 * count / total:6.2f}% {count:>10} {line}")
+
+    if args.branches:
+        branches = source_branches(args.executable, samples)
+        print(f"{sum(branches.values())} branches")
+        for (source, target), count in branches.most_common(args.top):
+            print(f"{count:>10} {source} -> {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,29 @@
 import argparse
+import csv
 import os
 import multiprocessing
 import glob
 import subprocess
 import random
+import statistics
+import sys
 from timeit import default_timer as timer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from history import History, lpt_makespan
+from text import parse_repetitions
+import usage
+
 
 def launch_subprocess_with_timeout(
     command, timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE
 ):
+    # The simulator is killed with its own children on timeout, and what it
+    # printed until then is kept
     start_time, end_time = None, None
     try:
         start_time = timer()
-        subprocess.run(command, stdout=stdout, stderr=stderr, timeout=timeout)
+        usage.run(command, stdout=stdout, stderr=stderr, timeout=timeout)
         end_time = timer()
     except subprocess.TimeoutExpired:
         print(f"Timeout expired for command {command}")
@@ -25,6 +35,14 @@ def launch_subprocess_with_timeout(
     return end_time - start_time
 
 
+def write_usage(path: str, prefix: str, used: usage.Usage | None):
+    # Next to the time, which stays a bare number (or "timeout") for
+    # evaluate.ipynb
+    if used is not None:
+        with open(path, "w") as f:
+            f.write(used.lines(prefix))
+
+
 def run_gus(
     executable: str,
     output_directory: str,
@@ -59,17 +77,20 @@ def run_gus(
 
     path_gus_report = os.path.join(output_directory, f"{file_name}.gus_report")
     path_gus_time = os.path.join(output_directory, f"{file_name}.gus_time")
+    path_gus_usage = os.path.join(output_directory, f"{file_name}.gus_usage")
     if use_cache and (os.path.exists(path_gus_report) or os.path.exists(path_gus_time)):
         print(f"[GUS] Skipping {executable} as it already exists")
-        return
+        return None, None
 
-    with open(path_gus_report, "w") as f:
+    # the timed out runs are accounted too
+    with usage.staged("gus"), open(path_gus_report, "w") as f:
         time = launch_subprocess_with_timeout(
             [gus_path, "--kernel", kernel_function, executable],
             timeout,
             stdout=f,
             stderr=f,
         )
+        used = usage.ledger.current()
 
     if time is None:
         with open(path_gus_time, "w") as f:
@@ -77,6 +98,8 @@ def run_gus(
     else:
         with open(path_gus_time, "w") as f:
             f.write(f"{time}")
+    write_usage(path_gus_usage, "gus", used)
+    return time, used
 
 
 def run_gem5(
@@ -95,17 +118,18 @@ def run_gem5(
 
     path_gem5_report = os.path.join(output_directory, f"{benchmark_name}.gem5_report")
     path_gem5_time = os.path.join(output_directory, f"{benchmark_name}.gem5_time")
+    path_gem5_usage = os.path.join(output_directory, f"{benchmark_name}.gem5_usage")
     if use_cache and (
         os.path.exists(path_gem5_report) and os.path.exists(path_gem5_time)
     ):
         print(f"[GEM5] Skipping {executable} as it already exists")
-        return
+        return None, None
 
     # create output directory if it does not exist
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    with open(path_gem5_report, "w") as f:
+    with usage.staged("gem5"), open(path_gem5_report, "w") as f:
         time = launch_subprocess_with_timeout(
             [
                 os.path.join(gem5_directory, "build/X86/gem5.fast"),
@@ -122,6 +146,7 @@ def run_gem5(
             stdout=f,
             stderr=f,
         )
+        used = usage.ledger.current()
 
     if time is None:
         with open(path_gem5_time, "w") as f:
@@ -129,10 +154,17 @@ def run_gem5(
     else:
         with open(path_gem5_time, "w") as f:
             f.write(f"{time}")
+    write_usage(path_gem5_usage, "gem5", used)
+    return time, used
 
 
 def run_binary(
-    executable: str, output_directory: str, timeout: int, retries: int, use_cache: bool
+    executable: str,
+    output_directory: str,
+    timeout: int,
+    retries: int,
+    use_cache: bool,
+    in_process: bool = False,
 ):
     print(f"[PAPI] Running {executable}")
 
@@ -145,7 +177,11 @@ def run_binary(
         print(f"[PAPI] Skipping {executable} as it already exists")
         return
 
-    with open(report_path, "w") as reportf:
+    # the executable repeats its kernel itself (-DPOLYBENCH_REPEAT)
+    if in_process:
+        retries = 1
+
+    with usage.staged("papi"), open(report_path, "w") as reportf:
         with open(time_path, "w") as timef:
             for _ in range(retries):
                 time = launch_subprocess_with_timeout(
@@ -154,13 +190,28 @@ def run_binary(
                 assert time is not None
                 timef.write(f"{time}\n")
 
-
-def run_simulator_parallel(files: list[str], threads: int, fn: callable, *args):
-    with multiprocessing.Pool(threads) as pool:
-        pool.starmap(
-            fn,
-            [(executable, *args) for executable in files],
+    if in_process:
+        with open(report_path, "r") as reportf:
+            repetitions = parse_repetitions(reportf)
+        assert repetitions, f"no repetitions in {report_path}"
+        repetitions_path = os.path.join(
+            output_directory, f"{benchmark_name}.papi_repetitions.csv"
         )
+        with open(repetitions_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(repetitions[0]))
+            writer.writeheader()
+            writer.writerows(repetitions)
+
+
+def run_simulator_parallel(jobs: list[tuple], threads: int, fn: callable) -> list:
+    # One job at a time per worker, in the given order (longest expected first)
+    with multiprocessing.Pool(threads, initializer=usage.shutdown_on_terminate) as pool:
+        return pool.starmap(fn, jobs, chunksize=1)
+
+
+def history_key(executable: str) -> str:
+    # /input/2mm.pocc.gcc.GUS -> 2mm.pocc.gcc
+    return os.path.splitext(os.path.basename(executable))[0]
 
 
 def take_random_seed_list(items: list, size: int, seed: int) -> list:
@@ -203,6 +254,11 @@ def main():
         type=int,
         default=5,
     )
+    parser.add_argument(
+        "--in-process",
+        help="The PAPI executables repeat their kernel themselves (built with -DPOLYBENCH_REPEAT=N): run them once, and write each repetition to <benchmark>.papi_repetitions.csv",
+        action="store_true",
+    )
     parser.add_argument(
         "--skip-gus",
         help="Skip GUS simulator",
@@ -223,6 +279,18 @@ def main():
         help="Use cached results",
         action="store_true",
     )
+    parser.add_argument(
+        "--history",
+        help="Database of the durations of the previous runs (default: <output_directory>/history.sqlite)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--usage-output",
+        help="CSV file in which write the resources consumed by the simulators (wall, user, sys, max RSS, page faults), by simulator",
+        type=str,
+        default=None,
+    )
 
     args = parser.parse_args()
 
@@ -249,11 +317,14 @@ def main():
         simulators.append(
             (
                 "GUS",
+                "gus",
                 run_gus,
-                gus_output_directory,
-                args.gus_directory,
-                args.timeout,
-                args.use_cache,
+                lambda timeout: (
+                    gus_output_directory,
+                    args.gus_directory,
+                    timeout,
+                    args.use_cache,
+                ),
             )
         )
 
@@ -261,12 +332,15 @@ def main():
         simulators.append(
             (
                 "GEM5",
+                "gem5.fast",
                 run_gem5,
-                args.gem5_scripts_directory,
-                gem5_output_directory,
-                args.gem5_directory,
-                args.timeout,
-                args.use_cache,
+                lambda timeout: (
+                    args.gem5_scripts_directory,
+                    gem5_output_directory,
+                    args.gem5_directory,
+                    timeout,
+                    args.use_cache,
+                ),
             )
         )
 
@@ -275,14 +349,55 @@ def main():
     if args.sample > 0:
         executables = take_random_seed_list(executables, args.sample, args.seed)
 
-    for extension, fn, *fn_args in simulators:
+    # the previous runs give the order of the jobs, their timeouts and the
+    # estimated makespan
+    history = History(
+        args.history or os.path.join(args.output_directory, "history.sqlite")
+    )
+    plans = []
+    makespan = 0.0
+    for extension, simulator, fn, fn_args in simulators:
+        tool = extension.lower()
+        expected = {
+            e: history.expected(history_key(e), tool) for e in executables
+        }
+        known = [t for t in expected.values() if t is not None]
+        guess = statistics.median(known) if known else 0.0
+        makespan += lpt_makespan(
+            [guess if t is None else t for t in expected.values()], args.threads
+        )
+        # the jobs never ran first: they may be the longest
+        order = sorted(
+            executables,
+            key=lambda e: float("inf") if expected[e] is None else expected[e],
+            reverse=True,
+        )
+        plans.append((extension, tool, simulator, fn, fn_args, order))
+    print(f"Estimated makespan of the simulators: {makespan:.0f}s")
+
+    for extension, tool, simulator, fn, fn_args, order in plans:
         executables_current = list(
             map(
                 lambda executable: executable.replace(".PAPI", f".{extension}"),
-                executables,
+                order,
             )
         )
-        run_simulator_parallel(executables_current, args.threads, fn, *fn_args)
+        jobs = [
+            (
+                executable,
+                *fn_args(history.timeout(history_key(executable), tool, args.timeout)),
+            )
+            for executable in executables_current
+        ]
+        results = run_simulator_parallel(jobs, args.threads, fn)
+        for executable, (time, used) in zip(executables_current, results):
+            # skipped or timed out
+            if time is not None:
+                history.record(history_key(executable), tool, time, True)
+            # the ledgers of the workers are lost with them
+            if used is not None:
+                usage.merge(tool, simulator, used)
+    history.close()
 
     if not args.skip_papi:
         for executable in executables:
@@ -292,8 +407,13 @@ def main():
                 args.timeout,
                 args.retries_per_executable,
                 args.use_cache,
+                args.in_process,
             )
 
+    usage.ledger.print()
+    if args.usage_output:
+        usage.ledger.write_csv(args.usage_output)
+
 
 if __name__ == "__main__":
     main()
@@ -3,7 +3,12 @@ import os
 import multiprocessing
 import glob
 import subprocess
+import sys
 import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import usage
+
 def run_gus(executable, output_directory, gus_directory):
     file_name = os.path.basename(executable)
     gus_path = os.path.join(gus_directory, 'qemu-x86_64')
@@ -13,20 +18,32 @@ def run_gus(executable, output_directory, gus_directory):
         start_time, end_time = 0, 0
         with open(os.path.join(output_directory, before_gus + '.qemu_report'), 'w') as f:
             start_time = time.time()
-            subprocess.run(command, stdout=f, stderr=subprocess.PIPE, check=True)
+            _, used = usage.run(command, stdout=f, stderr=subprocess.PIPE, check=True)
             end_time = time.time()
 
         with open(os.path.join(output_directory, before_gus + '.qemu_report'), 'a') as f:
             f.write('gus_runtime_seconds {}\n'.format(end_time - start_time))
+            f.write(used.lines('gus'))
     except subprocess.CalledProcessError as e:
         print('Error running gus on {}'.format(executable))
         print('Error: {}'.format(e))
         return 
 
+def run_gus_accounted(*args):
+    # The children of the job (the retries and the failed runs too), for the
+    # parent: the ledger of the worker is lost with it
+    with usage.staged('qemu'):
+        run_gus(*args)
+        return usage.ledger.current()
+
 def run_gus_parallel(input_dir, output_directory, gus_directory, threads):
     executables = glob.glob(os.path.join(input_dir, '*.GUS'))
-    with multiprocessing.Pool(int(threads)) as pool:
-        pool.starmap(run_gus, [(executable, output_directory, gus_directory) for executable in executables])
+    with multiprocessing.Pool(int(threads), initializer=usage.shutdown_on_terminate) as pool:
+        results = pool.starmap(run_gus_accounted, [(executable, output_directory, gus_directory) for executable in executables])
+    for used in results:
+        if used is not None:
+            usage.merge('qemu', 'qemu-x86_64', used)
+    usage.ledger.print()
     
 def main():
     parser = argparse.ArgumentParser(description='Generate GUS reports')
@@ -0,0 +1,89 @@
+import math
+import statistics
+
+# Student's t distribution, without scipy
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # Continued fraction of the incomplete beta function (Numerical Recipes)
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = 1.0
+    d = 1 - qab * x / qap
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1,201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-12:
+            break
+    return h
+
+def _betai(a: float, b: float, x: float) -> float:
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    front = math.exp(lbeta + a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a,b,x) / a
+    return 1 - front * _betacf(b,a,1 - x) / b
+
+def t_sf(t: float, df: float) -> float:
+    # P(T > t)
+    x = df / (df + t * t)
+    tail = 0.5 * _betai(df / 2,0.5,x)
+    return tail if t > 0 else 1 - tail
+
+def t_quantile(p: float, df: float) -> float:
+    # Bisection on the survival function
+    lo,hi = -1e3,1e3
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        if 1 - t_sf(mid,df) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+def ci_half_width(samples: list[float], level: float = 0.95) -> float:
+    n = len(samples)
+    if n < 2:
+        return math.inf
+    t = t_quantile(1 - (1 - level) / 2,n - 1)
+    return t * statistics.stdev(samples) / math.sqrt(n)
+
+def ci_narrow_enough(samples: list[float], target: float, level: float = 0.95, relative: bool = True) -> bool:
+    # The half-width of the interval, relative to the mean or absolute
+    mean = statistics.fmean(samples)
+    width = ci_half_width(samples,level)
+    if not relative:
+        return width <= target
+    if mean == 0:
+        return width == 0
+    return width / abs(mean) <= target
+
+def welch_greater(a: list[float], b: list[float]) -> float:
+    # p-value of the one-sided Welch test "mean(a) > mean(b)"
+    na,nb = len(a),len(b)
+    va,vb = statistics.variance(a) / na,statistics.variance(b) / nb
+    diff = statistics.fmean(a) - statistics.fmean(b)
+    if va + vb == 0:
+        return 0.0 if diff > 0 else 1.0
+    t = diff / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va ** 2 / (na - 1) + vb ** 2 / (nb - 1))
+    return t_sf(t,df)
@@ -1,9 +1,46 @@
+import mmap
+import os
 import re
-from typing import Union
+from typing import Iterable, Union
 import sys
 from dataclasses import dataclass
 
 
+class RawText:
+    # A lazy handle on the raw text of a report: the slices (path, offset,
+    # length) of the files which hold it, in order. Nothing is read until the
+    # text is needed, and then through a memory map. A length of None goes to
+    # the end of the file.
+
+    def __init__(self, path: str, offset: int = 0, length: int | None = None):
+        self.slices = [(path, offset, length)]
+
+    def __add__(self, other: "RawText") -> "RawText":
+        raw = RawText.__new__(RawText)
+        raw.slices = self.slices + other.slices
+        return raw
+
+    def __len__(self) -> int:
+        # In bytes
+        return sum(
+            os.path.getsize(p) - o if n is None else n for p, o, n in self.slices
+        )
+
+    def text(self) -> str:
+        parts = []
+        for path, offset, length in self.slices:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    end = len(m) if length is None else offset + length
+                    parts.append(m[offset:end].decode(errors="replace"))
+        return "".join(parts)
+
+    def __str__(self):
+        return self.text()
+
+
 class Report:
 
     def __init__(
@@ -13,14 +50,29 @@ class Report:
         benchmark: str,
         bottlenecks: list[str] | None = None,
         metrics: dict[str, int | None] | None = None,
-        report: str | None = None,
+        report: RawText | None = None,
+        samples: dict[str, list[int]] | None = None,
+        drilldown: list[str] | None = None,
+        usage=None,
+        timed_out: bool = False,
     ):
         self.success = success
         self.desc = desc
         self.benchmark = benchmark
         self.bottlenecks = bottlenecks
         self.metrics = metrics
+        # The raw text, left on disk
         self.report = report
+        # The values of each repetition, if the measurement was repeated
+        self.samples = samples
+        # The paths to the flagged nodes below level 1 (e.g.
+        # topdown-be-bound/tma_memory_bound), if they were measured
+        self.drilldown = drilldown
+        # The resources consumed by the children which produced it (a
+        # usage.Usage), unless it was reused
+        self.usage = usage
+        # Whether it failed because its tool was killed on timeout
+        self.timed_out = timed_out
 
     def print(self, flag):
         if flag and self.success:
@@ -57,3 +109,139 @@ def parse_int(regexp, text):
         return int(myint)
     else:
         return None
+
+
+NON_DIGITS = re.compile("[^0-9]")
+
+
+class CounterScanner:
+    # Extracts several counters from a report in a single pass over its
+    # lines (a file object is read line by line). Like parse_int, the value
+    # of a counter is made of the digits preceding its last occurrence on the
+    # first line where it appears, after the prefix if any.
+
+    def __init__(self, names: list[str], prefix: str = ""):
+        self.names = names
+        self.prefix = prefix
+        # Most lines (e.g. the output of the benchmark) mention no counter
+        self.any_name = re.compile("|".join(re.escape(n) for n in names))
+
+    def scan(self, lines: Iterable[str]) -> dict[str, int | None]:
+        values: dict[str, int | None] = {}
+        for line in lines:
+            if self._scan_line(line, values):
+                break
+        return values
+
+    def scan_sections(
+        self, lines: Iterable[str], separator: re.Pattern
+    ) -> list[dict[str, int | None]]:
+        # One dict per non-blank section between the separator lines
+        sections = []
+        values: dict[str, int | None] = {}
+        blank = True
+        for line in lines:
+            if separator.fullmatch(line.rstrip("\n")):
+                if not blank:
+                    sections.append(values)
+                values, blank = {}, True
+                continue
+            blank = blank and not line.strip()
+            self._scan_line(line, values)
+        if not blank:
+            sections.append(values)
+        return sections
+
+    def _scan_line(self, line: str, values: dict[str, int | None]) -> bool:
+        # Returns whether all the counters are known
+        if not self.any_name.search(line):
+            return False
+        start = line.find(self.prefix)
+        if start < 0:
+            return False
+        start += len(self.prefix)
+        for n in self.names:
+            if n in values:
+                continue
+            end = line.rfind(n)
+            if end >= start:
+                digits = NON_DIGITS.sub("", line[start:end])
+                values[n] = int(digits) if digits else None
+        return len(values) == len(self.names)
+
+
+def parse_number(text: str) -> int | float | None:
+    # e.g. "<not counted>" or "<not supported>" are not numbers
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return None
+
+
+def event_name(event: str) -> str:
+    # cycles:u and cpu_core/cycles/ are the same thing for us
+    event = event.split(":")[0]
+    if event.count("/") == 2:
+        event = event.split("/")[1]
+    return event
+
+
+def parse_perf_csv(lines: Iterable[str]) -> dict[str, int | float | None]:
+    # The output of perf stat -x, whose fields are: counter value, unit,
+    # event, running time, percentage of the enabled time during which the
+    # counter ran (below 100 when multiplexed), metric value, metric unit
+    metrics: dict[str, int | float | None] = {}
+    for line in lines:
+        fields = line.rstrip("\n").split(",")
+        if line.startswith("#") or len(fields) < 5:
+            continue
+        value, unit, event, running, percent = fields[:5]
+        if event:
+            name = event_name(event)
+            metrics[name] = parse_number(value)
+            metrics[f"{name}-running"] = parse_number(running)
+            metrics[f"{name}-running-percent"] = parse_number(percent)
+        # The derived metrics (e.g. "30.5,%  tma_retiring")
+        if len(fields) >= 7 and fields[5]:
+            metrics[fields[6].lstrip("%").strip()] = parse_number(fields[5])
+    return metrics
+
+
+# The raw report of repeated measurements is the concatenation of the
+# outputs of each repetition, each one introduced by this line
+REPETITION_MARKER = "# repetition {}"
+REPETITION = re.compile(r"^# repetition \d+$", re.MULTILINE)
+# ... and the measurements of the drill-down below a bottleneck follow, each
+# one introduced by the path of the node in the top-down hierarchy
+DRILLDOWN_MARKER = "# drill-down {}"
+DRILLDOWN = re.compile(r"^# drill-down (\S+)$", re.MULTILINE)
+
+
+REPETITIONS_BEGIN = "==BEGIN REPETITIONS=="
+REPETITIONS_END = "==END   REPETITIONS=="
+
+
+def parse_repetitions(lines: Iterable[str]) -> list[dict[str, int | float | None]]:
+    # The output of a benchmark built with -DPOLYBENCH_REPEAT=N: a header
+    # naming the columns (the time of the kernel, then the PAPI counters if
+    # any), then one line per repetition, preceded by its index. The header
+    # may follow other output on its line.
+    repetitions: list[dict[str, int | float | None]] = []
+    columns = None
+    for line in lines:
+        begin = line.find(REPETITIONS_BEGIN)
+        if begin >= 0:
+            columns = line[begin + len(REPETITIONS_BEGIN) :].split()
+        elif columns is None:
+            continue
+        elif line.startswith(REPETITIONS_END):
+            break
+        else:
+            fields = line.split()[1:]
+            if len(fields) == len(columns):
+                repetitions.append(
+                    {c: parse_number(f) for c, f in zip(columns, fields)}
+                )
+    return repetitions
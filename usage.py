@@ -0,0 +1,275 @@
+import contextlib
+import csv
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+# The resources consumed by each child process, as reported by wait4 when it
+# is reaped: the children are never reaped by anything else (asyncio's child
+# watcher or Popen.wait would throw their rusage away). Every child is
+# accounted in a ledger, by stage (the stage of the task of the scheduler
+# which spawned it, see staged) and by tool (the basename of the command).
+#
+# Every child also leads its own session, hence its own process group: on a
+# timeout or on Ctrl-C, the whole group is killed, with the processes the
+# child spawned itself (gem5, the helpers of Gus, the benchmark under perf),
+# which would otherwise keep their cores until the end of the run.
+
+
+@dataclass
+class Usage:
+    wall: float = 0.0
+    user: float = 0.0
+    sys: float = 0.0
+    # kB, the largest child
+    max_rss: int = 0
+    minor_faults: int = 0
+    major_faults: int = 0
+    children: int = 0
+
+    @staticmethod
+    def of(rusage, wall: float) -> "Usage":
+        return Usage(
+            wall=wall,
+            user=rusage.ru_utime,
+            sys=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss,
+            minor_faults=rusage.ru_minflt,
+            major_faults=rusage.ru_majflt,
+            children=1,
+        )
+
+    def __add__(self, other: "Usage") -> "Usage":
+        return Usage(
+            wall=self.wall + other.wall,
+            user=self.user + other.user,
+            sys=self.sys + other.sys,
+            max_rss=max(self.max_rss, other.max_rss),
+            minor_faults=self.minor_faults + other.minor_faults,
+            major_faults=self.major_faults + other.major_faults,
+            children=self.children + other.children,
+        )
+
+    @property
+    def cpu(self) -> float:
+        return self.user + self.sys
+
+    def lines(self, prefix: str) -> str:
+        # As the "<prefix>_runtime_seconds <value>" lines of the reports
+        return (
+            f"{prefix}_user_seconds {self.user}\n"
+            f"{prefix}_sys_seconds {self.sys}\n"
+            f"{prefix}_max_rss_kb {self.max_rss}\n"
+            f"{prefix}_minor_faults {self.minor_faults}\n"
+            f"{prefix}_major_faults {self.major_faults}\n"
+        )
+
+
+FIELDS = ["children", "wall", "user", "sys", "max_rss", "minor_faults", "major_faults"]
+
+
+def tool_of(command: list[str] | str) -> str:
+    # The basename of the program, after the environment assignments
+    words = shlex.split(command) if isinstance(command, str) else command
+    for w in words:
+        if "=" not in w:
+            return os.path.basename(w)
+    return ""
+
+
+class Ledger:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals: dict[tuple[str, str], Usage] = {}
+        self.local = threading.local()
+
+    def record(self, tool: str, usage: Usage):
+        stage = getattr(self.local, "stage", None) or "-"
+        with self.lock:
+            self.totals[(stage, tool)] = self.totals.get((stage, tool), Usage()) + usage
+        if getattr(self.local, "job", None) is not None:
+            self.local.job += usage
+
+    def current(self) -> Usage | None:
+        # The children of the job running on this thread so far, if any
+        job = getattr(self.local, "job", None)
+        return job if job and job.children else None
+
+    def summary(self) -> dict[tuple[str, str], Usage]:
+        with self.lock:
+            return dict(sorted(self.totals.items()))
+
+    def print(self, file=sys.stderr):
+        for (stage, tool), u in self.summary().items():
+            print(
+                f"[{stage}] {tool}: {u.children} children, wall {u.wall:.1f}s, "
+                f"user {u.user:.1f}s, sys {u.sys:.1f}s, max RSS {u.max_rss} kB, "
+                f"faults {u.minor_faults} minor / {u.major_faults} major",
+                file=file,
+            )
+
+    def write_csv(self, path: str):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "tool"] + FIELDS)
+            for (stage, tool), u in self.summary().items():
+                writer.writerow([stage, tool] + [getattr(u, n) for n in FIELDS])
+
+
+ledger = Ledger()
+
+
+@contextlib.contextmanager
+def staged(stage: str):
+    # The children spawned by this thread within the block are accounted to
+    # the stage, and summed up in the job
+    local = ledger.local
+    outer = (getattr(local, "stage", None), getattr(local, "job", None))
+    local.stage, local.job = stage, Usage()
+    try:
+        yield local
+    finally:
+        local.stage, local.job = outer
+
+
+def merge(stage: str, tool: str, usage: Usage):
+    # Children reaped by another process (a worker of a multiprocessing.Pool,
+    # whose ledger is lost with it), accounted to the stage in this one
+    with staged(stage):
+        ledger.record(tool, usage)
+
+
+# The process groups of the living children, and whether they are all being
+# killed (see shutdown)
+groups: set[int] = set()
+groups_lock = threading.Lock()
+closing = threading.Event()
+
+
+def spawn(command: list[str] | str, **popen_args) -> subprocess.Popen:
+    # Popen, in a new process group (of the same id as the child). Raises
+    # InterruptedError once shutting down.
+    if closing.is_set():
+        raise InterruptedError(f"Shutting down, {tool_of(command)} not started")
+    process = subprocess.Popen(command, start_new_session=True, **popen_args)
+    with groups_lock:
+        groups.add(process.pid)
+    # Spawned while shutdown was killing the others
+    if closing.is_set():
+        kill(process.pid)
+    return process
+
+
+def wait4(pid: int, on_exit):
+    # A thread per child waits for it (as asyncio's threaded child watcher
+    # does), and calls on_exit(status, rusage)
+    def wait():
+        _, status, rusage = os.wait4(pid, 0)
+        with groups_lock:
+            groups.discard(pid)
+        on_exit(status, rusage)
+
+    threading.Thread(target=wait, name=f"wait4-{pid}", daemon=True).start()
+
+
+def kill(pid: int):
+    # The whole group of the child (which may be gone already, while its own
+    # children are not). Not Popen.kill, which would reap the child before
+    # wait4.
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def shutdown():
+    # No child is started anymore, and the living ones are killed with their
+    # children: the jobs waiting for them fail right away
+    closing.set()
+    with groups_lock:
+        living = list(groups)
+    for pid in living:
+        kill(pid)
+
+
+def shutdown_on_terminate():
+    # The initializer of the workers of a multiprocessing.Pool, which are
+    # terminated by SIGTERM (when the pool exits early, e.g. on Ctrl-C)
+    def terminate(signum, frame):
+        shutdown()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+
+def run(
+    command: list[str] | str,
+    timeout: float | None = None,
+    capture_output: bool = False,
+    check: bool = False,
+    **popen_args,
+) -> tuple[subprocess.CompletedProcess, Usage]:
+    # subprocess.run, but accounted and killed as a group: raises
+    # subprocess.TimeoutExpired (with the partial output), and
+    # subprocess.CalledProcessError if check
+    start = time.monotonic()
+    if capture_output:
+        popen_args["stdout"] = popen_args["stderr"] = subprocess.PIPE
+    process = spawn(command, **popen_args)
+    outputs = {}
+    readers = [
+        threading.Thread(target=lambda n=n, s=s: outputs.__setitem__(n, s.read()))
+        for n, s in (("stdout", process.stdout), ("stderr", process.stderr))
+        if s is not None
+    ]
+    for r in readers:
+        r.start()
+    exited = threading.Event()
+    result = {}
+
+    def on_exit(status, rusage):
+        result["status"], result["rusage"] = status, rusage
+        exited.set()
+
+    wait4(process.pid, on_exit)
+    try:
+        timed_out = not exited.wait(timeout)
+    except BaseException:
+        # Ctrl-C
+        kill(process.pid)
+        raise
+    if timed_out:
+        kill(process.pid)
+        exited.wait()
+    else:
+        # The child is gone, but maybe not its own children, which keep the
+        # pipes open: they get what remains of the timeout
+        for r in readers:
+            r.join(None if timeout is None else max(0.0, start + timeout - time.monotonic()))
+        if any(r.is_alive() for r in readers):
+            timed_out = True
+            kill(process.pid)
+    for r in readers:
+        r.join()
+    for s in (process.stdout, process.stderr):
+        if s is not None:
+            s.close()
+    process.returncode = os.waitstatus_to_exitcode(result["status"])
+    usage = Usage.of(result["rusage"], time.monotonic() - start)
+    ledger.record(tool_of(command), usage)
+    if timed_out:
+        raise subprocess.TimeoutExpired(
+            command, timeout, outputs.get("stdout"), outputs.get("stderr")
+        )
+    completed = subprocess.CompletedProcess(
+        command, process.returncode, outputs.get("stdout"), outputs.get("stderr")
+    )
+    if check:
+        completed.check_returncode()
+    return completed, usage
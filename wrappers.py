@@ -5,9 +5,16 @@ from typing import Optional
 import pandas as pd
 import io
 import sys
+import shutil
+import tempfile
 
-from text import Report, parse_float, parse_int
+from text import Report, RawText, CounterScanner, parse_perf_csv
+from text import REPETITION_MARKER, REPETITION, DRILLDOWN_MARKER, DRILLDOWN
 from ihm import print_debug
+from cas import Store, key_of, headers_of
+from core_pool import pinned
+from stats import ci_narrow_enough
+import pipedream
 
 CYCLES = "cycles"
 SLOTS = "slots"
@@ -19,9 +26,32 @@ GUS_REPORT = "Gus report"
 TAM_REPORT = "TAM report"
 SENS_REPORT = "Sens report"
 
+# The output of perf stat: its human-readable table, or field-separated
+# values with the TopdownL1 metric group
+PERF_TABLE = "table"
+PERF_CSV = "csv"
+
+# The benchmarks built as shared objects measured in process, whose main is
+# called back around the kernel (see polybench.c)
+SHARED_KERNEL_OPTIONS = ["-shared", "-fPIC", "-DPOLYBENCH_HOOKS", "-Dmain=polybench_main"]
+# The perf-pipedream events of the counters
+pipedream_events = {
+    CYCLES: "PAPI_TOT_CYC",
+    SLOTS: "TOPDOWN_SLOTS",
+    RETIRING: "TOPDOWN_RETIRING",
+    BE_BOUND: "TOPDOWN_BE_BOUND",
+    FE_BOUND: "TOPDOWN_FE_BOUND",
+    BAD_SPEC: "TOPDOWN_BAD_SPEC",
+}
+# Empty windows measured to subtract the cost of starting and stopping
+PIPEDREAM_CALIBRATION_RUNS = 10
+# The measurement worker of the shared objects
+PIPEDREAM_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipedream_worker.py")
+
 POCC_TIMEOUT = 120 # two minutes
 GUS_TIMEOUT = 300 # five minutes
 SENS_TIMEOUT = 900
+PIPEDREAM_TIMEOUT = 300 # five minutes, as Gus
 
 counters = [
     CYCLES,
@@ -32,10 +62,114 @@ counters = [
     BAD_SPEC,
 ]
 
+# All the counters are read in a single pass over the report
+perf_scanner = CounterScanner(counters)
+gus_scanner = CounterScanner([CYCLES], prefix="EXECUTION TIME:")
+
+
+def complete(values: dict[str, int | None]) -> dict[str, int] | None:
+    if any(values.get(c) is None for c in counters):
+        return None
+    return {c: values[c] for c in counters}
+
+
+def counters_of(report: str, perf_format: str = PERF_TABLE) -> dict[str, int] | None:
+    if perf_format == PERF_CSV:
+        return complete(parse_perf_csv(io.StringIO(report)))
+    return complete(perf_scanner.scan(io.StringIO(report)))
+
+
+def perf_format_of(report: str) -> str:
+    # The field-separated output names each event in a field of its own,
+    # which perf stat's table never does (not even with thousands separators)
+    if CYCLES in parse_perf_csv(report.splitlines()):
+        return PERF_CSV
+    return PERF_TABLE
+
+
+def converged(
+    samples: list[dict[str, int]], ci_target: float, ci_level: float
+) -> bool:
+    # The cycles relatively, the top-down fractions absolutely
+    if not ci_narrow_enough([m[CYCLES] for m in samples], ci_target, ci_level):
+        return False
+    for counter in tma_thresholds:
+        fractions = [m[counter] / m[SLOTS] for m in samples]
+        if not ci_narrow_enough(fractions, ci_target, ci_level, relative=False):
+            return False
+    return True
+
+
 # Thresholds from
 # https://cdrdv2-public.intel.com/766317/vtune-profiler_cookbook_2023.0-766316-766317.pdf
 tma_thresholds = {RETIRING: 70.0, BE_BOUND: 40.0, FE_BOUND: 10.0, BAD_SPEC: 5.0}
 
+# Below a level 1 bottleneck, the subtree of the top-down hierarchy is
+# measured with perf's metric group of the node (tma_<node>_group), and so
+# on down to the requested level. Thresholds of the nodes (in percents of the
+# slots) from the same source.
+tma_groups = {
+    RETIRING: "tma_retiring_group",
+    BE_BOUND: "tma_backend_bound_group",
+    FE_BOUND: "tma_frontend_bound_group",
+    BAD_SPEC: "tma_bad_speculation_group",
+}
+tma_node_thresholds = {
+    "tma_memory_bound": 20.0,
+    "tma_core_bound": 10.0,
+    "tma_fetch_latency": 10.0,
+    "tma_fetch_bandwidth": 10.0,
+    "tma_branch_mispredicts": 10.0,
+    "tma_machine_clears": 10.0,
+    "tma_light_operations": 60.0,
+    "tma_heavy_operations": 10.0,
+}
+TMA_NODE_THRESHOLD = 10.0
+
+
+def tma_percents(metrics: dict[str, int]) -> dict[str, float]:
+    return {c: (metrics[c] / metrics[SLOTS]) * 100 for c in tma_thresholds}
+
+
+def group_of(path: str) -> str:
+    # topdown-be-bound -> tma_backend_bound_group,
+    # topdown-be-bound/tma_memory_bound -> tma_memory_bound_group
+    if "/" not in path:
+        return tma_groups[path]
+    return path.split("/")[-1] + "_group"
+
+
+def tma_nodes_of(output: str, path: str) -> dict[str, float]:
+    # The nodes of the subtree, without their parent
+    parent = group_of(path)[: -len("_group")]
+    return {
+        n: v
+        for n, v in parse_perf_csv(output.splitlines()).items()
+        if n.startswith("tma_") and n != parent and v is not None
+    }
+
+
+def tma_flagged(nodes: dict[str, float]) -> list[str]:
+    return [
+        n for n, v in nodes.items() if v >= tma_node_thresholds.get(n, TMA_NODE_THRESHOLD)
+    ]
+
+
+def tma_drill_down(measure, bottlenecks: list[str], tma_level: int) -> list[tuple[str, str]]:
+    # (path, output) of each subtree measured (once, without repetitions),
+    # only below the nodes flagged at the level above
+    outputs = []
+    pending = [(b, 2) for b in bottlenecks]
+    while pending:
+        path, level = pending.pop(0)
+        if level > tma_level:
+            continue
+        output = measure(group_of(path))
+        outputs.append((path, output))
+        for n in tma_flagged(tma_nodes_of(output, path)):
+            pending.append((f"{path}/{n}", level + 1))
+    return outputs
+
 
 def perf_tam_l1(
     executable_path: str,
@@ -47,9 +181,21 @@ def perf_tam_l1(
     lib_huge: str,
     core: int,
     debug: bool,
+    node: int | None = None,
+    repetitions_min: int = 1,
+    repetitions_max: int = 1,
+    ci_target: float = 0.01,
+    ci_level: float = 0.95,
+    perf_format: str = PERF_TABLE,
+    tma_level: int = 1,
+    kernel_window: bool = False,
+    huge_pages: str | None = None,
 ):
     #
+    # perf writes its statistics there, apart from the output of the benchmark
+    stat_path = None
     if tma_scope_dir:
+        perf_format = PERF_TABLE
         command_list = [
             f"{tma_scope_dir}/DynamoRIO-Linux-10.93.20000/bin64/drrun",
             "-c",
@@ -63,6 +209,23 @@ def perf_tam_l1(
                 "TMA_LEVEL": "TopdownL1",
                 "TMA_CORE": str(core),
         }
+    elif perf_format == PERF_CSV:
+        stat_path = f"{report_path}.stat"
+        command_list = [
+            "perf",
+            "stat",
+            "-x",
+            ",",
+            "-o",
+            stat_path,
+            "-e",
+            CYCLES,
+            "-M",
+            "TopdownL1",
+            "--",
+            executable_path,
+        ]
+        env_vars = {}
     else:
         command_list = [
             "perf",
@@ -73,36 +236,149 @@ def perf_tam_l1(
 
     if use_huge_pages:
         env_vars['LD_PRELOAD'] = lib_huge
+    # The arrays of the benchmark only (see polybench.c)
+    if huge_pages:
+        env_vars["POLYBENCH_HUGE_PAGES"] = huge_pages
+
+    # Pinned on the reserved core, with its memory on the NUMA node of the core
+    if node is not None:
+        command_list = pinned(command_list, core, node)
         
+    raw = None
     if reuse_perf_reports:
         if os.path.exists(report_path):
-            f = open(report_path,'r')
-            report = f.read()
-            success = True
-            f.close()
+            with open(report_path, "r") as f:
+                report = f.read()
+            raw = RawText(report_path)
         else:
             return Report(success=False, desc=TAM_REPORT, benchmark=executable_path)
     else:
-        res = command.execute(
-            command_list,
-            env_vars=env_vars,
-            target_file=report_path,
-            debug=debug,
-        )
-        report = res.message
-        success = res.success
-    
-    #
-    metrics = {}
-    for m in counters:
-        v = parse_int("(.*)" + m, report)
-        if v == None:
-            return Report(success=False, desc=TAM_REPORT, benchmark=executable_path)
-        metrics[m] = v
+        window = None
+        if kernel_window and not tma_scope_dir:
+            # The benchmark (built with -DPOLYBENCH_PERF_CTL) enables the
+            # counters of perf around its kernel only, through these FIFOs
+            window = tempfile.TemporaryDirectory(prefix="perf-ctl-")
+            ctl = os.path.join(window.name, "ctl")
+            ack = os.path.join(window.name, "ack")
+            os.mkfifo(ctl)
+            os.mkfifo(ack)
+            perf = command_list.index("stat") + 1
+            command_list = (
+                command_list[:perf]
+                + ["--delay=-1", f"--control=fifo:{ctl},{ack}"]
+                + command_list[perf:]
+            )
+            env_vars["POLYBENCH_PERF_CTL"] = ctl
+            env_vars["POLYBENCH_PERF_ACK"] = ack
+
+        def run(command_list):
+            res = command.execute(
+                command_list,
+                env_vars=env_vars,
+                debug=debug,
+            )
+            output = res.message
+            if stat_path:
+                output = ""
+                if os.path.exists(stat_path):
+                    with open(stat_path, "r") as f:
+                        output = f.read()
+                    os.remove(stat_path)
+            return res, output
+
+        # Repeat until the confidence intervals are narrow enough. A failed
+        # or unparsable run ends the repetitions, and only those before it
+        # are kept.
+        outputs = []
+        samples = []
+        for i in range(repetitions_max):
+            res, output = run(command_list)
+            sample = counters_of(output, perf_format)
+            if not res.success or sample == None:
+                break
+            outputs.append(output)
+            samples.append(sample)
+            if len(samples) >= repetitions_min and converged(
+                samples, ci_target, ci_level
+            ):
+                break
+        if not samples:
+            if window:
+                window.cleanup()
+            return Report(
+                success=False,
+                desc=TAM_REPORT,
+                benchmark=executable_path,
+                timed_out=res.timed_out,
+            )
+        if len(outputs) == 1:
+            report = outputs[0]
+        else:
+            report = "".join(
+                f"{REPETITION_MARKER.format(i)}\n{o}" for i, o in enumerate(outputs)
+            )
+        # Deeper levels only below the bottlenecks
+        if tma_level > 1 and perf_format == PERF_CSV:
+            means = {c: sum(s[c] for s in samples) / len(samples) for c in counters}
+            flagged = [
+                c for c, p in tma_percents(means).items() if p >= tma_thresholds[c]
+            ]
+
+            def measure(group):
+                drill_command = [group if c == "TopdownL1" else c for c in command_list]
+                return run(drill_command)[1]
+
+            for path, output in tma_drill_down(measure, flagged, tma_level):
+                report += f"{DRILLDOWN_MARKER.format(path)}\n{output}"
+        if window:
+            window.cleanup()
+        with open(report_path, "w") as f:
+            f.write(report)
+        raw = RawText(report_path)
+
+    return tam_report_of(report, perf_format, executable_path, debug, raw)
+
+
+def tam_report_of(
+    report: str,
+    perf_format: str,
+    executable_path: str,
+    debug: bool,
+    raw: RawText | None = None,
+) -> Report:
+    # The text is parsed, and left to raw (the report on disk)
+    parts = DRILLDOWN.split(report)
+    drills = list(zip(parts[1::2], parts[2::2]))
+    everything = {}
+    if perf_format == PERF_CSV:
+        sections = [
+            parse_perf_csv(c.splitlines())
+            for c in REPETITION.split(parts[0])
+            if c.strip()
+        ]
+        samples = [complete(v) for v in sections]
+        # Every event, its multiplexing and every derived metric, averaged
+        # over the repetitions
+        for name in sections[0] if sections else []:
+            values = [v.get(name) for v in sections]
+            if None not in values:
+                everything[name] = sum(values) / len(values)
+    else:
+        samples = [
+            complete(v)
+            for v in perf_scanner.scan_sections(io.StringIO(report), REPETITION)
+        ]
+    if not samples or None in samples:
+        return Report(success=False, desc=TAM_REPORT, benchmark=executable_path)
+    distributions = {m: [s[m] for s in samples] for m in counters}
+    metrics = {
+        **everything,
+        **{m: round(sum(v) / len(v)) for m, v in distributions.items()},
+    }
     #
     bottlenecks = []
-    for counter, threshold in tma_thresholds.items():
-        percent = (metrics[counter] / metrics[SLOTS]) * 100
+    for counter, percent in tma_percents(metrics).items():
+        threshold = tma_thresholds[counter]
         metrics[counter + "-percent"] = round(percent, 2)
         print_debug(
             debug,
@@ -112,18 +388,160 @@ def perf_tam_l1(
         if percent >= threshold:
             print_debug(debug, f"{counter} is a bottleneck for {executable_path}")
             bottlenecks.append(counter)
+    # The nodes of the deeper levels, and the paths to those flagged
+    drilldown = None
+    if drills:
+        drilldown = []
+        for path, output in drills:
+            nodes = tma_nodes_of(output, path)
+            metrics.update(nodes)
+            drilldown += [f"{path}/{n}" for n in tma_flagged(nodes)]
     #
     report = Report(
         success=True,
         desc=TAM_REPORT,
         bottlenecks=bottlenecks,
         metrics=metrics,
-        report=report,
+        report=raw,
         benchmark=executable_path,
+        samples=distributions if len(samples) > 1 else None,
+        drilldown=drilldown,
     )
     return report
 
 
+def pipedream_windows(
+    shared_object: str,
+    debug: bool,
+    repetitions_min: int,
+    repetitions_max: int,
+    ci_target: float,
+    ci_level: float,
+    huge_pages: str | None = None,
+) -> list[tuple[dict[str, int], dict[str, float]]]:
+    # The counters (minus the cost of an empty window) and their running
+    # ratio around each run of the kernel, from the calling thread, until the
+    # confidence intervals are narrow enough
+    events = pipedream.EventSet(
+        pipedream.Pipedream(), [pipedream_events[c] for c in counters]
+    )
+    try:
+        kernel = pipedream.SharedKernel(shared_object)
+        stops = []
+        kernel.set_hooks(
+            events.start, lambda: stops.append(events.stop()), huge_pages=huge_pages
+        )
+        baseline = {c: None for c in counters}
+        for _ in range(PIPEDREAM_CALIBRATION_RUNS):
+            events.start()
+            values, _ = events.stop()
+            for c in counters:
+                v = values[pipedream_events[c]]
+                baseline[c] = v if baseline[c] is None else min(v, baseline[c])
+        windows = []
+        for _ in range(repetitions_max):
+            stops.clear()
+            status = kernel.run()
+            if status != 0 or not stops:
+                print_debug(debug, f"{shared_object} failed ({status})")
+                windows = []
+                break
+            for values, ratios in stops:
+                windows.append((
+                    {c: max(values[pipedream_events[c]] - baseline[c], 0) for c in counters},
+                    {c: ratios[pipedream_events[c]] for c in counters},
+                ))
+            samples = [v for v, _ in windows]
+            if len(samples) >= repetitions_min and converged(samples, ci_target, ci_level):
+                break
+    except BaseException:
+        # The error of the measurement, not those of the cleanup: the event
+        # set may have been left running (or not)
+        for cleanup in (events.stop, events.destroy):
+            try:
+                cleanup()
+            except pipedream.PipedreamError:
+                pass
+        raise
+    events.destroy()
+    return windows
+
+
+def pipedream_report_of(windows: list[tuple[dict[str, int], dict[str, float]]]) -> str:
+    # Like the field-separated output of perf stat, a section per repetition
+    outputs = [
+        "".join(f"{values[c]},,{c},,{100 * ratios[c]:.2f}\n" for c in counters)
+        for values, ratios in windows
+    ]
+    if len(outputs) == 1:
+        return outputs[0]
+    return "".join(
+        f"{REPETITION_MARKER.format(i)}\n{o}" for i, o in enumerate(outputs)
+    )
+
+
+def pipedream_tam_l1(
+    shared_object: str,
+    report_path: str,
+    reuse_perf_reports: bool,
+    core: int,
+    debug: bool,
+    node: int | None = None,
+    repetitions_min: int = 1,
+    repetitions_max: int = 1,
+    ci_target: float = 0.01,
+    ci_level: float = 0.95,
+    huge_pages: str | None = None,
+    timeout: int = PIPEDREAM_TIMEOUT,
+) -> Report:
+    # The kernel built as a shared object is loaded by a measurement worker
+    # (pipedream_worker.py), and run under a perf-pipedream event set: neither
+    # perf nor the benchmark are spawned. As Gus, the worker is killed on
+    # timeout, and a kernel which crashes or exits only fails its report; the
+    # shared object goes away with the worker.
+    if not reuse_perf_reports:
+        command_list = [
+            sys.executable,
+            PIPEDREAM_WORKER,
+            shared_object,
+            report_path,
+            "--core",
+            str(core),
+            "--repetitions-min",
+            str(repetitions_min),
+            "--repetitions-max",
+            str(repetitions_max),
+            "--ci-target",
+            str(ci_target),
+            "--ci-level",
+            str(ci_level),
+        ]
+        if huge_pages:
+            command_list += ["--huge-pages", huge_pages]
+        if debug:
+            command_list.append("--debug")
+        # With its memory on the NUMA node of the core
+        if node is not None:
+            command_list = pinned(command_list, core, node)
+        # The worker writes the report only if the measurement worked
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        res = command.execute(command_list, timeout=timeout, debug=debug)
+        if not os.path.exists(report_path):
+            print_debug(debug, f"In-process measurement of {shared_object} failed: {res.message}")
+            return Report(
+                success=False,
+                desc=TAM_REPORT,
+                benchmark=shared_object,
+                timed_out=res.timed_out,
+            )
+    elif not os.path.exists(report_path):
+        return Report(success=False, desc=TAM_REPORT, benchmark=shared_object)
+    with open(report_path, "r") as f:
+        report = f.read()
+    return tam_report_of(report, PERF_CSV, shared_object, debug, RawText(report_path))
+
+
 def gus_detailed(
     executable_path: str,
     kernel: str,
@@ -133,6 +551,8 @@ def gus_detailed(
     l3_size: str,
     use_cache: bool,
     debug: bool,
+    cas_dir: str | None = None,
+    timeout: int = GUS_TIMEOUT,
 ):
 
     command_list = [
@@ -148,28 +568,45 @@ def gus_detailed(
         executable_path,
     ]
 
-    if use_cache and os.path.exists(gus_report_path):
-        f = open(gus_report_path, "r")
-        gus_report = f.read()
-        f.close()
-    else:
+    store = None
+    if cas_dir:
+        store = Store(cas_dir, debug)
+        key = key_of(" ".join(command_list[:-1]), [executable_path])
+    if not (
+        store and store.fetch(key, gus_report_path) or (
+            not store and use_cache and os.path.exists(gus_report_path)
+        )
+    ):
+        # The report is streamed to disk, not kept in memory
         res_detailed = command.execute(
             command_list,
             target_file=gus_report_path,
-            timeout = GUS_TIMEOUT,
+            capture_output=False,
+            timeout = timeout,
             debug=debug,
         )
         if not res_detailed.success:
-            return Report(success=False, desc=GUS_REPORT, benchmark=executable_path)
-        gus_report = res_detailed.message
+            return Report(
+                success=False,
+                desc=GUS_REPORT,
+                benchmark=executable_path,
+                timed_out=res_detailed.timed_out,
+            )
+        if store:
+            store.store(key, gus_report_path)
+    return gus_report_of(gus_report_path, executable_path)
+
 
-    cycles = parse_int("EXECUTION TIME:(.*)cycles", gus_report)
+def gus_report_of(gus_report_path: str, executable_path: str) -> Report:
+    # Scanned line by line: the report is not loaded in memory
+    with open(gus_report_path, "r") as f:
+        cycles = gus_scanner.scan(f).get(CYCLES)
     metrics: dict[str, int | None] = {CYCLES: cycles}
     return Report(
         success=True,
         desc=GUS_REPORT,
         metrics=metrics,
-        report=gus_report,
+        report=RawText(gus_report_path),
         benchmark=executable_path,
     )
 
@@ -184,6 +621,10 @@ def gus_sensitivity(
     use_cache: bool,
     debug: bool,
     sensitivity_threshold: float = 0.0,
+    cas_dir: str | None = None,
+    render_pdf: bool = False,
+    scratch_dir: str | None = None,
+    timeout: int = SENS_TIMEOUT,
 ):
     base_name = os.path.basename(executable_path)
     command_list = [
@@ -196,25 +637,69 @@ def gus_sensitivity(
         l3_size,
         "--kernel",
         kernel,
-        executable_path,
+        os.path.abspath(executable_path),
         "-s",
-        "--pdf-out",
-        "/tmp/out.pdf",
     ]
-    if use_cache and os.path.exists(sens_report_path):
-        f = open(sens_report_path, "r")
-        sens_report = f.read()
-        f.close()
-    else:
-        res = command.execute(
-            command_list,
-            target_file=sens_report_path,
-            timeout=SENS_TIMEOUT,
-            debug=debug
+    pdf_path = f"{sens_report_path}.pdf"
+    store = None
+    if cas_dir:
+        store = Store(cas_dir, debug)
+        # The binary is not part of the key. The PDF, if any, is stored
+        # apart from the report.
+        key = key_of(" ".join(command_list[:-2] + ["-s"]), [executable_path])
+        pdf_key = key_of(
+            " ".join(command_list[:-2] + ["-s", "--pdf-out"]), [executable_path]
         )
+    # A cached report without the PDF requested is not enough
+    if not (
+        store and store.fetch(key, sens_report_path) and (
+            not render_pdf or store.fetch(pdf_key, pdf_path)
+        ) or (
+            not store and use_cache and os.path.exists(sens_report_path) and (
+                not render_pdf or os.path.exists(pdf_path)
+            )
+        )
+    ):
+        # Concurrent analyses must not share their output files: each one
+        # works in its own scratch directory, and the PDF is only rendered
+        # on demand
+        with tempfile.TemporaryDirectory(prefix="sens-", dir=scratch_dir) as scratch:
+            if render_pdf:
+                command_list += ["--pdf-out", os.path.join(scratch, "out.pdf")]
+            res = command.execute(
+                command_list,
+                target_file=sens_report_path,
+                capture_output=False,
+                timeout=timeout,
+                debug=debug,
+                cwd=scratch,
+            )
+            if render_pdf and os.path.exists(os.path.join(scratch, "out.pdf")):
+                shutil.move(os.path.join(scratch, "out.pdf"), pdf_path)
         if not res.success:
-            return Report(success=False, desc=SENS_REPORT, benchmark=executable_path)
-        sens_report = res.message
+            return Report(
+                success=False,
+                desc=SENS_REPORT,
+                benchmark=executable_path,
+                timed_out=res.timed_out,
+            )
+        if store:
+            store.store(key, sens_report_path)
+            if render_pdf and os.path.exists(pdf_path):
+                store.store(pdf_key, pdf_path)
+    return sens_report_of(
+        sens_report_path, executable_path, sensitivity_threshold, debug
+    )
+
+
+def sens_report_of(
+    sens_report_path: str,
+    executable_path: str,
+    sensitivity_threshold: float = 0.0,
+    debug: bool = False,
+) -> Report:
+    with open(sens_report_path, "r") as f:
+        sens_report = f.read()
 
     #
     # Remove comments
@@ -248,7 +733,7 @@ def gus_sensitivity(
         desc=SENS_REPORT,
         bottlenecks=bottlenecks,
         metrics=metrics,
-        report=sens_report,
+        report=RawText(sens_report_path),
         benchmark=executable_path,
     )
     return report
@@ -315,18 +800,106 @@ def pocc_compile(
     compiler: str,
     compiler_options: list[str],
     debug: bool,
+    cas_dir: str | None = None,
+    include: list[str] = [],
+    scratch_dir: str | None = None,
 ):
-    return compile(
-        source=source,
-        destination=destination,
-        include=[],
-        compile_with=[],
-        compiler=compiler,
-        compiler_options=compiler_options,
-        linker_options=[],
-        debug=debug,
-        timeout = POCC_TIMEOUT,
-    )
+    store = None
+    if cas_dir:
+        store = Store(cas_dir, debug)
+        # The headers copied along with the source are inputs too
+        key = key_of(
+            " ".join([compiler] + compiler_options),
+            [source] + headers_of([os.path.dirname(source) or "."] + include),
+        )
+        if store.fetch(key, destination):
+            return command.Success(destination)
+    # polycc drops its temporary files in the current directory: each run
+    # works in a private scratch directory holding the source and the headers
+    with tempfile.TemporaryDirectory(prefix="pocc-", dir=scratch_dir) as scratch:
+        for d in [os.path.dirname(source) or "."] + include:
+            for h in os.listdir(d):
+                if h.endswith(".h"):
+                    shutil.copy(os.path.join(d, h), scratch)
+        shutil.copy(source, scratch)
+        output = os.path.basename(destination)
+        res = compile(
+            source=os.path.basename(source),
+            destination=output,
+            include=[],
+            compile_with=[],
+            compiler=compiler,
+            compiler_options=compiler_options,
+            linker_options=[],
+            debug=debug,
+            timeout = POCC_TIMEOUT,
+            cwd=scratch,
+        )
+        # Only the output is moved back
+        if os.path.exists(os.path.join(scratch, output)):
+            shutil.move(os.path.join(scratch, output), destination)
+            if store:
+                store.store(key, destination)
+    return res
+
+
+def compile_library(
+    sources: list[str],
+    destination: str,
+    include: list[str],
+    compiler: str,
+    compiler_options: list[str],
+    debug: bool,
+    timeout: int | None = None,
+    cas_dir: str | None = None,
+    scratch_dir: str | None = None,
+):
+    # The auxiliary sources (e.g. polybench.c) are the same for every
+    # benchmark: they are built once per compiler configuration into a static
+    # library, which the benchmarks are then linked against
+    store = None
+    if cas_dir:
+        store = Store(cas_dir, debug)
+        key = key_of(
+            " ".join([compiler] + compiler_options + ["-c"]),
+            sources + headers_of(include),
+        )
+        if store.fetch(key, destination):
+            return command.Success(destination)
+    # ar would add the objects to an existing archive
+    if os.path.exists(destination):
+        os.remove(destination)
+    inclusions = []
+    for i in include:
+        inclusions += ["-I"] + [i]
+    with tempfile.TemporaryDirectory(prefix="lib-", dir=scratch_dir) as scratch:
+        objects = []
+        for n, source in enumerate(sources):
+            obj = f"{scratch}/{n}.o"
+            command.execute(
+                command_list=[compiler]
+                + compiler_options
+                + inclusions
+                + ["-c", source, "-o", obj],
+                capture_output=False,
+                debug=debug,
+                timeout=timeout,
+            )
+            if not os.path.exists(obj):
+                return command.fail([compiler, "-c", source])
+            objects.append(obj)
+        res = command.execute(
+            command_list=["ar", "rcs", destination] + objects,
+            message_if_success=destination,
+            capture_output=False,
+            debug=debug,
+            timeout=timeout,
+        )
+    if not os.path.exists(destination):
+        return command.fail(["ar", "rcs", destination])
+    if store:
+        store.store(key, destination)
+    return res
 
 
 def compile(
@@ -339,8 +912,24 @@ def compile(
     linker_options: list[str],
     debug: bool,
     timeout: int | None = None,
+    cas_dir: str | None = None,
+    cwd: str | None = None,
 ):
 
+    # Keyed by the contents of the inputs and the command without its paths
+    store = None
+    if cas_dir:
+        store = Store(cas_dir, debug)
+        key = key_of(
+            " ".join([compiler] + compiler_options + linker_options),
+            [source] + compile_with + headers_of(include),
+        )
+        if store.fetch(key, destination):
+            return command.Success(destination)
+        # The exit status of the compiler is not checked: a failure must not
+        # leave an old artifact behind
+        if os.path.exists(destination):
+            os.remove(destination)
     inclusions = []
     for i in include:
         inclusions += ["-I"] + [i]
@@ -359,5 +948,8 @@ def compile(
         capture_output=False,
         debug=debug,
         timeout=timeout,
+        cwd=cwd,
     )
+    if store and res.success and os.path.exists(destination):
+        store.store(key, destination)
     return res